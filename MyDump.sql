@@ -49,8 +49,11 @@ CREATE TABLE `images` (
   `filename` varchar(255) NOT NULL,
   `mime_type` varchar(100) NOT NULL,
   `recipe_id` int NOT NULL,
+  `content_hash` varchar(64) DEFAULT NULL,
+  `variants` varchar(255) DEFAULT NULL,
   PRIMARY KEY (`id`),
   KEY `recipe_id` (`recipe_id`),
+  KEY `ix_images_content_hash` (`content_hash`),
   CONSTRAINT `images_ibfk_1` FOREIGN KEY (`recipe_id`) REFERENCES `recipes` (`id`) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
@@ -64,6 +67,42 @@ LOCK TABLES `images` WRITE;
 /*!40000 ALTER TABLE `images` ENABLE KEYS */;
 UNLOCK TABLES;
 
+--
+-- Table structure for table `jobs`
+--
+
+DROP TABLE IF EXISTS `jobs`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `jobs` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `kind` varchar(50) NOT NULL,
+  `payload` json NOT NULL,
+  `idempotency_key` varchar(191) DEFAULT NULL,
+  `status` varchar(20) NOT NULL,
+  `attempts` int NOT NULL,
+  `max_attempts` int NOT NULL,
+  `run_at` datetime NOT NULL,
+  `locked_by` varchar(100) DEFAULT NULL,
+  `locked_at` datetime DEFAULT NULL,
+  `last_error` text,
+  `created_at` datetime NOT NULL,
+  `finished_at` datetime DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `idempotency_key` (`idempotency_key`),
+  KEY `ix_jobs_status_run_at` (`status`,`run_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Dumping data for table `jobs`
+--
+
+LOCK TABLES `jobs` WRITE;
+/*!40000 ALTER TABLE `jobs` DISABLE KEYS */;
+/*!40000 ALTER TABLE `jobs` ENABLE KEYS */;
+UNLOCK TABLES;
+
 --
 -- Table structure for table `recipes`
 --
@@ -75,14 +114,22 @@ CREATE TABLE `recipes` (
   `id` int NOT NULL AUTO_INCREMENT,
   `title` varchar(255) NOT NULL,
   `description` text NOT NULL,
+  `description_html` text,
   `cooking_time` int NOT NULL,
   `servings` int NOT NULL,
   `ingredients` text NOT NULL,
+  `ingredients_html` text,
   `steps` text NOT NULL,
+  `steps_html` text,
   `user_id` int NOT NULL,
   `created_at` datetime DEFAULT NULL,
+  `updated_at` datetime DEFAULT NULL,
+  `rating_sum` int NOT NULL DEFAULT '0',
+  `rating_count` int NOT NULL DEFAULT '0',
   PRIMARY KEY (`id`),
   KEY `user_id` (`user_id`),
+  KEY `ix_recipes_created_at_id` (`created_at`,`id`),
+  FULLTEXT KEY `ft_recipes_search` (`title`,`ingredients`,`steps`),
   CONSTRAINT `recipes_ibfk_1` FOREIGN KEY (`user_id`) REFERENCES `users` (`id`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
@@ -109,6 +156,7 @@ CREATE TABLE `reviews` (
   `user_id` int NOT NULL,
   `rating` int NOT NULL,
   `text` text NOT NULL,
+  `text_html` text,
   `created_at` datetime NOT NULL,
   PRIMARY KEY (`id`),
   KEY `user_id` (`user_id`),
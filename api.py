@@ -0,0 +1,186 @@
+import json
+from functools import wraps
+
+from flask import Blueprint, Response, abort, jsonify, request, stream_with_context, url_for
+from flask_login import current_user
+from sqlalchemy.orm import selectinload
+
+from models import db, Dish, Feedback
+from pagination import paginate_keyset
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+# Размер пачки при потоковой выдаче NDJSON: один запрос на пачку и на каждую связь
+STREAM_BATCH = 500
+
+RECIPE_FIELDS = {
+    'id', 'title', 'cooking_time', 'servings', 'rating_avg', 'rating_count', 'created_at', 'updated_at',
+    'author', 'cover_photo', 'photos', 'description', 'ingredients', 'steps',
+    'description_html', 'ingredients_html', 'steps_html',
+}
+RECIPE_LIST_DEFAULT = ['id', 'title', 'cooking_time', 'servings', 'rating_avg', 'rating_count', 'author', 'cover_photo', 'created_at']
+RECIPE_DETAIL_DEFAULT = sorted(RECIPE_FIELDS - {'cover_photo'})
+REVIEW_FIELDS = {'id', 'rating', 'text', 'text_html', 'author', 'created_at'}
+REVIEW_DEFAULT = ['id', 'rating', 'text_html', 'author', 'created_at']
+
+
+def api_login_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return jsonify(error='Требуется аутентификация'), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@api.errorhandler(400)
+@api.errorhandler(404)
+def json_error(error):
+    return jsonify(error=error.description), error.code
+
+
+def requested_fields(allowed, default):
+    """Поля из параметра ?fields=a,b; неизвестные поля — ошибка 400."""
+    raw = request.args.get('fields')
+    if not raw:
+        return list(default)
+    fields = [field.strip() for field in raw.split(',') if field.strip()]
+    unknown = sorted(set(fields) - allowed)
+    if unknown:
+        abort(400, description=f'Неизвестные поля: {", ".join(unknown)}')
+    return fields
+
+
+def requested_limit():
+    limit = request.args.get('limit', DEFAULT_LIMIT, type=int)
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def wants_ndjson():
+    return request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson'
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def author_to_dict(account):
+    if account is None:
+        return None
+    return {'id': account.id, 'first_name': account.first_name, 'last_name': account.last_name}
+
+
+def photo_to_dict(photo):
+    if photo is None:
+        return None
+    return {
+        'id': photo.id,
+        'url': url_for('dishes.uploaded_photo', filename=photo.filename),
+        'mime_type': photo.mime_type,
+        'variants': {
+            name: url_for('dishes.uploaded_photo', filename=photo.variant_filename(name))
+            for name in (photo.variants or '').split(',') if name
+        },
+    }
+
+
+def recipe_to_dict(dish, fields):
+    result = {}
+    for field in fields:
+        if field == 'author':
+            result[field] = author_to_dict(dish.author)
+        elif field == 'cover_photo':
+            result[field] = photo_to_dict(dish.cover_photo)
+        elif field == 'photos':
+            result[field] = [photo_to_dict(photo) for photo in dish.photos]
+        elif field in ('created_at', 'updated_at'):
+            result[field] = _isoformat(getattr(dish, field))
+        elif field == 'rating_avg':
+            result[field] = round(dish.rating_avg, 2)
+        else:
+            result[field] = getattr(dish, field)
+    return result
+
+
+def review_to_dict(feedback, fields):
+    result = {}
+    for field in fields:
+        if field == 'author':
+            result[field] = author_to_dict(feedback.author)
+        elif field == 'created_at':
+            result[field] = _isoformat(feedback.created_at)
+        else:
+            result[field] = getattr(feedback, field)
+    return result
+
+
+def recipe_load_options(fields):
+    """Пакетная подгрузка только тех связей, которые попали в ответ."""
+    relations = {'author': Dish.author, 'cover_photo': Dish.cover_photo, 'photos': Dish.photos}
+    return [selectinload(relation) for name, relation in relations.items() if name in fields]
+
+
+def stream_ndjson(query, columns, cursor, serialize):
+    """Выдаёт весь список построчно, читая его пачками по ключу."""
+    def generate():
+        next_cursor = cursor
+        while True:
+            page = paginate_keyset(query, columns, next_cursor, per_page=STREAM_BATCH)
+            for item in page.items:
+                yield json.dumps(serialize(item), ensure_ascii=False) + '\n'
+            if not page.has_next:
+                break
+            next_cursor = page.next_cursor
+            # Уже отданные объекты не должны копиться в сессии
+            db.session.expunge_all()
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def page_response(page, serialize):
+    return jsonify(
+        items=[serialize(item) for item in page.items],
+        next_cursor=page.next_cursor,
+        prev_cursor=page.prev_cursor,
+    )
+
+
+@api.route('/recipes')
+@api_login_required
+def list_recipes():
+    fields = requested_fields(RECIPE_FIELDS, RECIPE_LIST_DEFAULT)
+    query = Dish.query.options(*recipe_load_options(fields))
+    columns = [Dish.created_at, Dish.id]
+    cursor = request.args.get('cursor')
+    serialize = lambda dish: recipe_to_dict(dish, fields)
+    if wants_ndjson():
+        return stream_ndjson(query, columns, cursor, serialize)
+    return page_response(paginate_keyset(query, columns, cursor, per_page=requested_limit()), serialize)
+
+
+@api.route('/recipes/<int:id>')
+@api_login_required
+def get_recipe(id):
+    fields = requested_fields(RECIPE_FIELDS, RECIPE_DETAIL_DEFAULT)
+    dish = Dish.query.options(*recipe_load_options(fields)).filter_by(id=id).first()
+    if dish is None:
+        abort(404, description='Блюдо не найдено')
+    return jsonify(recipe_to_dict(dish, fields))
+
+
+@api.route('/recipes/<int:id>/reviews')
+@api_login_required
+def list_reviews(id):
+    fields = requested_fields(REVIEW_FIELDS, REVIEW_DEFAULT)
+    if db.session.get(Dish, id) is None:
+        abort(404, description='Блюдо не найдено')
+    query = Feedback.query.filter_by(recipe_id=id)
+    if 'author' in fields:
+        query = query.options(selectinload(Feedback.author))
+    columns = [Feedback.created_at, Feedback.id]
+    cursor = request.args.get('cursor')
+    serialize = lambda feedback: review_to_dict(feedback, fields)
+    if wants_ndjson():
+        return stream_ndjson(query, columns, cursor, serialize)
+    return page_response(paginate_keyset(query, columns, cursor, per_page=requested_limit()), serialize)
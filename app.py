@@ -1,271 +1,229 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
-from flask_migrate import Migrate
+from flask import Blueprint, Flask, abort, current_app, jsonify, request
+import hmac
 import os
-from sqlalchemy import func
-import bleach
-from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from werkzeug.security import check_password_hash, generate_password_hash
+import click
+from sqlalchemy import text
 from dotenv import load_dotenv
-import pymysql
 import logging
 
-from models import db, Dish, Account, Photo, Feedback, UserRole
-from forms import DishForm, FeedbackForm, AuthForm, RegisterForm
-from markupsafe import Markup
-import markdown
-
-pymysql.install_as_MySQLdb()
-
-load_dotenv()
-
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = os.getenv('SQLALCHEMY_TRACK_MODIFICATIONS', 'False').lower() == 'true'
-app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER')
-
-required_env_vars = ['FLASK_SECRET_KEY', 'DATABASE_URL', 'UPLOAD_FOLDER']
-missing_vars = [var for var in required_env_vars if not os.getenv(var)]
-if missing_vars:
-    raise RuntimeError(f'Отсутствуют обязательные переменные окружения: {", ".join(missing_vars)}')
-
-db.init_app(app)
-migrate = Migrate(app, db)
-
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
-# Настройка логирования
-logging.basicConfig(filename='app.log', level=logging.ERROR, format='%(asctime)s %(levelname)s %(message)s')
-
-login_manager = LoginManager(app)
-login_manager.login_view = 'login_view'
-login_manager.login_message = 'Для выполнения данного действия необходимо пройти процедуру аутентификации'
-login_manager.login_message_category = 'warning'
-
-@login_manager.user_loader
-def load_account(account_id):
-    return db.session.get(Account, int(account_id))
-
-def save_photos(photo_files, recipe_id):
-    """Сохраняет фотографии блюда и добавляет записи в БД."""
-    for photo in photo_files:
-        if photo.filename:
-            filename = photo.filename
-            mime_type = photo.mimetype
-            path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            photo.save(path)
-            photo_obj = Photo(filename=filename, mime_type=mime_type, recipe_id=recipe_id)
-            db.session.add(photo_obj)
-    db.session.commit()
-
-def is_dish_name_unique(name):
-    return not Dish.query.filter_by(title=name).first()
-
-def can_edit_or_delete_recipe(dish, user):
-    is_admin = user.role and user.role.name == 'Администратор'
-    return is_admin or dish.user_id == user.id
-
-@app.route('/')
-@login_required
-def home():
-    page = request.args.get('page', 1, type=int)
-    per_page = 10
-    dishes_query = (
-        db.session.query(
-            Dish,
-            func.coalesce(func.avg(Feedback.rating), 0).label('avg_score'),
-            func.count(Feedback.id).label('feedbacks_count')
-        )
-        .outerjoin(Feedback, Feedback.recipe_id == Dish.id)
-        .group_by(Dish.id)
-        .order_by(Dish.created_at.desc())
-    )
-    pagination = dishes_query.paginate(page=page, per_page=per_page, error_out=False)
-    dishes = pagination.items
-    return render_template('index.html', recipes=dishes, pagination=pagination)
-
-@app.route('/create-dish', methods=['GET', 'POST'])
-@login_required
-def create_dish():
-    form = DishForm()
-    if form.validate_on_submit():
-        if not is_dish_name_unique(form.title.data):
-            flash('Блюдо с таким названием уже существует.', 'danger')
-            return render_template('add_recipe.html', form=form)
-        description = bleach.clean(form.description.data)
-        ingredients = bleach.clean(form.ingredients.data)
-        steps = bleach.clean(form.steps.data)
-        dish = Dish(
-            title=form.title.data,
-            description=description,
-            cooking_time=form.cooking_time.data,
-            servings=form.servings.data,
-            ingredients=ingredients,
-            steps=steps,
-            user_id=current_user.id
+from models import db
+from fragments import fragment_cache
+from transfer import import_data_command, export_data_command
+from api import api
+from assets import assets_cli, init_assets
+from compression import compression
+from metrics import metrics, profile_command
+from identity import identity_cache
+from jobs import init_jobs, jobs_cli
+from similarity import similarity_cli
+from replicas import REPLICA_BIND
+from auth import auth, login_manager
+from dishes import dishes
+from reviews import reviews
+
+bp = Blueprint('main', __name__, cli_group=None)
+bp.cli.add_command(import_data_command)
+bp.cli.add_command(export_data_command)
+bp.cli.add_command(profile_command)
+bp.cli.add_command(jobs_cli)
+bp.cli.add_command(similarity_cli)
+bp.cli.add_command(assets_cli)
+
+# Обязательные параметры: ключ конфигурации и переменная окружения, из которой он берётся
+REQUIRED_SETTINGS = {
+    'SECRET_KEY': 'FLASK_SECRET_KEY',
+    'SQLALCHEMY_DATABASE_URI': 'DATABASE_URL',
+    'UPLOAD_FOLDER': 'UPLOAD_FOLDER',
+}
+
+
+def env_flag(name, default='False'):
+    return os.getenv(name, default).lower() == 'true'
+
+
+def engine_options(config, url=None):
+    """Параметры пула соединений SQLAlchemy (для основной БД или url реплики).
+
+    pool_recycle должен быть меньше wait_timeout MySQL, иначе сервер закрывает
+    простаивающие соединения раньше пула; pool_pre_ping отбрасывает уже закрытые.
+    """
+    options = {
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+    }
+    # SQLite в тестах работает со StaticPool, у которого нет размеров пула
+    if not (url or config['SQLALCHEMY_DATABASE_URI']).startswith('sqlite'):
+        options.update(
+            pool_size=config['DB_POOL_SIZE'],
+            max_overflow=config['DB_MAX_OVERFLOW'],
+            pool_timeout=config['DB_POOL_TIMEOUT'],
         )
-        try:
-            db.session.add(dish)
-            db.session.commit()
-            if form.photos.data:
-                save_photos(form.photos.data, dish.id)
-            flash('Блюдо успешно добавлено!', 'success')
-            return redirect(url_for('home'))
-        except Exception as e:
-            db.session.rollback()
-            logging.error(f'Ошибка при добавлении блюда: {e}')
-            flash('Ошибка при сохранении блюда. Проверьте корректность данных.', 'danger')
-            return render_template('add_recipe.html', form=form)
-    return render_template('add_recipe.html', form=form)
-
-@app.route('/edit-dish/<int:id>', methods=['GET', 'POST'])
-@login_required
-def edit_dish(id):
-    dish = Dish.query.get_or_404(id)
-    if not can_edit_or_delete_recipe(dish, current_user):
-        flash('У вас недостаточно прав для редактирования этого блюда', 'danger')
-        return redirect(url_for('home'))
-    form = DishForm(obj=dish)
-    if form.validate_on_submit():
-        dish.title = form.title.data
-        dish.description = form.description.data
-        dish.cooking_time = form.cooking_time.data
-        dish.servings = form.servings.data
-        dish.ingredients = form.ingredients.data
-        dish.steps = form.steps.data
-        try:
-            db.session.commit()
-            flash('Блюдо успешно обновлено!', 'success')
-            return redirect(url_for('home'))
-        except Exception as e:
-            db.session.rollback()
-            logging.error(f'Ошибка при обновлении блюда: {e}')
-            flash('Ошибка при обновлении блюда.', 'danger')
-    return render_template('edit_recipe.html', form=form, recipe=dish)
-
-@app.route('/dish/<int:id>')
-@login_required
-def view_dish(id):
-    dish = Dish.query.get_or_404(id)
-    photos = Photo.query.filter_by(recipe_id=dish.id).all()
-    feedbacks = Feedback.query.filter_by(recipe_id=dish.id).all()
-    details_html = Markup(markdown.markdown(dish.description, extensions=['extra']))
-    components_html = Markup(markdown.markdown(dish.ingredients, extensions=['extra']))
-    instructions_html = Markup(markdown.markdown(dish.steps, extensions=['extra']))
-    return render_template(
-        'view_recipe.html',
-        recipe=dish,
-        images=photos,
-        description_html=details_html,
-        ingredients_html=components_html,
-        steps_html=instructions_html,
-        reviews=feedbacks
-    )
-
-@app.route('/delete-dish/<int:id>', methods=['POST'])
-@login_required
-def delete_dish(id):
-    dish = Dish.query.get_or_404(id)
-    if not can_edit_or_delete_recipe(dish, current_user):
-        flash('У вас недостаточно прав для удаления этого блюда', 'danger')
-        return redirect(url_for('home'))
+    return options
+
+
+def create_app(config=None):
+    """Создаёт приложение; config переопределяет значения из окружения."""
+    load_dotenv()
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY')
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
+    # Реплика для чтений в GET-запросах; без неё всё идёт в DATABASE_URL
+    app.config['REPLICA_DATABASE_URL'] = os.getenv('REPLICA_DATABASE_URL')
+    # Сколько секунд после своей записи пользователь читает из основной БД (запас на отставание реплики)
+    app.config['REPLICA_PIN_SECONDS'] = float(os.getenv('REPLICA_PIN_SECONDS', 5))
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = env_flag('SQLALCHEMY_TRACK_MODIFICATIONS')
+    app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER')
+    app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', 5))
+    app.config['DB_MAX_OVERFLOW'] = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    app.config['DB_POOL_TIMEOUT'] = int(os.getenv('DB_POOL_TIMEOUT', 30))
+    app.config['DB_POOL_RECYCLE'] = int(os.getenv('DB_POOL_RECYCLE', 280))
+    app.config['DB_POOL_PRE_PING'] = env_flag('DB_POOL_PRE_PING', 'True')
+    # thread — пул потоков в процессе приложения, inline — сразу в запросе, external — только flask jobs work
+    app.config['JOB_RUNNER'] = os.getenv('JOB_RUNNER', 'thread')
+    app.config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', 2))
+    app.config['JOB_MAX_ATTEMPTS'] = int(os.getenv('JOB_MAX_ATTEMPTS', 5))
+    app.config['JOB_RETRY_DELAY'] = int(os.getenv('JOB_RETRY_DELAY', 10))
+    app.config['JOB_LOCK_TIMEOUT'] = int(os.getenv('JOB_LOCK_TIMEOUT', 300))
+    # Как часто планировщик процесса (JOB_RUNNER=thread) запускает повторы и очистку, секунды
+    app.config['JOB_POLL_INTERVAL'] = int(os.getenv('JOB_POLL_INTERVAL', 30))
+    app.config['JOB_RETENTION'] = int(os.getenv('JOB_RETENTION', 7 * 24 * 3600))
+    app.config['UPLOAD_GRACE_SECONDS'] = int(os.getenv('UPLOAD_GRACE_SECONDS', 3600))
+    app.config['SWEEP_INTERVAL'] = int(os.getenv('SWEEP_INTERVAL', 3600))
+    # Сброс кеша после записи должны видеть все воркеры gunicorn и процесс flask jobs work,
+    # поэтому по умолчанию кеш файловый; memory годится только для одного процесса
+    app.config['FRAGMENT_CACHE_BACKEND'] = os.getenv('FRAGMENT_CACHE_BACKEND', 'filesystem')
+    app.config['FRAGMENT_CACHE_DIR'] = os.getenv('FRAGMENT_CACHE_DIR', os.path.join(app.instance_path, 'fragments'))
+    app.config['FRAGMENT_CACHE_SIZE'] = int(os.getenv('FRAGMENT_CACHE_SIZE', 1000))
+    # Предел устаревания фрагмента, если сброс до процесса не дошёл (другая машина, кеш в памяти)
+    app.config['FRAGMENT_CACHE_TIMEOUT'] = int(os.getenv('FRAGMENT_CACHE_TIMEOUT', 300))
+    app.config['FEED_APPROX_TOTAL'] = env_flag('FEED_APPROX_TOTAL')
+    app.config['FEED_TOTAL_TTL'] = int(os.getenv('FEED_TOTAL_TTL', 300))
+    app.config['IDENTITY_CACHE_TTL'] = int(os.getenv('IDENTITY_CACHE_TTL', 30))
+    app.config['SLOW_REQUEST_SECONDS'] = float(os.getenv('SLOW_REQUEST_SECONDS', 1.0))
+    # Токен Prometheus для /metrics (Authorization: Bearer ...); без него эндпоинт отключён
+    app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+    app.config['PROFILE_ENDPOINT'] = os.getenv('PROFILE_ENDPOINT')
+    app.config['PROFILE_DIR'] = os.getenv('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+    # Ответы меньше порога не сжимаются: выигрыш меньше накладных расходов
+    app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE', 500))
+    app.config['COMPRESS_LEVEL'] = int(os.getenv('COMPRESS_LEVEL', 6))
+    app.config['COMPRESS_BROTLI_LEVEL'] = int(os.getenv('COMPRESS_BROTLI_LEVEL', 5))
+    # Журнал ошибок; пустое значение оставляет настройку логирования вызывающему (тесты, gunicorn)
+    app.config['LOG_FILE'] = os.getenv('LOG_FILE', 'app.log')
+    if config:
+        app.config.update(config)
+
+    missing_vars = [env for key, env in REQUIRED_SETTINGS.items() if not app.config.get(key)]
+    if missing_vars:
+        raise RuntimeError(f'Отсутствуют обязательные переменные окружения: {", ".join(missing_vars)}')
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+    replica_url = app.config['REPLICA_DATABASE_URL']
+    if replica_url:
+        app.config.setdefault('SQLALCHEMY_BINDS', {})[REPLICA_BIND] = {
+            'url': replica_url, **engine_options(app.config, replica_url),
+        }
+
+    if any(url and url.startswith('mysql://') for url in (app.config['SQLALCHEMY_DATABASE_URI'], replica_url)):
+        # URL без драйвера использует MySQLdb; его заменяет pymysql, который нужен только таким приложениям
+        import pymysql
+        pymysql.install_as_MySQLdb()
+
+    db.init_app(app)
+    app.cli.add_command(MigrateCommands('db', help='Миграции схемы БД (Flask-Migrate).'))
+    fragment_cache.init_app(app)
+    # Сжатие регистрируется первым, поэтому выполняется последним из after_request
+    compression.init_app(app)
+    metrics.init_app(app)
+    identity_cache.init_app(app)
+    login_manager.init_app(app)
+    init_jobs(app)
+    app.register_blueprint(bp)
+    app.register_blueprint(auth)
+    app.register_blueprint(dishes)
+    app.register_blueprint(reviews)
+    app.register_blueprint(api)
+    init_assets(app)
+    # Каталог загрузок создаётся перед сохранением первого файла (storage.store_upload)
+    init_logging(app.config['LOG_FILE'])
+    return app
+
+
+def init_logging(filename):
+    """Пишет ошибки в filename; файл открывается при первой записи, пустое имя отключает журнал."""
+    root = logging.getLogger()
+    if not filename or root.handlers:
+        return
+    handler = logging.FileHandler(filename, encoding='utf-8', delay=True)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    root.addHandler(handler)
+    root.setLevel(logging.ERROR)
+
+
+def init_migrate(app):
+    """Подключает Flask-Migrate: вместе с alembic это заметная доля времени импорта приложения."""
+    from flask_migrate import Migrate
+
+    Migrate(app, db)
+
+
+class MigrateCommands(click.Group):
+    """Группа flask db, которая загружает Flask-Migrate только при вызове её команд."""
+
+    def _commands(self):
+        if 'migrate' not in current_app.extensions:
+            init_migrate(current_app)
+        from flask_migrate.cli import db as db_cli_group
+        return db_cli_group
+
+    def list_commands(self, ctx):
+        return self._commands().list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self._commands().get_command(ctx, name)
+
+@bp.route('/health')
+def health():
+    """Проверка для балансировщика и оркестратора: доступность БД и состояние пула."""
+    pool = db.engine.pool
+    pool_state = {'class': type(pool).__name__, 'status': pool.status()}
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        if hasattr(pool, name):
+            pool_state[name] = getattr(pool, name)()
     try:
-        for photo in dish.photos:
-            photo_path = os.path.join(app.config['UPLOAD_FOLDER'], photo.filename)
-            if os.path.exists(photo_path):
-                os.remove(photo_path)
-        db.session.delete(dish)
-        db.session.commit()
-        flash('Блюдо успешно удалено!', 'success')
+        db.session.execute(text('SELECT 1'))
     except Exception as e:
         db.session.rollback()
-        logging.error(f'Ошибка при удалении блюда: {e}')
-        flash('Ошибка при удалении блюда.', 'danger')
-    return redirect(url_for('home'))
-
-@app.route('/dish/<int:dish_id>/add-feedback', methods=['GET', 'POST'])
-@login_required
-def add_feedback(dish_id):
-    dish = Dish.query.get_or_404(dish_id)
-    form = FeedbackForm()
-    user_id = current_user.id
-    existing_feedback = Feedback.query.filter_by(recipe_id=dish_id, user_id=user_id).first()
-    if existing_feedback:
-        flash('Вы уже оставляли отзыв на это блюдо.', 'warning')
-        return redirect(url_for('view_dish', id=dish_id))
-    if form.validate_on_submit():
-        text = bleach.clean(form.comment.data)
-        feedback = Feedback(
-            recipe_id=dish_id,
-            user_id=user_id,
-            rating=form.rating.data,
-            text=text
-        )
+        logging.error(f'Проверка состояния: БД недоступна: {e}')
+        return jsonify(status='error', database='unavailable', pool=pool_state), 503
+    status = 'ok'
+    replica = None
+    if REPLICA_BIND in db.engines:
         try:
-            db.session.add(feedback)
-            db.session.commit()
-            flash('Отзыв успешно добавлен!', 'success')
-            return redirect(url_for('view_dish', id=dish_id))
+            with db.engines[REPLICA_BIND].connect() as connection:
+                connection.execute(text('SELECT 1'))
+            replica = 'ok'
         except Exception as e:
-            db.session.rollback()
-            logging.error(f'Ошибка при добавлении отзыва: {e}')
-            flash('Ошибка при сохранении отзыва.', 'danger')
-    return render_template('add_review.html', form=form, recipe=dish)
-
-@app.template_filter('markdown')
-def markdown_filter(text):
-    return Markup(markdown.markdown(text, extensions=['extra']))
+            logging.error(f'Проверка состояния: реплика недоступна: {e}')
+            replica, status = 'unavailable', 'degraded'
+    if 'size' in pool_state and pool_state['checkedout'] >= pool_state['size'] + current_app.config['DB_MAX_OVERFLOW']:
+        status = 'saturated'
+    state = {'status': status, 'database': 'ok', 'pool': pool_state}
+    if replica:
+        state['replica'] = replica
+    return jsonify(state)
+
+@bp.route('/metrics')
+def prometheus_metrics():
+    """Метрики для Prometheus; доступны только с токеном METRICS_TOKEN."""
+    token = current_app.config['METRICS_TOKEN']
+    if not token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        abort(401)
+    return current_app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
 
-@app.route('/login', methods=['GET', 'POST'])
-def login_view():
-    form = AuthForm()
-    error = None
-    if form.validate_on_submit():
-        account = Account.query.filter_by(username=form.username.data).first()
-        if account and check_password_hash(account.password_hash, form.password.data):
-            login_user(account, remember=form.remember_me.data)
-            return redirect(url_for('home'))
-        else:
-            error = 'Невозможно аутентифицироваться с указанными логином и паролем'
-    return render_template('login.html', form=form, error=error)
 
-@app.route('/logout')
-@login_required
-def logout_view():
-    logout_user()
-    flash('Вы вышли из аккаунта.', 'success')
-    return redirect(url_for('login_view'))
-
-@app.route('/register', methods=['GET', 'POST'])
-def register():
-    form = RegisterForm()
-    # Подгружаем роли для выбора
-    form.role_id.choices = [(role.id, role.name) for role in UserRole.query.all()]
-    error = None
-    if form.validate_on_submit():
-        if Account.query.filter_by(username=form.username.data).first():
-            error = 'Пользователь с таким логином уже существует.'
-        else:
-            new_user = Account(
-                username=form.username.data,
-                password_hash=generate_password_hash(form.password.data),
-                last_name=form.last_name.data,
-                first_name=form.first_name.data,
-                middle_name=form.middle_name.data,
-                role_id=form.role_id.data
-            )
-            try:
-                db.session.add(new_user)
-                db.session.commit()
-                flash('Регистрация успешна! Теперь вы можете войти.', 'success')
-                return redirect(url_for('login_view'))
-            except Exception as e:
-                db.session.rollback()
-                error = 'Ошибка при регистрации пользователя.'
-    return render_template('register.html', form=form, error=error)
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=os.getenv('FLASK_DEBUG', 'False').lower() == 'true') 
-
-
+    create_app().run(host='0.0.0.0', port=port, debug=env_flag('FLASK_DEBUG'))
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import mimetypes
+import os
+
+import click
+from flask import Blueprint, abort, current_app, send_from_directory, url_for
+from flask.cli import with_appcontext
+from werkzeug.security import safe_join
+
+from compression import available_encodings, choose_encoding, compress
+
+# Собранные файлы лежат в static/dist и кешируются клиентом навсегда: имя меняется вместе с содержимым
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+# Расширения, для которых готовятся сжатые копии
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.html'}
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+assets = Blueprint('assets', __name__)
+
+
+def _manifest_path(app):
+    return os.path.join(app.static_folder, DIST, MANIFEST)
+
+
+def load_manifest(app):
+    """Читает манифест сборки (исходное имя -> имя с отпечатком); без сборки он пуст."""
+    try:
+        with open(_manifest_path(app), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    app.extensions['assets'] = manifest
+    return manifest
+
+
+def init_assets(app):
+    load_manifest(app)
+    app.add_template_global(asset_url)
+    app.register_blueprint(assets)
+
+
+def asset_url(filename):
+    """URL статического файла: собранная копия с отпечатком, если она есть, иначе исходный файл."""
+    fingerprinted = current_app.extensions.get('assets', {}).get(filename)
+    if fingerprinted:
+        return url_for('assets.fingerprinted', filename=fingerprinted)
+    return url_for('static', filename=filename)
+
+
+def _source_files(static_folder):
+    for root, dirs, files in os.walk(static_folder):
+        # Собранные копии и пользовательские загрузки не собираются
+        dirs[:] = [d for d in dirs if d not in (DIST, 'uploads')]
+        for name in files:
+            if not name.startswith('.'):
+                path = os.path.join(root, name)
+                yield os.path.relpath(path, static_folder).replace(os.sep, '/'), path
+
+
+def build_assets(app):
+    """Копирует файлы static в static/dist под именами с хешем содержимого и сжимает текстовые.
+
+    Прежние копии не удаляются: страницы, закешированные до выкладки, продолжают их находить.
+    """
+    dist = os.path.join(app.static_folder, DIST)
+    manifest = {}
+    for relpath, path in sorted(_source_files(app.static_folder)):
+        with open(path, 'rb') as f:
+            data = f.read()
+        stem, ext = os.path.splitext(relpath)
+        target = f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+        outputs = {target: data}
+        if ext in COMPRESSIBLE_EXTENSIONS:
+            for encoding in available_encodings():
+                packed = compress(data, encoding, 9, 11)
+                if len(packed) < len(data):
+                    outputs[target + SUFFIXES[encoding]] = packed
+        for name, content in outputs.items():
+            destination = os.path.join(dist, name)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            with open(destination, 'wb') as f:
+                f.write(content)
+        manifest[relpath] = target
+    os.makedirs(dist, exist_ok=True)
+    tmp_path = _manifest_path(app) + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, _manifest_path(app))
+    app.extensions['assets'] = manifest
+    return manifest
+
+
+@assets.route('/static/dist/<path:filename>')
+def fingerprinted(filename):
+    """Собранный файл в лучшей из заранее сжатых кодировок, которую принимает клиент."""
+    dist = os.path.join(current_app.static_folder, DIST)
+    path = safe_join(dist, filename)
+    if path is None:
+        abort(404)
+    offered = [encoding for encoding in available_encodings() if os.path.isfile(path + SUFFIXES[encoding])]
+    encoding = choose_encoding(offered) if offered else None
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = send_from_directory(
+        dist, filename + SUFFIXES[encoding] if encoding else filename,
+        mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE,
+    )
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if offered:
+        response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@click.group('assets')
+def assets_cli():
+    """Сборка статических файлов."""
+
+
+@assets_cli.command('build')
+@with_appcontext
+def build_command():
+    """Собирает static в static/dist: отпечатки в именах, gzip и Brotli копии, манифест."""
+    manifest = build_assets(current_app)
+    click.echo(f'Собрано файлов: {len(manifest)}.')
@@ -0,0 +1,69 @@
+from flask import Blueprint, flash, redirect, render_template, url_for
+from flask_login import LoginManager, current_user, login_required, login_user, logout_user
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from forms import AuthForm, RegisterForm
+from identity import identity_cache
+from models import db, Account
+
+auth = Blueprint('auth', __name__)
+
+login_manager = LoginManager()
+login_manager.login_view = 'auth.login_view'
+login_manager.login_message = 'Для выполнения данного действия необходимо пройти процедуру аутентификации'
+login_manager.login_message_category = 'warning'
+
+
+@login_manager.user_loader
+def load_account(account_id):
+    # Пользователь и роль берутся из кеша, обычный запрос страницы не обращается к users и roles
+    return identity_cache.account(int(account_id))
+
+@auth.route('/login', methods=['GET', 'POST'])
+def login_view():
+    form = AuthForm()
+    error = None
+    if form.validate_on_submit():
+        account = Account.query.filter_by(username=form.username.data).first()
+        if account and check_password_hash(account.password_hash, form.password.data):
+            login_user(account, remember=form.remember_me.data)
+            return redirect(url_for('dishes.home'))
+        else:
+            error = 'Невозможно аутентифицироваться с указанными логином и паролем'
+    return render_template('login.html', form=form, error=error)
+
+@auth.route('/logout')
+@login_required
+def logout_view():
+    identity_cache.forget(current_user.id)
+    logout_user()
+    flash('Вы вышли из аккаунта.', 'success')
+    return redirect(url_for('auth.login_view'))
+
+@auth.route('/register', methods=['GET', 'POST'])
+def register():
+    form = RegisterForm()
+    # Роли для выбора берутся из кеша, а не из БД на каждый запрос
+    form.role_id.choices = identity_cache.role_choices()
+    error = None
+    if form.validate_on_submit():
+        if Account.query.filter_by(username=form.username.data).first():
+            error = 'Пользователь с таким логином уже существует.'
+        else:
+            new_user = Account(
+                username=form.username.data,
+                password_hash=generate_password_hash(form.password.data),
+                last_name=form.last_name.data,
+                first_name=form.first_name.data,
+                middle_name=form.middle_name.data,
+                role_id=form.role_id.data
+            )
+            try:
+                db.session.add(new_user)
+                db.session.commit()
+                flash('Регистрация успешна! Теперь вы можете войти.', 'success')
+                return redirect(url_for('auth.login_view'))
+            except Exception as e:
+                db.session.rollback()
+                error = 'Ошибка при регистрации пользователя.'
+    return render_template('register.html', form=form, error=error)
@@ -0,0 +1,82 @@
+"""Сравнение двух прогонов бенчмарков.
+
+    python -m benchmarks.compare results/base.json results/new.json --threshold 0.15
+
+Регрессией считается рост p50 или p95 больше чем на threshold, рост среднего
+числа SQL-запросов на запрос в последовательных прогонах маршрутов больше чем
+на MIN_QUERY_DELTA или загрузка при запуске модуля, который раньше загружался
+лениво (отчёты benchmarks.startup). В нагрузочном прогоне число запросов
+зависит от того, какие запросы попали на холодный кеш, и только выводится. При регрессии команда завершается с кодом 1, что
+позволяет использовать её в CI.
+"""
+import argparse
+import json
+import sys
+
+LATENCY_KEYS = ('p50_ms', 'p95_ms')
+# Изменения быстрее этого порога считаются шумом таймера
+MIN_DELTA_MS = 0.5
+# Допустимый рост среднего числа SQL-запросов: промахи кеша в начале прогона
+MIN_QUERY_DELTA = 0.5
+
+
+def _sections(results):
+    sections = {f'route {name}': stats for name, stats in results.get('routes', {}).items()}
+    if 'load' in results:
+        sections['load'] = results['load']
+        for name, stats in results['load'].get('routes', {}).items():
+            sections[f'load {name}'] = stats
+    for name in ('import', 'create_app', 'total'):
+        if name in results.get('startup', {}):
+            sections[f'startup {name}'] = results['startup'][name]
+    return sections
+
+
+def compare(baseline, current, threshold=0.1):
+    """Возвращает (строки отчёта, список регрессий)."""
+    lines, regressions = [], []
+    old_sections, new_sections = _sections(baseline), _sections(current)
+    for name, new in new_sections.items():
+        old = old_sections.get(name)
+        if old is None:
+            lines.append(f'{name}: новый раздел')
+            continue
+        parts = []
+        for key in LATENCY_KEYS:
+            before, after = old[key], new[key]
+            change = (after - before) / before if before else 0.0
+            parts.append(f'{key} {before:.2f} → {after:.2f} ({change:+.0%})')
+            if change > threshold and after - before > MIN_DELTA_MS:
+                regressions.append(f'{name}: {key} вырос на {change:.0%}')
+        if 'queries_per_request' in new:
+            before, after = old['queries_per_request'], new['queries_per_request']
+            parts.append(f'запросов {before} → {after}')
+            if not name.startswith('load') and after - before > MIN_QUERY_DELTA:
+                regressions.append(f'{name}: SQL-запросов на запрос стало {after} вместо {before}')
+        lines.append(f'{name}: ' + ', '.join(parts))
+    if 'startup' in baseline and 'startup' in current:
+        eager = set(current['startup']['lazy_modules_loaded']) - set(baseline['startup']['lazy_modules_loaded'])
+        if eager:
+            regressions.append(f'startup: при запуске загружаются {", ".join(sorted(eager))}')
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Допустимый относительный рост перцентилей.')
+    args = parser.parse_args()
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, encoding='utf-8') as f:
+        current = json.load(f)
+    lines, regressions = compare(baseline, current, args.threshold)
+    print('\n'.join(lines))
+    if regressions:
+        print('\nРегрессии:\n' + '\n'.join(f'  {item}' for item in regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""Генератор синтетических данных для бенчмарков.
+
+    python -m benchmarks.datagen --users 20000 --recipes 100000 --reviews 2000000
+
+При одинаковом --seed получается одинаковый набор данных. Строки вставляются
+пакетами через executemany, агрегаты оценок считаются заранее, поисковый индекс
+заполняется теми же пакетами.
+"""
+import argparse
+import hashlib
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert, select
+from werkzeug.security import generate_password_hash
+
+from models import db, Account, Dish, Feedback, Photo, RatingBucket, UserRole
+from rendering import process_markdown
+from search import index_rows
+
+PASSWORD = 'bench'
+BASE_TIME = datetime(2024, 1, 1)
+WORDS = [
+    'свекла', 'капуста', 'морковь', 'лук', 'чеснок', 'картофель', 'говядина', 'курица', 'сметана',
+    'укроп', 'петрушка', 'томат', 'перец', 'рис', 'гречка', 'мука', 'яйцо', 'молоко', 'сыр', 'грибы',
+    'тыква', 'фасоль', 'горох', 'лимон', 'мед', 'орехи', 'яблоко', 'творог', 'масло', 'соль',
+]
+# Текстов меньше, чем блюд: Markdown рендерится один раз на шаблон, а не на строку
+TEXT_VARIANTS = 64
+
+
+def _texts(rng):
+    texts = []
+    for _ in range(TEXT_VARIANTS):
+        ingredients = '\n'.join(f'* {word} — {rng.randint(1, 500)} г' for word in rng.sample(WORDS, 6))
+        steps = '\n'.join(f'{n}. {" ".join(rng.sample(WORDS, 4))}' for n in range(1, 6))
+        description = f'**{rng.choice(WORDS).capitalize()}** и {rng.choice(WORDS)} по-домашнему.'
+        texts.append({
+            'description': process_markdown(description),
+            'ingredients': process_markdown(ingredients),
+            'steps': process_markdown(steps),
+        })
+    return texts
+
+
+def _ensure_roles():
+    if db.session.scalar(select(func.count(UserRole.id))):
+        return
+    db.session.add_all([
+        UserRole(id=1, name='Администратор', description='Админ'),
+        UserRole(id=2, name='Пользователь', description='Обычный пользователь'),
+    ])
+    db.session.commit()
+
+
+def _next_id(model):
+    return (db.session.scalar(select(func.max(model.id))) or 0) + 1
+
+
+def generate_users(count, batch_size, prefix='user'):
+    """Пользователи prefix<N> с паролем PASSWORD; возвращает список их id."""
+    _ensure_roles()
+    password_hash = generate_password_hash(PASSWORD)
+    first_id = _next_id(Account)
+    ids = list(range(first_id, first_id + count))
+    for start in range(0, count, batch_size):
+        db.session.execute(insert(Account), [
+            {'id': account_id, 'username': f'{prefix}{account_id}', 'password_hash': password_hash,
+             'last_name': 'Тестов', 'first_name': f'Повар {account_id}', 'role_id': 2}
+            for account_id in ids[start:start + batch_size]
+        ])
+        db.session.commit()
+    return ids
+
+
+def generate_recipes(count, user_ids, reviews, photos_per_recipe, batch_size, rng):
+    """Блюда с отзывами и фотографиями; возвращает (блюд, отзывов, фото)."""
+    texts = _texts(rng)
+    first_id = _next_id(Dish)
+    reviews_per_recipe = reviews / count if count else 0
+    review_count = photo_count = 0
+    for start in range(0, count, batch_size):
+        dishes, feedback, photos, buckets = [], [], [], []
+        for dish_id in range(first_id + start, first_id + min(start + batch_size, count)):
+            created_at = BASE_TIME + timedelta(minutes=dish_id)
+            # Популярность распределена неравномерно: у части блюд отзывов в разы больше среднего
+            wanted = min(len(user_ids), int(rng.expovariate(1 / reviews_per_recipe))) if reviews_per_recipe else 0
+            ratings = [min(5, max(1, round(rng.gauss(4, 1)))) for _ in range(wanted)]
+            for user_id, rating in zip(rng.sample(user_ids, wanted), ratings):
+                text, text_html = process_markdown(f'{rng.choice(WORDS).capitalize()}, оценка {rating}')
+                feedback.append({
+                    'recipe_id': dish_id, 'user_id': user_id, 'rating': rating, 'text': text,
+                    'text_html': text_html, 'created_at': created_at + timedelta(hours=len(feedback) % 72),
+                })
+            buckets.extend({'recipe_id': dish_id, 'rating': rating, 'count': ratings.count(rating)}
+                           for rating in sorted(set(ratings)))
+            variant = rng.choice(texts)
+            dishes.append({
+                'id': dish_id, 'title': f'{rng.choice(WORDS).capitalize()} №{dish_id}',
+                'description': variant['description'][0], 'description_html': variant['description'][1],
+                'ingredients': variant['ingredients'][0], 'ingredients_html': variant['ingredients'][1],
+                'steps': variant['steps'][0], 'steps_html': variant['steps'][1],
+                'cooking_time': rng.randint(5, 240), 'servings': rng.randint(1, 8),
+                'user_id': rng.choice(user_ids), 'created_at': created_at, 'updated_at': created_at,
+                'rating_sum': sum(ratings), 'rating_count': len(ratings),
+            })
+            for n in range(rng.randint(0, photos_per_recipe)):
+                digest = hashlib.sha256(f'{dish_id}-{n}'.encode()).hexdigest()
+                photos.append({
+                    'recipe_id': dish_id, 'filename': f'{digest[:2]}/{digest[2:4]}/{digest}.jpg',
+                    'mime_type': 'image/jpeg', 'content_hash': digest,
+                    'variants': 'card,card.webp,detail,detail.webp',
+                })
+        db.session.execute(insert(Dish), dishes)
+        index_rows([{key: dish[key] for key in ('id', 'title', 'ingredients', 'steps')} for dish in dishes])
+        if feedback:
+            db.session.execute(insert(Feedback), feedback)
+            db.session.execute(insert(RatingBucket), buckets)
+        if photos:
+            db.session.execute(insert(Photo), photos)
+        db.session.commit()
+        review_count += len(feedback)
+        photo_count += len(photos)
+    return count, review_count, photo_count
+
+
+def generate(users, recipes, reviews, photos_per_recipe=3, seed=42, batch_size=1000):
+    """Заполняет базу текущего приложения; возвращает размеры получившегося набора."""
+    rng = random.Random(seed)
+    user_ids = generate_users(users, batch_size)
+    recipes, reviews, photos = generate_recipes(recipes, user_ids, reviews, photos_per_recipe, batch_size, rng)
+    return {'users': users, 'recipes': recipes, 'reviews': reviews, 'photos': photos, 'seed': seed}
+
+
+def main():
+    from benchmarks.run import bench_app
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', help='URL базы; по умолчанию DATABASE_URL.')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--recipes', type=int, default=10000)
+    parser.add_argument('--reviews', type=int, default=100000)
+    parser.add_argument('--photos-per-recipe', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+    app = bench_app(args.database)
+    with app.app_context():
+        db.create_all()
+        sizes = generate(args.users, args.recipes, args.reviews, args.photos_per_recipe, args.seed, args.batch_size)
+    print(sizes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+"""Микро-бенчмарки маршрутов и нагрузочный прогон через тестовый клиент Flask.
+
+    python -m benchmarks.run --generate --recipes 100000 --reviews 2000000 -o results/base.json
+    python -m benchmarks.run -o results/new.json
+    python -m benchmarks.compare results/base.json results/new.json
+
+Для каждого маршрута считаются перцентили времени ответа и число SQL-запросов
+на запрос. Нагрузочный прогон запускает --concurrency потоков, каждый со своим
+клиентом и пользователем, на смеси маршрутов с весами из LOAD_MIX.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import event, func, select
+
+from benchmarks.datagen import PASSWORD, WORDS, generate, generate_users
+from models import db, Dish
+from pagination import encode_cursor
+
+DEFAULT_DATABASE = 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'recipes-bench.sqlite')
+# Доли маршрутов в нагрузочном прогоне
+LOAD_MIX = {'home': 30, 'home_deep': 10, 'view_dish': 40, 'search': 10, 'api_recipes': 5, 'add_feedback': 5}
+
+
+def bench_app(database=None, cache='memory'):
+    """Приложение для бенчмарков: без CSRF, с обработкой фото в потоке запроса."""
+    database = database or os.getenv('DATABASE_URL') or DEFAULT_DATABASE
+    os.environ.setdefault('FLASK_SECRET_KEY', 'bench')
+    os.environ.setdefault('UPLOAD_FOLDER', os.path.join(tempfile.gettempdir(), 'recipes-bench-uploads'))
+    os.environ['DATABASE_URL'] = database
+    from app import create_app
+
+    return create_app({
+        'SQLALCHEMY_DATABASE_URI': database,
+        'WTF_CSRF_ENABLED': False,
+        'JOB_RUNNER': 'inline',
+        'FRAGMENT_CACHE_BACKEND': cache,
+        'SLOW_REQUEST_SECONDS': float('inf'),
+    })
+
+
+class QueryCounter:
+    """Считает SQL-запросы, выполненные в текущем потоке."""
+
+    def __init__(self, engine):
+        self._local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def take(self):
+        count = getattr(self._local, 'count', 0)
+        self._local.count = 0
+        return count
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(timings, queries, errors=0, elapsed=None):
+    result = {
+        'requests': len(timings),
+        'errors': errors,
+        'p50_ms': round(percentile(timings, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(timings, 0.99) * 1000, 3),
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3) if timings else 0.0,
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else 0.0,
+    }
+    if elapsed:
+        result['requests_per_second'] = round(len(timings) / elapsed, 1)
+    return result
+
+
+class Worker:
+    """Клиент одного пользователя; маршруты выбирают блюда из своего генератора случайных чисел."""
+
+    def __init__(self, app, username, dish_ids, deep_cursor, seed):
+        self.client = app.test_client()
+        self.dish_ids = dish_ids
+        self.deep_cursor = deep_cursor
+        self.rng = random.Random(seed)
+        # Отзыв на блюдо можно оставить один раз, поэтому блюда для отзывов идут по порядку
+        self._unreviewed = iter(self.rng.sample(dish_ids, len(dish_ids)))
+        rv = self.client.post('/login', data={'username': username, 'password': PASSWORD})
+        if rv.status_code != 302:
+            raise RuntimeError(f'Не удалось войти как {username}')
+
+    def request(self, route):
+        if route == 'home':
+            return self.client.get('/')
+        if route == 'home_deep':
+            return self.client.get('/', query_string={'cursor': self.deep_cursor})
+        if route == 'view_dish':
+            return self.client.get(f'/dish/{self.rng.choice(self.dish_ids)}')
+        if route == 'search':
+            return self.client.get('/search', query_string={'q': self.rng.choice(WORDS)})
+        if route == 'api_recipes':
+            return self.client.get('/api/v1/recipes?limit=20')
+        if route == 'add_feedback':
+            dish_id = next(self._unreviewed)
+            return self.client.post(f'/dish/{dish_id}/add-feedback', data={'rating': self.rng.randint(1, 5), 'comment': 'Бенчмарк'})
+        raise ValueError(route)
+
+
+def run_route(worker, counter, route, iterations, warmup):
+    for _ in range(warmup):
+        worker.request(route)
+    counter.take()
+    timings, queries, errors = [], [], 0
+    for _ in range(iterations):
+        start = time.perf_counter()
+        rv = worker.request(route)
+        timings.append(time.perf_counter() - start)
+        queries.append(counter.take())
+        errors += rv.status_code >= 400
+    return summarize(timings, queries, errors)
+
+
+def run_load(workers, counter, duration):
+    routes, weights = zip(*LOAD_MIX.items())
+    deadline = time.perf_counter() + duration
+    lock = threading.Lock()
+    timings, queries, per_route = [], [], {route: ([], []) for route in routes}
+    errors = [0]
+
+    def drive(worker):
+        counter.take()
+        while time.perf_counter() < deadline:
+            route = worker.rng.choices(routes, weights)[0]
+            start = time.perf_counter()
+            try:
+                failed = worker.request(route).status_code >= 400
+            except StopIteration:
+                continue
+            except Exception:
+                failed = True
+            elapsed = time.perf_counter() - start
+            count = counter.take()
+            with lock:
+                timings.append(elapsed)
+                queries.append(count)
+                per_route[route][0].append(elapsed)
+                per_route[route][1].append(count)
+                errors[0] += failed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(workers)) as pool:
+        list(pool.map(drive, workers))
+    elapsed = time.perf_counter() - start
+    result = summarize(timings, queries, errors[0], elapsed)
+    result['concurrency'] = len(workers)
+    result['routes'] = {route: summarize(*values) for route, values in per_route.items() if values[0]}
+    return result
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _deep_cursor(total):
+    """Курсор на середину ленты: проверяет, что глубокие страницы не дороже первой."""
+    row = db.session.execute(
+        select(Dish.created_at, Dish.id).order_by(Dish.created_at.desc(), Dish.id.desc()).offset(total // 2).limit(1)
+    ).first()
+    return encode_cursor('next', list(row)) if row else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', help='URL базы; по умолчанию DATABASE_URL или временный файл SQLite.')
+    parser.add_argument('--generate', action='store_true', help='Пересоздать схему и сгенерировать данные.')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--recipes', type=int, default=10000)
+    parser.add_argument('--reviews', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--cache', choices=['memory', 'none'], default='memory', help='Кеш фрагментов.')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--routes', default=','.join(LOAD_MIX), help='Маршруты микро-бенчмарков через запятую.')
+    parser.add_argument('--concurrency', type=int, default=8, help='0 — без нагрузочного прогона.')
+    parser.add_argument('--duration', type=float, default=10.0, help='Длительность нагрузочного прогона, с.')
+    parser.add_argument('--output', '-o', help='Файл JSON с результатами; по умолчанию stdout.')
+    args = parser.parse_args()
+
+    app = bench_app(args.database, args.cache)
+    with app.app_context():
+        if args.generate:
+            db.drop_all()
+            db.create_all()
+            dataset = generate(args.users, args.recipes, args.reviews, seed=args.seed)
+        else:
+            dataset = {'recipes': db.session.scalar(select(func.count(Dish.id))), 'seed': args.seed}
+        dish_ids = list(db.session.scalars(select(Dish.id)))
+        if not dish_ids:
+            parser.error('база пуста, запустите с --generate')
+        deep_cursor = _deep_cursor(len(dish_ids))
+        # Свои пользователи у каждого прогона: у них ещё нет отзывов
+        prefix = f'bench{int(time.time())}-'
+        usernames = [f'{prefix}{user_id}' for user_id in generate_users(args.concurrency + 1, 1000, prefix=prefix)]
+        counter = QueryCounter(db.engine)
+
+        results = {
+            'meta': {
+                'revision': _git_revision(),
+                'started_at': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'database': db.engine.dialect.name,
+                'cache': args.cache,
+                'dataset': dataset,
+            },
+            'routes': {},
+        }
+        worker = Worker(app, usernames[0], dish_ids, deep_cursor, args.seed)
+        for route in args.routes.split(','):
+            results['routes'][route] = run_route(worker, counter, route, args.iterations, args.warmup)
+            print(f'{route}: {results["routes"][route]}', flush=True)
+        if args.concurrency:
+            workers = [
+                Worker(app, username, dish_ids, deep_cursor, args.seed + n)
+                for n, username in enumerate(usernames[1:], start=1)
+            ]
+            results['load'] = run_load(workers, counter, args.duration)
+            print(f'load: {results["load"]}', flush=True)
+
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Время запуска процесса приложения: импорт app и create_app() в чистом интерпретаторе.
+
+    python -m benchmarks.startup --runs 20 -o results/startup.json
+    python -m benchmarks.startup --importtime 15
+
+Каждый прогон — отдельный процесс, как у воркера gunicorn без preload или
+процесса pytest-xdist. В отчёт попадают перцентили времени и тяжёлые модули,
+загруженные при запуске, хотя нужны только отдельным командам и задачам.
+Результат сравнивается с прошлым прогоном через benchmarks.compare.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.run import percentile, _git_revision
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Модули, которые приложение загружает только при первом использовании
+LAZY_MODULES = ('markdown', 'bleach', 'pymysql', 'PIL.Image', 'flask_migrate', 'alembic')
+
+PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+print(json.dumps({
+    'import': imported - started,
+    'create_app': created - imported,
+    'loaded': [name for name in %r if name in sys.modules],
+}))
+''' % (LAZY_MODULES,)
+
+
+def probe_env(upload_folder):
+    """Окружение прогона: минимальная конфигурация без обращения к реальной БД."""
+    env = dict(os.environ)
+    env.update({
+        'FLASK_SECRET_KEY': 'startup',
+        'DATABASE_URL': env.get('DATABASE_URL', 'sqlite://'),
+        'UPLOAD_FOLDER': upload_folder,
+        'LOG_FILE': '',
+        'PYTHONDONTWRITEBYTECODE': '1',
+    })
+    return env
+
+
+def probe(upload_folder, python_args=()):
+    result = subprocess.run(
+        [sys.executable, *python_args, '-c', PROBE], cwd=ROOT, env=probe_env(upload_folder),
+        capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.splitlines()[-1]), result.stderr
+
+
+def _timings(values):
+    return {
+        'runs': len(values),
+        'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(values, 0.95) * 1000, 3),
+    }
+
+
+def measure_startup(runs=10):
+    """Перцентили времени импорта и create_app() по runs отдельным процессам."""
+    timings = {'import': [], 'create_app': [], 'total': []}
+    loaded = set()
+    with tempfile.TemporaryDirectory() as tmp:
+        for _ in range(runs):
+            sample, _ = probe(os.path.join(tmp, 'uploads'))
+            timings['import'].append(sample['import'])
+            timings['create_app'].append(sample['create_app'])
+            timings['total'].append(sample['import'] + sample['create_app'])
+            loaded.update(sample['loaded'])
+    return {
+        **{name: _timings(values) for name, values in timings.items()},
+        'lazy_modules_loaded': sorted(loaded),
+    }
+
+
+def heaviest_imports(limit=15):
+    """Модули с наибольшим суммарным временем импорта по -X importtime (мс)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        _, stderr = probe(os.path.join(tmp, 'uploads'), ['-X', 'importtime'])
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        rows.append((int(cumulative) / 1000, name.strip()))
+    # Время пакета включает время его подмодулей, поэтому цепочка импорта видна целиком
+    return [{'module': name, 'cumulative_ms': round(ms, 1)} for ms, name in sorted(rows, reverse=True)[:limit]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10, help='Число запусков в отдельных процессах.')
+    parser.add_argument('--importtime', type=int, default=0, metavar='N',
+                        help='Добавить в отчёт N модулей с наибольшим временем импорта.')
+    parser.add_argument('--output', '-o', help='Файл JSON с результатами; по умолчанию stdout.')
+    args = parser.parse_args()
+
+    results = {
+        'meta': {'revision': _git_revision(), 'python': sys.version.split()[0]},
+        'startup': measure_startup(args.runs),
+    }
+    if args.importtime:
+        results['startup']['heaviest_imports'] = heaviest_imports(args.importtime)
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
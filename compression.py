@@ -0,0 +1,80 @@
+import gzip
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # Brotli необязателен: без него ответы сжимаются только gzip
+    brotli = None
+
+# Текстовые типы, которые имеет смысл сжимать; изображения и архивы уже сжаты
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript',
+    'application/json', 'application/x-ndjson', 'image/svg+xml',
+}
+
+
+def available_encodings():
+    """Поддерживаемые кодировки в порядке предпочтения сервера."""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def choose_encoding(offered):
+    """Лучшая из offered по Accept-Encoding клиента; при равном q — первая в offered."""
+    accepted = request.accept_encodings
+    best, best_quality = None, 0
+    for encoding in offered:
+        quality = accepted.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data, encoding, level=6, brotli_level=5):
+    if encoding == 'br':
+        return brotli.compress(data, quality=brotli_level)
+    # mtime=0: одинаковое содержимое даёт одинаковые байты (и ETag собранных файлов)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+class Compression:
+    """Сжатие ответов приложения gzip или Brotli в after_request.
+
+    Сжимаются только готовые (не потоковые) ответы текстовых типов размером от
+    COMPRESS_MIN_SIZE байт. Файлы из send_file и собранные ассеты уже отдаются
+    как есть или в заранее сжатом виде.
+    """
+
+    def init_app(self, app):
+        app.after_request(self._after_request)
+        app.extensions['compression'] = self
+
+    def _should_compress(self, response, min_size):
+        if response.status_code < 200 or response.status_code in (204, 206, 304):
+            return False
+        if response.direct_passthrough or response.is_streamed:
+            return False
+        if 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+            return False
+        if response.cache_control.no_transform:
+            return False
+        return (response.content_length or 0) >= min_size
+
+    def _after_request(self, response):
+        config = current_app.config
+        if not self._should_compress(response, config['COMPRESS_MIN_SIZE']):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(available_encodings())
+        if encoding is None:
+            return response
+        response.set_data(compress(response.get_data(), encoding, config['COMPRESS_LEVEL'], config['COMPRESS_BROTLI_LEVEL']))
+        response.headers['Content-Encoding'] = encoding
+        # Сжатое представление побайтно отличается от исходного: валидатор становится слабым
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+
+compression = Compression()
@@ -0,0 +1,317 @@
+import logging
+import os
+
+import click
+from flask import Blueprint, abort, current_app, flash, redirect, render_template, request, send_from_directory, url_for
+from flask_login import current_user, login_required
+from markupsafe import Markup
+from sqlalchemy import or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
+
+from forms import DishForm, RATING_CHOICES
+from fragments import fragment_cache
+from httpcache import conditional, page_etag
+from images import generate_variants
+from jobs import dispatch, enqueue
+from models import db, Dish, Feedback, Photo, RatingBucket
+from pagination import approximate_total, paginate_keyset
+from rendering import apply_markdown, rendered
+from replicas import has_replica, is_pinned, reads_from_replica
+from reviews import reviews_page
+from search import index_dish, reindex_all, search_dishes, unindex_dish
+from similarity import similar_dishes
+from storage import is_blob_path, store_upload
+
+dishes = Blueprint('dishes', __name__, cli_group=None)
+
+
+def save_photos(photo_files, recipe_id):
+    """Сохраняет файлы фотографий блюда и добавляет записи в текущую транзакцию.
+
+    Файлы хранятся по хешу содержимого, одинаковые загрузки — один файл на диске.
+    Уменьшенные копии создаются фоновыми задачами после коммита.
+    """
+    saved = []
+    for photo in photo_files:
+        if photo.filename:
+            content_hash, filename = store_upload(photo)
+            photo_obj = Photo(filename=filename, mime_type=photo.mimetype, recipe_id=recipe_id, content_hash=content_hash)
+            twin = Photo.query.filter(Photo.content_hash == content_hash, Photo.variants.isnot(None)).first()
+            if twin:
+                photo_obj.variants = twin.variants
+            else:
+                saved.append(photo_obj)
+            db.session.add(photo_obj)
+    Dish.touch(recipe_id)
+    db.session.flush()
+    for photo_obj in saved:
+        enqueue('generate_variants', key=f'variants:{photo_obj.id}', photo_id=photo_obj.id)
+
+def is_dish_name_unique(name, exclude_id=None):
+    # Проверка по уникальному индексу uq_recipes_title, без чтения строки блюда
+    query = select(Dish.id).where(Dish.title == name)
+    if exclude_id is not None:
+        query = query.where(Dish.id != exclude_id)
+    return db.session.scalar(query.limit(1)) is None
+
+def can_edit_or_delete_recipe(dish, user):
+    is_admin = user.role and user.role.name == 'Администратор'
+    return is_admin or dish.user_id == user.id
+
+@dishes.route('/')
+@login_required
+def home():
+    cursor = request.args.get('cursor')
+    per_page = 10
+    # Средняя оценка и число отзывов хранятся в самой таблице recipes
+    # Авторы и обложки подгружаются пакетно, по одному запросу на связь
+    dishes_query = Dish.query.options(selectinload(Dish.author), selectinload(Dish.cover_photo))
+    page = paginate_keyset(dishes_query, [Dish.created_at, Dish.id], cursor, per_page=per_page)
+    approx_total = None
+    if current_app.config['FEED_APPROX_TOTAL']:
+        approx_total = approximate_total(Dish, ttl=current_app.config['FEED_TOTAL_TTL'])
+    # Валидатор строится по строкам страницы, рендеринг при 304 не выполняется
+    state = [(dish.id, dish.modified_at) for dish in page.items]
+    etag = page_etag('home', state, page.next_cursor, page.prev_cursor, approx_total)
+    last_modified = max((modified for _, modified in state if modified), default=None)
+    return conditional(etag, last_modified, lambda: render_template(
+        'index.html', feed_html=render_feed(page, cursor, approx_total)
+    ))
+
+def cached_fragment(key, render):
+    """Фрагмент из кеша с учётом отставания реплики.
+
+    Фрагменты, собранные по данным реплики, живут не дольше окна закрепления, а
+    пользователь, закреплённый за основной БД, не читает их и перезаписывает своими.
+    """
+    if not has_replica():
+        return fragment_cache.get_or_render(key, render)
+    if reads_from_replica():
+        return fragment_cache.get_or_render(key, render, timeout=max(current_app.config['REPLICA_PIN_SECONDS'], 1))
+    return fragment_cache.get_or_render(key, render, refresh=is_pinned())
+
+def render_card(dish):
+    return cached_fragment(
+        fragment_cache.card_key(dish.id),
+        lambda: Markup(render_template('fragments/recipe_card.html', recipe=dish))
+    )
+
+def render_feed(page, cursor, approx_total):
+    """Страница ленты из кеша; карточки переиспользуются между страницами."""
+    return cached_fragment(
+        fragment_cache.feed_key(cursor or '', approx_total),
+        lambda: Markup(render_template(
+            'fragments/feed.html',
+            cards=[render_card(dish) for dish in page.items],
+            page=page,
+            approx_total=approx_total
+        ))
+    )
+
+@dishes.route('/create-dish', methods=['GET', 'POST'])
+@login_required
+def create_dish():
+    form = DishForm()
+    if form.validate_on_submit():
+        if not is_dish_name_unique(form.title.data):
+            flash('Блюдо с таким названием уже существует.', 'danger')
+            return render_template('add_recipe.html', form=form)
+        dish = Dish(
+            title=form.title.data,
+            cooking_time=form.cooking_time.data,
+            servings=form.servings.data,
+            user_id=current_user.id
+        )
+        # Markdown очищается и рендерится один раз, при записи
+        for field in ('description', 'ingredients', 'steps'):
+            apply_markdown(dish, field, getattr(form, field).data)
+        try:
+            db.session.add(dish)
+            db.session.flush()
+            index_dish(dish)
+            if form.photos.data:
+                save_photos(form.photos.data, dish.id)
+            enqueue('invalidate_dish', dish_id=dish.id)
+            enqueue('update_similarity', key=f'similarity:{dish.id}', dish_id=dish.id)
+            db.session.commit()
+            dispatch()
+            flash('Блюдо успешно добавлено!', 'success')
+            return redirect(url_for('dishes.home'))
+        except IntegrityError:
+            # Блюдо с тем же названием успели сохранить между проверкой и коммитом
+            db.session.rollback()
+            flash('Блюдо с таким названием уже существует.', 'danger')
+            return render_template('add_recipe.html', form=form)
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f'Ошибка при добавлении блюда: {e}')
+            flash('Ошибка при сохранении блюда. Проверьте корректность данных.', 'danger')
+            return render_template('add_recipe.html', form=form)
+    return render_template('add_recipe.html', form=form)
+
+@dishes.route('/edit-dish/<int:id>', methods=['GET', 'POST'])
+@login_required
+def edit_dish(id):
+    dish = Dish.query.get_or_404(id)
+    if not can_edit_or_delete_recipe(dish, current_user):
+        flash('У вас недостаточно прав для редактирования этого блюда', 'danger')
+        return redirect(url_for('dishes.home'))
+    form = DishForm(obj=dish)
+    if form.validate_on_submit():
+        if not is_dish_name_unique(form.title.data, exclude_id=dish.id):
+            flash('Блюдо с таким названием уже существует.', 'danger')
+            return render_template('edit_recipe.html', form=form, recipe=dish)
+        old_title, old_ingredients = dish.title, dish.ingredients
+        dish.title = form.title.data
+        dish.cooking_time = form.cooking_time.data
+        dish.servings = form.servings.data
+        for field in ('description', 'ingredients', 'steps'):
+            apply_markdown(dish, field, getattr(form, field).data)
+        try:
+            index_dish(dish)
+            enqueue('invalidate_dish', dish_id=dish.id)
+            # Название блюда выводится в списках соседей других блюд: пересчёт обновляет и их страницы
+            if dish.ingredients != old_ingredients or dish.title != old_title:
+                enqueue('update_similarity', key=f'similarity:{dish.id}', dish_id=dish.id)
+            db.session.commit()
+            dispatch()
+            flash('Блюдо успешно обновлено!', 'success')
+            return redirect(url_for('dishes.home'))
+        except IntegrityError:
+            db.session.rollback()
+            flash('Блюдо с таким названием уже существует.', 'danger')
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f'Ошибка при обновлении блюда: {e}')
+            flash('Ошибка при обновлении блюда.', 'danger')
+    return render_template('edit_recipe.html', form=form, recipe=dish)
+
+@dishes.route('/dish/<int:id>')
+@login_required
+def view_dish(id):
+    # Дешёвая проверка актуальности до загрузки блюда, отзывов и рендеринга
+    modified_at = Dish.last_modified(id)
+    if modified_at is None:
+        abort(404)
+    cursor = request.args.get('reviews')
+    return conditional(page_etag('dish', id, modified_at, cursor), modified_at, lambda: render_dish(id, cursor))
+
+def render_dish(id, reviews_cursor=None):
+    dish = (
+        Dish.query.options(joinedload(Dish.author), selectinload(Dish.photos))
+        .filter_by(id=id)
+        .first_or_404()
+    )
+    photos = dish.photos
+    # Свой отзыв ищется по уникальному индексу (recipe_id, user_id), а не среди всех отзывов
+    user_feedback = db.session.scalars(
+        select(Feedback).where(Feedback.recipe_id == id, Feedback.user_id == current_user.id)
+    ).first()
+    details_html = rendered(dish, 'description')
+    components_html = rendered(dish, 'ingredients')
+    instructions_html = rendered(dish, 'steps')
+    return render_template(
+        'view_recipe.html',
+        recipe=dish,
+        images=photos,
+        description_html=details_html,
+        ingredients_html=components_html,
+        steps_html=instructions_html,
+        reviews=reviews_page(id, reviews_cursor),
+        user_feedback=user_feedback,
+        histogram=RatingBucket.histogram(id) if dish.rating_count else {},
+        similar=similar_dishes(id),
+        rating_choices=RATING_CHOICES,
+    )
+
+@dishes.route('/search')
+@login_required
+def search():
+    query = request.args.get('q', '').strip()
+    page = search_dishes(query, request.args.get('cursor')) if query else None
+    return render_template('search.html', query=query, page=page)
+
+@dishes.route('/delete-dish/<int:id>', methods=['POST'])
+@login_required
+def delete_dish(id):
+    dish = Dish.query.get_or_404(id)
+    if not can_edit_or_delete_recipe(dish, current_user):
+        flash('У вас недостаточно прав для удаления этого блюда', 'danger')
+        return redirect(url_for('dishes.home'))
+    try:
+        photos = [(photo.content_hash, [photo.filename] + photo.variant_filenames()) for photo in dish.photos]
+        unindex_dish(dish.id)
+        db.session.delete(dish)
+        # Файлы удаляются после коммита и только вместе с последней ссылкой на содержимое
+        enqueue('remove_photo_files', photos=photos)
+        enqueue('invalidate_dish', dish_id=id)
+        # Блюдо уходит из индекса похожих и из списков соседей других блюд
+        enqueue('update_similarity', key=f'similarity:{id}', dish_id=id)
+        db.session.commit()
+        dispatch()
+        flash('Блюдо успешно удалено!', 'success')
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f'Ошибка при удалении блюда: {e}')
+        flash('Ошибка при удалении блюда.', 'danger')
+    return redirect(url_for('dishes.home'))
+
+@dishes.route('/uploads/<path:filename>')
+def uploaded_photo(filename):
+    response = send_from_directory(current_app.config['UPLOAD_FOLDER'], filename)
+    if is_blob_path(filename):
+        # Содержимое по такому адресу никогда не меняется, ETag — хеш из имени файла
+        response.set_etag(os.path.basename(filename).split('.')[0])
+        response.make_conditional(request)
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.public = True
+        response.cache_control.max_age = 3600
+    return response
+
+@dishes.cli.command('reindex-search')
+@click.option('--batch-size', default=1000, show_default=True, help='Число блюд в одной транзакции.')
+def reindex_search_command(batch_size):
+    """Перестраивает полнотекстовый индекс блюд."""
+    total = reindex_all(batch_size)
+    db.session.commit()
+    click.echo(f'Проиндексировано блюд: {total}.')
+
+@dishes.cli.command('generate-variants')
+@click.option('--force', is_flag=True, help='Пересоздать варианты и для уже обработанных фото.')
+def generate_variants_command(force):
+    """Создаёт уменьшенные копии для ранее загруженных фотографий."""
+    query = select(Photo.id).order_by(Photo.id)
+    if not force:
+        query = query.where(Photo.variants.is_(None))
+    photo_ids = db.session.scalars(query).all()
+    processed = sum(1 for photo_id in photo_ids if generate_variants(photo_id))
+    click.echo(f'Обработано фотографий: {processed} из {len(photo_ids)}.')
+
+@dishes.cli.command('render-markdown')
+@click.option('--batch-size', default=500, show_default=True, help='Число строк в одной транзакции.')
+def render_markdown_command(batch_size):
+    """Сохраняет готовый HTML для блюд и отзывов, записанных без него."""
+    targets = [
+        (Dish, ('description', 'ingredients', 'steps')),
+        (Feedback, ('text',)),
+    ]
+    for model, fields in targets:
+        missing = or_(*[getattr(model, f'{field}_html').is_(None) for field in fields])
+        while True:
+            rows = model.query.filter(missing).order_by(model.id).limit(batch_size).all()
+            if not rows:
+                break
+            for row in rows:
+                for field in fields:
+                    if getattr(row, f'{field}_html') is None:
+                        apply_markdown(row, field, getattr(row, field))
+            db.session.commit()
+    click.echo('HTML для Markdown-полей сохранён.')
+
+@dishes.app_template_filter('rendered')
+def rendered_filter(obj, field):
+    return rendered(obj, field)
@@ -14,20 +14,18 @@ class DishForm(FlaskForm):
     photos = MultipleFileField('Фотографии')
 
 
+RATING_CHOICES = [
+    (5, 'отлично'),
+    (4, 'хорошо'),
+    (3, 'удовлетворительно'),
+    (2, 'неудовлетворительно'),
+    (1, 'плохо'),
+    (0, 'ужасно')
+]
+
+
 class FeedbackForm(FlaskForm):
-    rating = SelectField(
-        'Оценка',
-        choices=[
-            (5, 'отлично'),
-            (4, 'хорошо'),
-            (3, 'удовлетворительно'),
-            (2, 'неудовлетворительно'),
-            (1, 'плохо'),
-            (0, 'ужасно')
-        ],
-        coerce=int,
-        default=5
-    )
+    rating = SelectField('Оценка', choices=RATING_CHOICES, coerce=int, default=5)
     comment = TextAreaField('Текст отзыва', validators=[DataRequired()])
 
 
@@ -0,0 +1,217 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class NullBackend:
+    """Ничего не хранит: кеширование выключено."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, timeout=0):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+class MemoryBackend:
+    """LRU в памяти процесса, ограниченный числом записей.
+
+    Сбросы из других процессов сюда не доходят: записи устаревают только по таймауту.
+    """
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires and expires < time.time():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=0):
+        with self._lock:
+            self._items[key] = (time.time() + timeout if timeout else 0, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class FileSystemBackend:
+    """Файловый кеш, общий для всех воркеров на одной машине.
+
+    Запись атомарна (временный файл + os.replace). Размер проверяется не при
+    каждой записи, а раз в cull_every записей процесса (по умолчанию десятая
+    часть maxsize): обход каталога стоит O(n). Тогда удаляются самые старые
+    файлы сверх maxsize и ещё десятая часть. Каталог создаётся при первой записи.
+    """
+
+    def __init__(self, directory, maxsize=1000, cull_every=None):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.cull_every = cull_every or max(1, maxsize // 10)
+        self._writes = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                expires, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires and expires < time.time():
+            self.delete(key)
+            return None
+        return value
+
+    def set(self, key, value, timeout=0):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((time.time() + timeout if timeout else 0, value), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(key))
+        self._writes += 1
+        if self._writes % self.cull_every == 0:
+            self._cull()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _entries(self):
+        try:
+            return [entry for entry in os.scandir(self.directory) if not entry.name.startswith('.')]
+        except FileNotFoundError:
+            return []
+
+    def _cull(self):
+        entries = self._entries()
+        if len(entries) <= self.maxsize:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.maxsize + max(1, self.maxsize // 10)]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        for entry in self._entries():
+            os.remove(entry.path)
+
+    def __len__(self):
+        return len(self._entries())
+
+
+class FragmentCache:
+    """Кеш отрендеренных фрагментов страниц со счётчиками попаданий.
+
+    Карточка блюда хранится под ключом card:<id> и удаляется при изменении блюда.
+    Страницы ленты включают в ключ поколение ленты, которое меняется при любом
+    изменении, затрагивающем ленту, поэтому устаревшие страницы просто перестают читаться.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else NullBackend()
+        self.timeout = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        kind = app.config.get('FRAGMENT_CACHE_BACKEND', 'memory')
+        size = app.config.get('FRAGMENT_CACHE_SIZE', 1000)
+        if kind == 'filesystem':
+            self.backend = FileSystemBackend(app.config['FRAGMENT_CACHE_DIR'], size)
+        elif kind == 'memory':
+            self.backend = MemoryBackend(size)
+        else:
+            self.backend = NullBackend()
+        self.timeout = app.config.get('FRAGMENT_CACHE_TIMEOUT', 0)
+        app.extensions['fragment_cache'] = self
+
+    def get_or_render(self, key, render, timeout=None, refresh=False):
+        """Фрагмент из кеша или render(); refresh=True перерисовывает и перезаписывает запись."""
+        value = None if refresh else self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if value is None:
+            value = render()
+            self.backend.set(key, value, self.timeout if timeout is None else timeout)
+        return value
+
+    def feed_generation(self):
+        generation = self.backend.get('feed:generation')
+        if generation is None:
+            generation = uuid.uuid4().hex
+            self.backend.set('feed:generation', generation)
+        return generation
+
+    def feed_key(self, *parts):
+        return ':'.join(['feed', self.feed_generation()] + [str(part) for part in parts])
+
+    def card_key(self, dish_id):
+        return f'card:{dish_id}'
+
+    def invalidate_feed(self):
+        self.backend.set('feed:generation', uuid.uuid4().hex)
+
+    def invalidate_dish(self, dish_id):
+        self.backend.delete(self.card_key(dish_id))
+        self.invalidate_feed()
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self.hits = self.misses = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+            'entries': len(self.backend),
+        }
+
+
+fragment_cache = FragmentCache()
@@ -0,0 +1,34 @@
+import multiprocessing
+import os
+
+# Все параметры берутся из окружения, значения по умолчанию рассчитаны на один контейнер
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+# Размер пула соединений (DB_POOL_SIZE) не должен быть меньше числа потоков воркера
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+
+# Приложение импортируется один раз в мастере, воркеры получают его через fork.
+# При preload сигнал HUP перезапускает воркеров без перечитывания кода,
+# для выката новой версии используется USR2 + WINCH/QUIT старого мастера.
+preload_app = os.getenv('GUNICORN_PRELOAD', 'True').lower() == 'true'
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+# Периодический перезапуск воркеров ограничивает рост памяти
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    # Соединения, открытые в мастере до fork, не должны разделяться воркерами
+    from wsgi import app
+    from models import db
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
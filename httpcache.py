@@ -0,0 +1,54 @@
+import hashlib
+from datetime import timezone
+
+from flask import make_response, request, session
+from flask_login import current_user
+
+
+def page_etag(*parts):
+    """ETag страницы: состояние данных плюс пользователь, для которого она собрана."""
+    user = (current_user.get_id(), getattr(current_user, 'role_id', None))
+    return hashlib.sha1(repr(parts + user).encode('utf-8')).hexdigest()
+
+
+def _as_utc(moment):
+    if moment is None:
+        return None
+    return moment.replace(microsecond=0, tzinfo=timezone.utc)
+
+
+def is_fresh(etag, last_modified=None):
+    """Совпадает ли закешированная клиентом копия с текущим состоянием страницы."""
+    # Одноразовые flash-сообщения должны попасть в тело ответа
+    if session.get('_flashes'):
+        return False
+    if request.if_none_match:
+        # Слабое сравнение (RFC 9110): сжатый ответ несёт тот же ETag с пометкой W/
+        return request.if_none_match.contains_weak(etag)
+    last_modified = _as_utc(last_modified)
+    if last_modified and request.if_modified_since:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def with_validators(response, etag, last_modified=None):
+    response = make_response(response)
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = _as_utc(last_modified)
+    # Страницы персональные: кешировать только в браузере и всегда перепроверять
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+
+def not_modified(etag, last_modified=None):
+    return with_validators(make_response('', 304), etag, last_modified)
+
+
+def conditional(etag, last_modified, render):
+    """Отвечает 304 без вызова render, если копия клиента актуальна."""
+    if is_fresh(etag, last_modified):
+        return not_modified(etag, last_modified)
+    return with_validators(render(), etag, last_modified)
@@ -0,0 +1,115 @@
+import threading
+import time
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models import db, Account, UserRole
+
+ACCOUNT_COLUMNS = [column.key for column in Account.__table__.columns]
+ROLE_COLUMNS = [column.key for column in UserRole.__table__.columns]
+
+
+def _snapshot(obj, columns):
+    return {key: getattr(obj, key) for key in columns}
+
+
+def _detached(model, values):
+    """Объект с уже загруженными значениями, который можно присоединить к сессии без SELECT."""
+    obj = model(**values)
+    make_transient_to_detached(obj)
+    return obj
+
+
+class IdentityCache:
+    """Кеш пользователей и таблицы ролей для аутентифицированных запросов.
+
+    Хранятся значения столбцов, а не объекты: каждый запрос получает собственный
+    экземпляр Account в своей сессии, уже связанный с ролью. Записи живут ttl
+    секунд и сбрасываются при изменении пользователя или ролей в этом процессе.
+    """
+
+    def __init__(self, ttl=30, maxsize=10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._accounts = {}
+        self._roles = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('IDENTITY_CACHE_TTL', self.ttl)
+        app.extensions['identity_cache'] = self
+
+    def _role_snapshots(self):
+        with self._lock:
+            cached = self._roles
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        roles = {role.id: _snapshot(role, ROLE_COLUMNS) for role in db.session.scalars(select(UserRole).order_by(UserRole.id))}
+        with self._lock:
+            self._roles = (time.monotonic() + self.ttl, roles)
+        return roles
+
+    def role_choices(self):
+        """Пары (id, название) для выбора роли в форме регистрации."""
+        return [(role['id'], role['name']) for role in self._role_snapshots().values()]
+
+    def role(self, role_id):
+        values = self._role_snapshots().get(role_id)
+        if values is None:
+            return None
+        return db.session.merge(_detached(UserRole, values), load=False)
+
+    def account(self, account_id):
+        """Пользователь с присоединённой ролью или None; при попадании в кеш запросов к БД нет."""
+        with self._lock:
+            cached = self._accounts.get(account_id)
+        if cached and cached[0] > time.monotonic():
+            account = db.session.merge(_detached(Account, cached[1]), load=False)
+        else:
+            account = db.session.get(Account, account_id)
+            if account is None:
+                self.forget(account_id)
+                return None
+            with self._lock:
+                if len(self._accounts) >= self.maxsize:
+                    self._evict()
+                self._accounts[account_id] = (time.monotonic() + self.ttl, _snapshot(account, ACCOUNT_COLUMNS))
+        set_committed_value(account, 'role', self.role(account.role_id))
+        return account
+
+    def _evict(self):
+        now = time.monotonic()
+        expired = [key for key, (expires, _) in self._accounts.items() if expires <= now]
+        for key in expired or list(self._accounts)[:max(1, len(self._accounts) // 10)]:
+            del self._accounts[key]
+
+    def forget(self, account_id):
+        with self._lock:
+            self._accounts.pop(account_id, None)
+
+    def forget_roles(self):
+        with self._lock:
+            self._roles = None
+
+    def clear(self):
+        with self._lock:
+            self._accounts.clear()
+            self._roles = None
+
+
+identity_cache = IdentityCache()
+
+
+@event.listens_for(Account, 'after_update')
+@event.listens_for(Account, 'after_delete')
+def _account_changed(mapper, connection, target):
+    identity_cache.forget(target.id)
+
+
+@event.listens_for(UserRole, 'after_insert')
+@event.listens_for(UserRole, 'after_update')
+@event.listens_for(UserRole, 'after_delete')
+def _roles_changed(mapper, connection, target):
+    identity_cache.forget_roles()
@@ -0,0 +1,52 @@
+import logging
+import os
+
+from flask import current_app
+
+from fragments import fragment_cache
+from models import db, Dish, Photo
+
+# Размеры вариантов (максимальная ширина, высота); ширина используется в srcset
+VARIANT_SIZES = {
+    'card': (480, 250),
+    'detail': (1200, 900),
+}
+# Для каждого размера сохраняется копия в исходном формате и в WebP
+VARIANT_NAMES = [f'{size}{suffix}' for size in VARIANT_SIZES for suffix in ('', '.webp')]
+
+def _save_variant(image, path, name, source_format):
+    if name.endswith('.webp'):
+        image.save(path, 'WEBP', quality=80, method=4)
+    elif source_format == 'PNG':
+        image.save(path, 'PNG', optimize=True)
+    else:
+        image.convert('RGB').save(path, 'JPEG', quality=82, optimize=True, progressive=True)
+
+
+def generate_variants(photo_id):
+    """Создаёт уменьшенные копии фотографии и отмечает их в БД."""
+    photo = db.session.get(Photo, photo_id)
+    if photo is None:
+        return []
+    # Pillow нужен только обработчику фоновых задач, а не каждому процессу приложения
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    folder = current_app.config['UPLOAD_FOLDER']
+    try:
+        with Image.open(os.path.join(folder, photo.filename)) as original:
+            source_format = original.format
+            original = ImageOps.exif_transpose(original)
+            created = []
+            for name in VARIANT_NAMES:
+                image = original.copy()
+                image.thumbnail(VARIANT_SIZES[name.split('.')[0]], Image.LANCZOS)
+                _save_variant(image, os.path.join(folder, photo.variant_filename(name)), name, source_format)
+                created.append(name)
+    except (OSError, UnidentifiedImageError) as e:
+        logging.error(f'Не удалось создать варианты фото {photo.filename}: {e}')
+        return []
+    photo.variants = ','.join(created)
+    Dish.touch(photo.recipe_id)
+    db.session.commit()
+    fragment_cache.invalidate_dish(photo.recipe_id)
+    return created
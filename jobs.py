@@ -0,0 +1,465 @@
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, g, has_app_context
+from flask.cli import with_appcontext
+from sqlalchemy import and_, case, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from fragments import fragment_cache
+from images import generate_variants
+from models import db, Job, Photo
+from similarity import update_dish
+from storage import is_blob_path, remove_files
+
+HANDLERS = {}
+# Задачи, которые выполняются сразу после коммита запроса, поставившего их
+INLINE_KINDS = set()
+# Предел задержки между повторными попытками, секунды
+MAX_RETRY_DELAY = 3600
+
+_executor = None
+_executor_lock = threading.Lock()
+# Процесс, в котором запущен планировщик; после fork воркер запускает свой
+_scheduler_pid = None
+
+
+def job(kind, inline=False):
+    """Регистрирует обработчик задачи; аргументы обработчика — поля payload."""
+    def decorator(func):
+        HANDLERS[kind] = func
+        if inline:
+            INLINE_KINDS.add(kind)
+        return func
+    return decorator
+
+
+def _worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+
+def enqueue(kind, key=None, delay=0, max_attempts=None, **payload):
+    """Ставит задачу в очередь в текущей транзакции и возвращает её.
+
+    Пока задача с тем же ключом ждёт, новая не создаётся. Выполняющаяся задача
+    могла прочитать данные до изменения, поэтому отмечается для повторного
+    запуска с новым payload; выполненная или проваленная запускается заново.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f'Неизвестный тип задачи: {kind}')
+    run_at = datetime.utcnow() + timedelta(seconds=delay)
+    max_attempts = max_attempts or current_app.config['JOB_MAX_ATTEMPTS']
+    existing = db.session.scalar(select(Job).where(Job.idempotency_key == key)) if key else None
+    if existing is not None and existing.status == 'running' and _mark_rerun(existing, payload, max_attempts):
+        task = existing
+    elif existing is not None and existing.status == 'pending':
+        task = existing
+    elif existing is not None:
+        existing.status, existing.attempts, existing.max_attempts, existing.rerun = 'pending', 0, max_attempts, False
+        existing.payload, existing.run_at, existing.last_error, existing.finished_at = payload, run_at, None, None
+        task = existing
+    else:
+        task = Job(kind=kind, payload=payload, idempotency_key=key, run_at=run_at, max_attempts=max_attempts)
+        try:
+            with db.session.begin_nested():
+                db.session.add(task)
+        except IntegrityError:
+            # Ту же задачу одновременно поставил другой запрос
+            task = db.session.scalar(select(Job).where(Job.idempotency_key == key))
+    if has_app_context():
+        g.setdefault('enqueued_jobs', []).append((task.id, task.kind))
+    return task
+
+
+def _mark_rerun(task, payload, max_attempts):
+    """Отмечает выполняющуюся задачу для повторного запуска; False, если она уже завершилась."""
+    result = db.session.execute(
+        update(Job)
+        .where(Job.id == task.id, Job.status == 'running')
+        .values(rerun=True, payload=payload, max_attempts=max_attempts)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.refresh(task)
+    return result.rowcount == 1
+
+
+def _claim(job_id, worker):
+    """Атомарно забирает задачу; False, если её уже взял другой исполнитель."""
+    result = db.session.execute(
+        update(Job)
+        .where(Job.id == job_id, _claimable())
+        .values(status='running', locked_by=worker, locked_at=datetime.utcnow(), attempts=Job.attempts + 1)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def _claimable():
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=current_app.config['JOB_LOCK_TIMEOUT'])
+    # Задачи упавшего исполнителя возвращаются в очередь по таймауту блокировки
+    return or_(
+        and_(Job.status == 'pending', Job.run_at <= now),
+        and_(Job.status == 'running', Job.locked_at < stale),
+    )
+
+
+def claim_next(worker, limit=1):
+    """Забирает до limit готовых задач. В MySQL занятые строки пропускаются (SKIP LOCKED)."""
+    query = select(Job.id).where(_claimable()).order_by(Job.run_at, Job.id).limit(limit)
+    if db.engine.dialect.name == 'mysql':
+        query = query.with_for_update(skip_locked=True)
+    candidates = db.session.scalars(query).all()
+    return [job_id for job_id in candidates if _claim(job_id, worker)]
+
+
+def _retry_delay(attempts):
+    base = current_app.config['JOB_RETRY_DELAY']
+    return min(MAX_RETRY_DELAY, base * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+
+
+def _requeue_if_rerun(job_id):
+    """Возвращает в очередь задачу, поставленную заново во время выполнения; True, если вернул."""
+    result = db.session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == 'running', Job.rerun.is_(True))
+        .values(status='pending', rerun=False, attempts=0, run_at=datetime.utcnow(),
+                last_error=None, locked_by=None, locked_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def run_job(job_id):
+    """Выполняет уже захваченную задачу; при ошибке планирует повтор с экспоненциальной задержкой.
+
+    Если во время выполнения задачу поставили заново, она возвращается в очередь
+    с новым payload, а не завершается.
+    """
+    task = db.session.get(Job, job_id)
+    try:
+        HANDLERS[task.kind](**task.payload)
+    except Exception as e:
+        db.session.rollback()
+        if _requeue_if_rerun(job_id):
+            db.session.commit()
+            return False
+        task = db.session.get(Job, job_id)
+        task.last_error = f'{type(e).__name__}: {e}'
+        if task.attempts >= task.max_attempts:
+            task.status = 'failed'
+            task.finished_at = datetime.utcnow()
+            logging.error(f'Задача {task.kind} #{task.id} провалена после {task.attempts} попыток: {e}')
+        else:
+            task.status = 'pending'
+            task.run_at = datetime.utcnow() + timedelta(seconds=_retry_delay(task.attempts))
+        db.session.commit()
+        return False
+    # Одним UPDATE: отметка rerun, поставленная в любой момент выполнения, не теряется
+    rerun = Job.rerun.is_(True)
+    now = datetime.utcnow()
+    db.session.execute(
+        update(Job)
+        .where(Job.id == job_id)
+        # rerun сбрасывается последним: MySQL вычисляет SET слева направо по уже новым значениям
+        .ordered_values(
+            (Job.status, case((rerun, 'pending'), else_='done')),
+            (Job.attempts, case((rerun, 0), else_=Job.attempts)),
+            (Job.run_at, case((rerun, now), else_=Job.run_at)),
+            (Job.finished_at, case((rerun, None), else_=now)),
+            (Job.last_error, None),
+            (Job.rerun, False),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return True
+
+
+def run_pending(limit=None):
+    """Выполняет готовые задачи, пока они есть; возвращает число выполненных."""
+    worker = _worker_id()
+    done = 0
+    while limit is None or done < limit:
+        claimed = claim_next(worker)
+        if not claimed:
+            break
+        for job_id in claimed:
+            run_job(job_id)
+            done += 1
+    return done
+
+
+def _run_in_context(app):
+    with app.app_context():
+        try:
+            run_pending()
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f'Ошибка фоновой очереди: {e}')
+
+
+def _get_executor(workers):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='jobs')
+        return _executor
+
+
+def run_due():
+    """Один такт планировщика: ставит очистку по расписанию и выполняет готовые задачи,
+    в том числе повторы, время которых наступило."""
+    schedule_sweep()
+    return run_pending(limit=100)
+
+
+def _schedule_loop(app):
+    while True:
+        time.sleep(app.config['JOB_POLL_INTERVAL'])
+        with app.app_context():
+            try:
+                run_due()
+            except Exception as e:
+                db.session.rollback()
+                logging.error(f'Ошибка планировщика очереди: {e}')
+
+
+def _ensure_scheduler():
+    global _scheduler_pid
+    with _executor_lock:
+        if _scheduler_pid == os.getpid():
+            return
+        _scheduler_pid = os.getpid()
+    threading.Thread(
+        target=_schedule_loop, args=(current_app._get_current_object(),), name='jobs-scheduler', daemon=True
+    ).start()
+
+
+def init_jobs(app):
+    """При JOB_RUNNER=thread каждый процесс приложения сам выполняет отложенные задачи.
+
+    Планировщик запускается с первым запросом, а не при создании приложения:
+    поток мастера gunicorn с preload не переживает fork в воркеры.
+    """
+    if app.config['JOB_RUNNER'] == 'thread':
+        app.before_request(_ensure_scheduler)
+
+
+def dispatch():
+    """Запускает задачи, поставленные текущим запросом; вызывается после коммита.
+
+    Задачи из INLINE_KINDS выполняются сразу, остальные — в пуле потоков
+    (JOB_RUNNER=thread), в этом же потоке (inline) или отдельным воркером (external).
+    Повторы после ошибок и очистку при JOB_RUNNER=thread выполняет планировщик
+    процесса (init_jobs), при external — flask jobs work.
+    """
+    tasks = g.pop('enqueued_jobs', [])
+    runner = current_app.config['JOB_RUNNER']
+    worker = _worker_id()
+    background = False
+    for job_id, kind in tasks:
+        if kind in INLINE_KINDS or runner == 'inline':
+            if _claim(job_id, worker):
+                run_job(job_id)
+        else:
+            background = True
+    if background and runner == 'thread':
+        _get_executor(current_app.config['JOB_WORKERS']).submit(_run_in_context, current_app._get_current_object())
+
+
+@job('invalidate_dish', inline=True)
+def invalidate_dish(dish_id):
+    fragment_cache.invalidate_dish(dish_id)
+
+
+@job('generate_variants')
+def generate_photo_variants(photo_id):
+    generate_variants(photo_id)
+
+
+@job('update_similarity')
+def update_similarity(dish_id):
+    for changed in update_dish(dish_id):
+        fragment_cache.invalidate_dish(changed)
+
+
+@job('remove_photo_files')
+def remove_photo_files(photos):
+    """Удаляет файлы удалённых фото, если на их содержимое больше не ссылается ни одна запись.
+
+    Проверка выполняется при запуске задачи, поэтому файл, загруженный заново
+    после удаления блюда, не пропадает. Файлы моложе UPLOAD_GRACE_SECONDS могут
+    принадлежать ещё не закоммиченной загрузке и остаются очистке sweep_uploads.
+    """
+    filenames = []
+    for content_hash, files in photos:
+        # Старые загрузки без хеша хранились под именем файла клиента, общим для нескольких фото
+        reference = Photo.content_hash == content_hash if content_hash else Photo.filename == files[0]
+        if db.session.scalar(select(Photo.id).where(reference).limit(1)):
+            continue
+        filenames.extend(files)
+    remove_files(filenames, modified_before=time.time() - current_app.config['UPLOAD_GRACE_SECONDS'])
+
+
+def _upload_files(folder):
+    for root, _, files in os.walk(folder):
+        for name in files:
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, folder).replace(os.sep, '/'), path
+
+
+def _referenced(relpaths):
+    """Подмножество relpaths, на которое ссылаются записи Photo (оригиналы и варианты)."""
+    hashes = {os.path.basename(relpath)[:64] for relpath in relpaths if is_blob_path(relpath)}
+    # Варианты старых фото называются по имени оригинала: photo.jpg -> photo.card.webp
+    stems = {relpath.split('.', 1)[0] for relpath in relpaths if not is_blob_path(relpath)}
+    conditions = [Photo.filename.startswith(f'{stem}.', autoescape=True) for stem in stems]
+    if hashes:
+        conditions.append(Photo.content_hash.in_(hashes))
+    referenced = set()
+    for photo in db.session.scalars(select(Photo).where(or_(*conditions))):
+        referenced.add(photo.filename)
+        referenced.update(photo.variant_filenames())
+    return referenced & set(relpaths)
+
+
+def sweep_uploads(grace=None, batch_size=500):
+    """Удаляет из UPLOAD_FOLDER файлы без записи Photo; возвращает их число.
+
+    Файлы моложе grace секунд не трогаются: загрузка сохраняет файл раньше,
+    чем коммитится строка Photo.
+    """
+    folder = current_app.config['UPLOAD_FOLDER']
+    grace = current_app.config['UPLOAD_GRACE_SECONDS'] if grace is None else grace
+    cutoff = time.time() - grace
+    removed = 0
+    batch = {}
+
+    def flush():
+        nonlocal removed
+        orphans = set(batch) - _referenced(list(batch))
+        for relpath in orphans:
+            try:
+                os.remove(batch[relpath])
+                removed += 1
+            except FileNotFoundError:
+                pass
+        batch.clear()
+
+    for relpath, path in _upload_files(folder):
+        try:
+            if os.path.getmtime(path) > cutoff:
+                continue
+        except FileNotFoundError:
+            continue
+        batch[relpath] = path
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    db.session.rollback()
+    return removed
+
+
+def prune_jobs(retention=None):
+    """Удаляет выполненные задачи старше retention секунд."""
+    retention = current_app.config['JOB_RETENTION'] if retention is None else retention
+    cutoff = datetime.utcnow() - timedelta(seconds=retention)
+    result = db.session.execute(
+        Job.__table__.delete().where(Job.status == 'done', Job.finished_at < cutoff)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+@job('sweep_uploads')
+def periodic_sweep():
+    removed = sweep_uploads()
+    pruned = prune_jobs()
+    if removed or pruned:
+        logging.warning(f'Очистка: удалено файлов {removed}, старых задач {pruned}')
+
+
+def schedule_sweep():
+    """Ставит очистку в очередь, если с прошлой прошло SWEEP_INTERVAL секунд.
+
+    Вызывается по таймеру планировщиком каждого процесса приложения (JOB_RUNNER=thread)
+    и исполнителем flask jobs work; общий ключ оставляет в очереди одну задачу.
+    """
+    last = db.session.scalar(select(Job).where(Job.idempotency_key == 'sweep-uploads'))
+    interval = timedelta(seconds=current_app.config['SWEEP_INTERVAL'])
+    if last is not None and (last.status in ('pending', 'running') or
+                             (last.finished_at and last.finished_at > datetime.utcnow() - interval)):
+        return
+    enqueue('sweep_uploads', key='sweep-uploads')
+    db.session.commit()
+    g.pop('enqueued_jobs', None)
+
+
+@click.group('jobs')
+def jobs_cli():
+    """Фоновая очередь задач."""
+
+
+@jobs_cli.command('work')
+@click.option('--threads', default=2, show_default=True, help='Число потоков-исполнителей.')
+@click.option('--poll', default=1.0, show_default=True, help='Пауза между опросами пустой очереди, с.')
+@click.option('--once', is_flag=True, help='Выполнить готовые задачи и завершиться.')
+@with_appcontext
+def work_command(threads, poll, once):
+    """Запускает исполнитель очереди и периодическую очистку загрузок."""
+    app = current_app._get_current_object()
+    if once:
+        click.echo(f'Выполнено задач: {run_pending()}')
+        return
+    stop = threading.Event()
+
+    def loop():
+        with app.app_context():
+            while not stop.is_set():
+                try:
+                    if not run_pending(limit=100):
+                        stop.wait(poll)
+                except Exception as e:
+                    db.session.rollback()
+                    logging.error(f'Ошибка исполнителя очереди: {e}')
+                    stop.wait(poll)
+
+    pool = [threading.Thread(target=loop, name=f'jobs-{n}') for n in range(threads)]
+    for thread in pool:
+        thread.start()
+    click.echo(f'Исполнитель очереди запущен, потоков: {threads}. Ctrl+C для остановки.')
+    try:
+        while any(thread.is_alive() for thread in pool):
+            schedule_sweep()
+            stop.wait(min(60, current_app.config['SWEEP_INTERVAL']))
+    except KeyboardInterrupt:
+        stop.set()
+    for thread in pool:
+        thread.join()
+
+
+@jobs_cli.command('sweep')
+@click.option('--grace', type=int, help='Минимальный возраст удаляемого файла, с.')
+@with_appcontext
+def sweep_command(grace):
+    """Удаляет из UPLOAD_FOLDER файлы, на которые не ссылается ни одна фотография."""
+    click.echo(f'Удалено файлов: {sweep_uploads(grace)}')
+
+
+@jobs_cli.command('status')
+@with_appcontext
+def status_command():
+    """Число задач по состояниям."""
+    rows = db.session.execute(select(Job.status, db.func.count()).group_by(Job.status)).all()
+    for status, count in rows:
+        click.echo(f'{status}: {count}')
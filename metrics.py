@@ -0,0 +1,347 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter as SampleCounter
+
+import click
+from flask import current_app, g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from fragments import fragment_cache
+from models import db
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+# Сколько SQL-запросов одного запроса сохраняется для журнала медленных запросов
+MAX_LOGGED_STATEMENTS = 50
+
+slow_log = logging.getLogger('metrics.slow')
+slow_log.setLevel(logging.WARNING)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in sorted(items):
+            yield self.name, list(zip(self.labels, key)), value
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    """Гистограмма с накопительными корзинами, как у клиента Prometheus."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            state = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        for key, counts, total, count in sorted(items):
+            labels = list(zip(self.labels, key))
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield f'{self.name}_bucket', labels + [('le', _format_value(float(bound)))], bucket_count
+            yield f'{self.name}_bucket', labels + [('le', '+Inf')], count
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, count
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Gauge:
+    """Значение, вычисляемое в момент выдачи метрик."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, collect, kind='gauge'):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self._collect = collect
+
+    def samples(self):
+        for labels, value in self._collect():
+            yield self.name, labels, value
+
+    def reset(self):
+        pass
+
+
+class SamplingProfiler:
+    """Периодически снимает стек потока запроса через sys._current_frames.
+
+    Результат — свёрнутые стеки («a;b;c N»), которые читают flamegraph.pl и speedscope.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = SampleCounter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class RequestMetrics:
+    """Метрики запросов: время ответа, SQL, шаблоны и объём загрузок по эндпоинтам.
+
+    Значения хранятся в памяти процесса, поэтому каждый воркер gunicorn отдаёт
+    на /metrics собственные счётчики.
+    """
+
+    def __init__(self):
+        self.request_seconds = Histogram(
+            'http_request_duration_seconds', 'Время обработки запроса.', ('endpoint', 'method'))
+        self.requests_total = Counter(
+            'http_requests_total', 'Число обработанных запросов.', ('endpoint', 'method', 'status'))
+        self.sql_queries = Histogram(
+            'sql_queries_per_request', 'Число SQL-запросов на один HTTP-запрос.', ('endpoint',), QUERY_COUNT_BUCKETS)
+        self.sql_seconds = Histogram(
+            'sql_duration_seconds', 'Суммарное время SQL-запросов за один HTTP-запрос.', ('endpoint',))
+        self.template_seconds = Histogram(
+            'template_render_seconds', 'Суммарное время рендеринга шаблонов за один HTTP-запрос.', ('endpoint',))
+        self.upload_bytes = Counter(
+            'upload_bytes_total', 'Объём тел запросов с загружаемыми файлами.', ('endpoint',))
+        self.slow_requests = Counter(
+            'http_slow_requests_total', 'Число запросов дольше SLOW_REQUEST_SECONDS.', ('endpoint',))
+        self.metrics = [
+            self.request_seconds, self.requests_total, self.sql_queries, self.sql_seconds,
+            self.template_seconds, self.upload_bytes, self.slow_requests,
+            Gauge('fragment_cache_hits_total', 'Попадания в кеш фрагментов.',
+                  lambda: [([], fragment_cache.hits)], kind='counter'),
+            Gauge('fragment_cache_misses_total', 'Промахи кеша фрагментов.',
+                  lambda: [([], fragment_cache.misses)], kind='counter'),
+            Gauge('fragment_cache_entries', 'Число записей в кеше фрагментов.',
+                  lambda: [([], len(fragment_cache.backend))]),
+            Gauge('db_pool_checked_out', 'Соединения пула, выданные в работу.', self._pool_checked_out),
+        ]
+        self._profile_checked = 0.0
+        self._profile_endpoint = None
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        app.extensions['metrics'] = self
+
+    def _pool_checked_out(self):
+        return [([('bind', key or 'primary')], engine.pool.checkedout())
+                for key, engine in db.engines.items() if hasattr(engine.pool, 'checkedout')]
+
+    def profiled_endpoint(self):
+        """Эндпоинт для профилирования: из файла, записанного командой flask profile, или из конфигурации.
+
+        Файл перечитывается не чаще раза в секунду, чтобы не обращаться к диску на каждый запрос.
+        """
+        now = time.monotonic()
+        if now - self._profile_checked >= 1:
+            self._profile_checked = now
+            try:
+                with open(_profile_control_path(current_app.config['PROFILE_DIR']), encoding='utf-8') as f:
+                    self._profile_endpoint = f.read().strip() or None
+            except FileNotFoundError:
+                self._profile_endpoint = current_app.config['PROFILE_ENDPOINT']
+        return self._profile_endpoint
+
+    def _before_request(self):
+        g.metrics = {'start': time.perf_counter(), 'sql_count': 0, 'sql_time': 0.0,
+                     'statements': [], 'template_time': 0.0, 'template_depth': 0}
+        if request.endpoint and request.endpoint == self.profiled_endpoint():
+            g.metrics['profiler'] = SamplingProfiler(threading.get_ident()).start()
+
+    def _after_request(self, response):
+        stats = g.pop('metrics', None)
+        if stats is None:
+            return response
+        elapsed = time.perf_counter() - stats['start']
+        endpoint = request.endpoint or 'unknown'
+        self.request_seconds.observe(elapsed, endpoint=endpoint, method=request.method)
+        self.requests_total.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        self.sql_queries.observe(stats['sql_count'], endpoint=endpoint)
+        self.sql_seconds.observe(stats['sql_time'], endpoint=endpoint)
+        self.template_seconds.observe(stats['template_time'], endpoint=endpoint)
+        if request.mimetype == 'multipart/form-data' and request.content_length:
+            self.upload_bytes.inc(request.content_length, endpoint=endpoint)
+        if 'profiler' in stats:
+            self._dump_profile(stats['profiler'].stop(), endpoint)
+        if elapsed >= current_app.config['SLOW_REQUEST_SECONDS']:
+            self.slow_requests.inc(endpoint=endpoint)
+            self._log_slow(endpoint, elapsed, stats)
+        return response
+
+    def _dump_profile(self, profiler, endpoint):
+        directory = current_app.config['PROFILE_DIR']
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{endpoint}-{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{threading.get_ident()}.folded')
+        profiler.dump(path)
+
+    def _log_slow(self, endpoint, elapsed, stats):
+        lines = [
+            f'Медленный запрос {request.method} {request.full_path} ({endpoint}): {elapsed:.3f} с, '
+            f'SQL: {stats["sql_count"]} запросов за {stats["sql_time"]:.3f} с, шаблоны: {stats["template_time"]:.3f} с'
+        ]
+        lines += [f'  {duration * 1000:.1f} мс: {statement}' for statement, duration in stats['statements']]
+        if stats['sql_count'] > len(stats['statements']):
+            lines.append(f'  … ещё {stats["sql_count"] - len(stats["statements"])} запросов')
+        slow_log.warning('\n'.join(lines))
+
+    def _before_render(self, sender, template, context, **extra):
+        stats = g.get('metrics') if has_request_context() else None
+        if stats is None:
+            return
+        # Вложенные вызовы render_template не учитываются дважды
+        if stats['template_depth'] == 0:
+            stats['template_start'] = time.perf_counter()
+        stats['template_depth'] += 1
+
+    def _after_render(self, sender, template, context, **extra):
+        stats = g.get('metrics') if has_request_context() else None
+        if stats is None or not stats['template_depth']:
+            return
+        stats['template_depth'] -= 1
+        if stats['template_depth'] == 0:
+            stats['template_time'] += time.perf_counter() - stats['template_start']
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus."""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        for metric in self.metrics:
+            metric.reset()
+
+
+def _request_stats():
+    return g.get('metrics') if has_request_context() else None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _request_stats() is not None:
+        conn.info.setdefault('metrics_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _request_stats()
+    starts = conn.info.get('metrics_start')
+    if stats is None or not starts:
+        return
+    duration = time.perf_counter() - starts.pop()
+    stats['sql_count'] += 1
+    stats['sql_time'] += duration
+    if len(stats['statements']) < MAX_LOGGED_STATEMENTS:
+        stats['statements'].append((statement, duration))
+
+
+def _profile_control_path(directory):
+    return os.path.join(directory, 'endpoint')
+
+
+@click.command('profile')
+@click.argument('endpoint', required=False)
+@click.option('--off', is_flag=True, help='Выключить профилирование.')
+def profile_command(endpoint, off):
+    """Включает выборочное профилирование одного эндпоинта во всех воркерах."""
+    directory = current_app.config['PROFILE_DIR']
+    path = _profile_control_path(directory)
+    if off:
+        if os.path.exists(path):
+            os.remove(path)
+        click.echo('Профилирование выключено.')
+        return
+    if not endpoint or endpoint not in current_app.view_functions:
+        raise click.BadParameter(f'неизвестный эндпоинт {endpoint!r}', param_hint='ENDPOINT')
+    os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(endpoint)
+    click.echo(f'Профили запросов к {endpoint} сохраняются в {directory}.')
+
+
+metrics = RequestMetrics()
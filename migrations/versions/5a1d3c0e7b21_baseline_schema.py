@@ -0,0 +1,124 @@
+"""Исходная схема, как в MyDump.sql
+
+База, восстановленная из MyDump.sql, уже содержит эту схему: для неё
+выполняется `flask db stamp 5a1d3c0e7b21`, затем `flask db upgrade`.
+
+Revision ID: 5a1d3c0e7b21
+Revises:
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a1d3c0e7b21'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'roles',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('description', sa.Text(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name'),
+    )
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(length=100), nullable=False),
+        sa.Column('password_hash', sa.String(length=255), nullable=False),
+        sa.Column('last_name', sa.String(length=100), nullable=False),
+        sa.Column('first_name', sa.String(length=100), nullable=False),
+        sa.Column('middle_name', sa.String(length=100), nullable=True),
+        sa.Column('role_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['role_id'], ['roles.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('username'),
+    )
+    op.create_table(
+        'recipes',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(length=255), nullable=False),
+        sa.Column('description', sa.Text(), nullable=False),
+        sa.Column('description_html', sa.Text(), nullable=True),
+        sa.Column('cooking_time', sa.Integer(), nullable=False),
+        sa.Column('servings', sa.Integer(), nullable=False),
+        sa.Column('ingredients', sa.Text(), nullable=False),
+        sa.Column('ingredients_html', sa.Text(), nullable=True),
+        sa.Column('steps', sa.Text(), nullable=False),
+        sa.Column('steps_html', sa.Text(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('rating_sum', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('rating_count', sa.Integer(), server_default='0', nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sqlite_autoincrement=True,
+    )
+    op.create_index('ix_recipes_created_at_id', 'recipes', ['created_at', 'id'])
+    if op.get_bind().dialect.name == 'mysql':
+        op.execute('ALTER TABLE recipes ADD FULLTEXT INDEX ft_recipes_search (title, ingredients, steps)')
+    elif op.get_bind().dialect.name == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE recipes_fts USING fts5(title, ingredients, steps, tokenize='unicode61')")
+    op.create_table(
+        'images',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('filename', sa.String(length=255), nullable=False),
+        sa.Column('mime_type', sa.String(length=100), nullable=False),
+        sa.Column('recipe_id', sa.Integer(), nullable=False),
+        sa.Column('content_hash', sa.String(length=64), nullable=True),
+        sa.Column('variants', sa.String(length=255), nullable=True),
+        sa.ForeignKeyConstraint(['recipe_id'], ['recipes.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_images_content_hash', 'images', ['content_hash'])
+    op.create_table(
+        'reviews',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('recipe_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('rating', sa.Integer(), nullable=False),
+        sa.Column('text', sa.Text(), nullable=False),
+        sa.Column('text_html', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['recipe_id'], ['recipes.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_table(
+        'jobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=50), nullable=False),
+        sa.Column('payload', sa.JSON(), nullable=False),
+        sa.Column('idempotency_key', sa.String(length=191), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('max_attempts', sa.Integer(), nullable=False),
+        sa.Column('run_at', sa.DateTime(), nullable=False),
+        sa.Column('locked_by', sa.String(length=100), nullable=True),
+        sa.Column('locked_at', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('idempotency_key'),
+    )
+    op.create_index('ix_jobs_status_run_at', 'jobs', ['status', 'run_at'])
+
+
+def downgrade():
+    op.drop_table('jobs')
+    op.drop_table('reviews')
+    op.drop_table('images')
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute('DROP TABLE IF EXISTS recipes_fts')
+    op.drop_table('recipes')
+    op.drop_table('users')
+    op.drop_table('roles')
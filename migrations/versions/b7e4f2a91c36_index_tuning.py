@@ -0,0 +1,84 @@
+"""Индексы и ограничения для частых запросов
+
+- уникальное название блюда (проверка в create_dish и импорт);
+- один отзыв пользователя на блюдо, отзывы блюда по дате;
+- фотографии блюда и обложка (минимальный id фото блюда).
+
+Перед созданием уникальных индексов повторяющиеся названия получают суффикс
+с id блюда, а лишние отзывы удаляются с пересчётом агрегатов оценок.
+
+Revision ID: b7e4f2a91c36
+Revises: 5a1d3c0e7b21
+Create Date: 2026-10-17 10:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e4f2a91c36'
+down_revision = '5a1d3c0e7b21'
+branch_labels = None
+depends_on = None
+
+
+def _index_names(table):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def _deduplicate_titles(bind):
+    titles = bind.execute(sa.text(
+        'SELECT title FROM recipes GROUP BY title HAVING COUNT(*) > 1'
+    )).scalars().all()
+    for title in titles:
+        ids = bind.execute(sa.text('SELECT id FROM recipes WHERE title = :title ORDER BY id'), {'title': title}).scalars().all()
+        for dish_id in ids[1:]:
+            new_title = f'{title[:240]} ({dish_id})'
+            bind.execute(sa.text('UPDATE recipes SET title = :title WHERE id = :id'), {'title': new_title, 'id': dish_id})
+            if bind.dialect.name == 'sqlite':
+                bind.execute(sa.text('UPDATE recipes_fts SET title = :title WHERE rowid = :id'), {'title': new_title, 'id': dish_id})
+
+
+def _deduplicate_reviews(bind):
+    duplicates = bind.execute(sa.text(
+        'SELECT recipe_id, user_id, MIN(id) FROM reviews GROUP BY recipe_id, user_id HAVING COUNT(*) > 1'
+    )).all()
+    for recipe_id, user_id, keep_id in duplicates:
+        bind.execute(
+            sa.text('DELETE FROM reviews WHERE recipe_id = :recipe_id AND user_id = :user_id AND id <> :keep_id'),
+            {'recipe_id': recipe_id, 'user_id': user_id, 'keep_id': keep_id},
+        )
+    for recipe_id in {row[0] for row in duplicates}:
+        bind.execute(sa.text(
+            'UPDATE recipes SET '
+            'rating_sum = (SELECT COALESCE(SUM(rating), 0) FROM reviews WHERE recipe_id = :id), '
+            'rating_count = (SELECT COUNT(*) FROM reviews WHERE recipe_id = :id) '
+            'WHERE id = :id'
+        ), {'id': recipe_id})
+
+
+def upgrade():
+    bind = op.get_bind()
+    _deduplicate_titles(bind)
+    _deduplicate_reviews(bind)
+    op.create_index('uq_recipes_title', 'recipes', ['title'], unique=True)
+    op.create_index('uq_reviews_recipe_user', 'reviews', ['recipe_id', 'user_id'], unique=True)
+    op.create_index('ix_reviews_recipe_created', 'reviews', ['recipe_id', 'created_at', 'id'])
+    op.create_index('ix_images_recipe_id_id', 'images', ['recipe_id', 'id'])
+    # Индексы, которые MySQL создал для внешних ключей, теперь покрываются новыми
+    if bind.dialect.name == 'mysql':
+        for table in ('reviews', 'images'):
+            if 'recipe_id' in _index_names(table):
+                op.drop_index('recipe_id', table_name=table)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'mysql':
+        # Внешнему ключу recipe_id нужен индекс, пока удаляются новые
+        for table in ('reviews', 'images'):
+            op.create_index('recipe_id', table, ['recipe_id'])
+    op.drop_index('ix_images_recipe_id_id', table_name='images')
+    op.drop_index('ix_reviews_recipe_created', table_name='reviews')
+    op.drop_index('uq_reviews_recipe_user', table_name='reviews')
+    op.drop_index('uq_recipes_title', table_name='recipes')
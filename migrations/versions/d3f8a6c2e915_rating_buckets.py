@@ -0,0 +1,38 @@
+"""Гистограмма оценок блюд
+
+Таблица rating_buckets хранит число отзывов с каждой оценкой у блюда и
+заполняется по существующим отзывам.
+
+Revision ID: d3f8a6c2e915
+Revises: b7e4f2a91c36
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3f8a6c2e915'
+down_revision = 'b7e4f2a91c36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'rating_buckets',
+        sa.Column('recipe_id', sa.Integer(), nullable=False),
+        sa.Column('rating', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['recipe_id'], ['recipes.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('recipe_id', 'rating'),
+    )
+    op.execute(
+        'INSERT INTO rating_buckets (recipe_id, rating, count) '
+        'SELECT recipe_id, rating, COUNT(*) FROM reviews GROUP BY recipe_id, rating'
+    )
+
+
+def downgrade():
+    op.drop_table('rating_buckets')
@@ -0,0 +1,55 @@
+"""Индекс похожих блюд по ингредиентам
+
+Сигнатуры MinHash, корзины LSH и готовые списки соседей. Таблицы создаются
+пустыми: после обновления схемы индекс собирается командой `flask similarity build`.
+
+Revision ID: e6b1c4d8f027
+Revises: d3f8a6c2e915
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6b1c4d8f027'
+down_revision = 'd3f8a6c2e915'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'recipe_signatures',
+        sa.Column('recipe_id', sa.Integer(), nullable=False),
+        sa.Column('tokens', sa.JSON(), nullable=False),
+        sa.Column('signature', sa.JSON(), nullable=False),
+        sa.ForeignKeyConstraint(['recipe_id'], ['recipes.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('recipe_id'),
+    )
+    op.create_table(
+        'recipe_bands',
+        sa.Column('band', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('bucket', sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column('recipe_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['recipe_id'], ['recipes.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('band', 'bucket', 'recipe_id'),
+    )
+    op.create_index('ix_recipe_bands_recipe_id', 'recipe_bands', ['recipe_id'])
+    op.create_table(
+        'recipe_neighbours',
+        sa.Column('recipe_id', sa.Integer(), nullable=False),
+        sa.Column('neighbour_id', sa.Integer(), nullable=False),
+        sa.Column('score', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['neighbour_id'], ['recipes.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['recipe_id'], ['recipes.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('recipe_id', 'neighbour_id'),
+    )
+    op.create_index('ix_recipe_neighbours_neighbour_id', 'recipe_neighbours', ['neighbour_id'])
+
+
+def downgrade():
+    op.drop_table('recipe_neighbours')
+    op.drop_table('recipe_bands')
+    op.drop_table('recipe_signatures')
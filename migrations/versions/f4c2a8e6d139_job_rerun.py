@@ -0,0 +1,29 @@
+"""Повторный запуск выполняющейся задачи
+
+Флаг jobs.rerun: задачу с тем же ключом поставили, пока она выполнялась, и
+после завершения она возвращается в очередь с новыми данными.
+
+Revision ID: f4c2a8e6d139
+Revises: e6b1c4d8f027
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4c2a8e6d139'
+down_revision = 'e6b1c4d8f027'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('jobs') as batch_op:
+        batch_op.add_column(sa.Column('rerun', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('jobs') as batch_op:
+        batch_op.drop_column('rerun')
@@ -1,8 +1,14 @@
+import os
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, and_, bindparam, event, func, select
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.orm import aliased
 from datetime import datetime
 from flask_login import UserMixin
 
-db = SQLAlchemy()
+from replicas import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 class Dish(db.Model):
@@ -10,14 +16,77 @@ class Dish(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text, nullable=False)
+    description_html = db.Column(db.Text)
     cooking_time = db.Column(db.Integer, nullable=False)
     servings = db.Column(db.Integer, nullable=False)
     ingredients = db.Column(db.Text, nullable=False)
+    ingredients_html = db.Column(db.Text)
     steps = db.Column(db.Text, nullable=False)
+    steps_html = db.Column(db.Text)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Меняется при любом изменении, влияющем на страницу блюда (валидатор HTTP-кеша)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Денормализованные агрегаты оценок, поддерживаются при изменении отзывов
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     author = db.relationship('Account', backref='dishes')
-    photos = db.relationship('Photo', cascade="all, delete-orphan")
+    photos = db.relationship('Photo', cascade="all, delete-orphan", order_by='Photo.id')
+    __table_args__ = (
+        db.Index('ix_recipes_created_at_id', 'created_at', 'id'),
+        db.Index('uq_recipes_title', 'title', unique=True),
+        {'sqlite_autoincrement': True},
+    )
+
+    @property
+    def modified_at(self):
+        return self.updated_at or self.created_at
+
+    @staticmethod
+    def touch(dish_id):
+        """Отмечает изменение связанных с блюдом данных (например, фотографий)."""
+        Dish.query.filter_by(id=dish_id).update({'updated_at': datetime.utcnow()})
+
+    @staticmethod
+    def last_modified(dish_id):
+        """modified_at блюда без загрузки строки; None, если блюда нет."""
+        row = db.session.execute(
+            select(func.coalesce(Dish.updated_at, Dish.created_at)).where(Dish.id == dish_id)
+        ).first()
+        return row[0] if row else None
+
+    @property
+    def rating_avg(self):
+        return self.rating_sum / self.rating_count if self.rating_count else 0
+
+    def add_rating(self, rating):
+        """Учитывает новую оценку в агрегатах блюда (атомарным UPDATE при flush) и в гистограмме."""
+        self.rating_sum = Dish.rating_sum + rating
+        self.rating_count = Dish.rating_count + 1
+        RatingBucket.bump([(self.id, rating, 1)])
+
+    def change_rating(self, old_rating, new_rating):
+        """Учитывает изменение оценки в существующем отзыве."""
+        self.rating_sum = Dish.rating_sum + (new_rating - old_rating)
+        RatingBucket.bump([(self.id, old_rating, -1), (self.id, new_rating, 1)])
+
+    def remove_rating(self, rating):
+        """Убирает оценку удалённого отзыва из агрегатов блюда."""
+        self.rating_sum = Dish.rating_sum - rating
+        self.rating_count = Dish.rating_count - 1
+        RatingBucket.bump([(self.id, rating, -1)])
+
+
+# Полнотекстовый индекс для поиска: FULLTEXT в MySQL, отдельная таблица FTS5 в SQLite
+event.listen(Dish.__table__, 'after_create', DDL(
+    'ALTER TABLE recipes ADD FULLTEXT INDEX ft_recipes_search (title, ingredients, steps)'
+).execute_if(dialect='mysql'))
+event.listen(Dish.__table__, 'after_create', DDL(
+    "CREATE VIRTUAL TABLE recipes_fts USING fts5(title, ingredients, steps, tokenize='unicode61')"
+).execute_if(dialect='sqlite'))
+event.listen(Dish.__table__, 'before_drop', DDL(
+    'DROP TABLE IF EXISTS recipes_fts'
+).execute_if(dialect='sqlite'))
 
 
 class Account(UserMixin, db.Model):
@@ -45,6 +114,41 @@ class Photo(db.Model):
     filename = db.Column(db.String(255), nullable=False)
     mime_type = db.Column(db.String(100), nullable=False)
     recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id', ondelete="CASCADE"), nullable=False)
+    # SHA-256 содержимого; одинаковые файлы разных фото хранятся один раз
+    content_hash = db.Column(db.String(64), index=True)
+    # Готовые уменьшенные копии через запятую, например "card,card.webp"
+    variants = db.Column(db.String(255))
+
+    # Фото блюда и его обложка (минимальный id) читаются по одному индексу
+    __table_args__ = (db.Index('ix_images_recipe_id_id', 'recipe_id', 'id'),)
+
+    def has_variant(self, name):
+        return name in (self.variants or '').split(',')
+
+    def variant_filename(self, name):
+        """Имя файла варианта: photo.jpg -> photo.card.jpg / photo.card.webp."""
+        stem, ext = os.path.splitext(self.filename)
+        size, _, fmt = name.partition('.')
+        return f'{stem}.{size}.{fmt or ext.lstrip(".")}'
+
+    def variant_filenames(self):
+        return [self.variant_filename(name) for name in (self.variants or '').split(',') if name]
+
+
+# Первая фотография блюда для карточек ленты, без загрузки остальных фото
+_other_photo = aliased(Photo)
+Dish.cover_photo = db.relationship(
+    Photo,
+    primaryjoin=and_(
+        Photo.recipe_id == Dish.id,
+        Photo.id == select(func.min(_other_photo.id))
+        .where(_other_photo.recipe_id == Photo.recipe_id)
+        .correlate_except(_other_photo)
+        .scalar_subquery(),
+    ),
+    uselist=False,
+    viewonly=True,
+)
 
 
 class Feedback(db.Model):
@@ -54,5 +158,102 @@ class Feedback(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     rating = db.Column(db.Integer, nullable=False)
     text = db.Column(db.Text, nullable=False)
+    text_html = db.Column(db.Text)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     author = db.relationship('Account', backref='feedbacks')
+
+    __table_args__ = (
+        db.Index('uq_reviews_recipe_user', 'recipe_id', 'user_id', unique=True),
+        db.Index('ix_reviews_recipe_created', 'recipe_id', 'created_at', 'id'),
+    )
+
+
+class RatingBucket(db.Model):
+    """Число отзывов с данной оценкой у блюда: гистограмма без чтения отзывов."""
+    __tablename__ = 'rating_buckets'
+    recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id', ondelete="CASCADE"), primary_key=True)
+    rating = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def bump(changes):
+        """Атомарно прибавляет delta к корзинам по списку (recipe_id, rating, delta)."""
+        if changes:
+            db.session.execute(_bucket_upsert(db.session.get_bind().dialect.name), [
+                {'recipe_id': recipe_id, 'rating': rating, 'delta': delta}
+                for recipe_id, rating, delta in changes
+            ])
+
+    @staticmethod
+    def histogram(recipe_id):
+        """Словарь оценка -> число отзывов для блюда."""
+        rows = db.session.execute(
+            select(RatingBucket.rating, RatingBucket.count).where(RatingBucket.recipe_id == recipe_id)
+        )
+        return {rating: count for rating, count in rows if count}
+
+
+def _bucket_upsert(dialect):
+    """INSERT ... с увеличением count при существующей корзине (MySQL или SQLite)."""
+    table = RatingBucket.__table__
+    insert = mysql.insert if dialect == 'mysql' else sqlite.insert
+    statement = insert(table).values(
+        recipe_id=bindparam('recipe_id'), rating=bindparam('rating'), count=bindparam('delta')
+    )
+    if dialect == 'mysql':
+        return statement.on_duplicate_key_update(count=table.c.count + statement.inserted['count'])
+    return statement.on_conflict_do_update(
+        index_elements=[table.c.recipe_id, table.c.rating],
+        set_={'count': table.c.count + statement.excluded['count']},
+    )
+
+
+class RecipeSignature(db.Model):
+    """Нормализованные ингредиенты блюда и их сигнатура MinHash (см. similarity.py)."""
+    __tablename__ = 'recipe_signatures'
+    recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id', ondelete="CASCADE"), primary_key=True)
+    tokens = db.Column(db.JSON, nullable=False)
+    signature = db.Column(db.JSON, nullable=False)
+
+
+class RecipeBand(db.Model):
+    """Корзина LSH, в которую попала полоса сигнатуры блюда."""
+    __tablename__ = 'recipe_bands'
+    band = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    bucket = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id', ondelete="CASCADE"), primary_key=True)
+
+    __table_args__ = (db.Index('ix_recipe_bands_recipe_id', 'recipe_id'),)
+
+
+class RecipeNeighbour(db.Model):
+    """Похожее блюдо и мера Жаккара их ингредиентов; страница блюда читает только эту таблицу."""
+    __tablename__ = 'recipe_neighbours'
+    recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id', ondelete="CASCADE"), primary_key=True)
+    neighbour_id = db.Column(db.Integer, db.ForeignKey('recipes.id', ondelete="CASCADE"), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (db.Index('ix_recipe_neighbours_neighbour_id', 'neighbour_id'),)
+
+
+class Job(db.Model):
+    """Задача фоновой очереди; строка добавляется в той же транзакции, что и изменение данных."""
+    __tablename__ = 'jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    # Пока задача с таким ключом ждёт, повторная постановка её не дублирует
+    idempotency_key = db.Column(db.String(191), unique=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    # Задачу поставили заново во время выполнения: после него она вернётся в очередь
+    rerun = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (db.Index('ix_jobs_status_run_at', 'status', 'run_at'),)
@@ -0,0 +1,121 @@
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import and_, func, or_, select, text
+
+from models import db
+
+
+class KeysetPage:
+    """Страница выборки с непрозрачными курсорами на соседние страницы."""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='keyset-cursor')
+
+
+def _dump_value(value):
+    if isinstance(value, datetime):
+        return ['dt', value.isoformat()]
+    return ['v', value]
+
+
+def _load_value(item):
+    kind, value = item
+    return datetime.fromisoformat(value) if kind == 'dt' else value
+
+
+def encode_cursor(direction, values):
+    return _serializer().dumps([direction, [_dump_value(v) for v in values]])
+
+
+def decode_cursor(token):
+    """Возвращает (направление, значения ключа) или None для испорченного курсора."""
+    try:
+        direction, values = _serializer().loads(token)
+    except (BadSignature, ValueError, TypeError):
+        return None
+    if direction not in ('next', 'prev'):
+        return None
+    return direction, [_load_value(v) for v in values]
+
+
+def _beyond(columns, values, descending):
+    """Условие «строка лежит за ключом values» в порядке сортировки columns."""
+    column, value = columns[0], values[0]
+    strictly = column < value if descending else column > value
+    if len(columns) == 1:
+        return strictly
+    return or_(strictly, and_(column == value, _beyond(columns[1:], values[1:], descending)))
+
+
+def paginate_keyset(query, columns, cursor=None, per_page=10, descending=True, key=None):
+    """Выбирает страницу query, упорядоченного по columns, начиная с позиции курсора.
+
+    Стоимость не зависит от глубины страницы: вместо OFFSET используется условие
+    по ключу последней показанной строки, COUNT(*) не выполняется.
+    """
+    if key is None:
+        def key(row):
+            return [getattr(row, column.key) for column in columns]
+    decoded = decode_cursor(cursor) if cursor else None
+    direction, values = decoded if decoded else ('next', None)
+    backwards = direction == 'prev'
+    # При движении назад выбираем в обратном порядке и затем разворачиваем
+    desc = descending != backwards
+    if values is not None:
+        query = query.filter(_beyond(columns, values, desc))
+    query = query.order_by(*[column.desc() if desc else column.asc() for column in columns])
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, values is not None
+    next_cursor = encode_cursor('next', key(rows[-1])) if rows and has_next else None
+    prev_cursor = encode_cursor('prev', key(rows[0])) if rows and has_prev else None
+    return KeysetPage(rows, next_cursor, prev_cursor)
+
+
+_totals = {}
+_totals_lock = threading.Lock()
+
+
+def approximate_total(model, ttl=300):
+    """Приблизительное число строк таблицы, кешируемое на ttl секунд.
+
+    Для MySQL берётся оценка из information_schema без сканирования таблицы.
+    """
+    table = model.__tablename__
+    now = time.monotonic()
+    with _totals_lock:
+        cached = _totals.get(table)
+        if cached and cached[1] > now:
+            return cached[0]
+        if db.engine.dialect.name == 'mysql':
+            total = db.session.scalar(text(
+                'SELECT TABLE_ROWS FROM information_schema.TABLES '
+                'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table'
+            ), {'table': table})
+        else:
+            total = db.session.scalar(select(func.count()).select_from(model))
+        _totals[table] = (total or 0, now + ttl)
+        return total or 0
@@ -0,0 +1,66 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from markupsafe import Markup
+
+# markdown и bleach импортируются при первом рендеринге: в запросах на чтение
+# HTML уже сохранён, и процессам приложения они могут не понадобиться вовсе
+
+
+def render_markdown(text):
+    import markdown
+
+    return markdown.markdown(text, extensions=['extra'])
+
+
+def process_markdown(text):
+    """Очищает исходный текст и рендерит его в HTML: возвращает (source, html)."""
+    import bleach
+
+    source = bleach.clean(text)
+    return source, render_markdown(source)
+
+
+def apply_markdown(obj, field, text):
+    """Записывает в obj очищенный исходник поля field и готовый HTML в field_html."""
+    source, html = process_markdown(text)
+    setattr(obj, field, source)
+    setattr(obj, f'{field}_html', html)
+
+
+class RenderCache:
+    """Ограниченный LRU-кеш HTML для строк, сохранённых без готового HTML."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, text):
+        key = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+        html = process_markdown(text)[1]
+        with self._lock:
+            self._items[key] = html
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return html
+
+    def __len__(self):
+        return len(self._items)
+
+
+legacy_cache = RenderCache()
+
+
+def rendered(obj, field):
+    """HTML поля из БД; для старых строк без него — через legacy_cache."""
+    html = getattr(obj, f'{field}_html')
+    if html is None:
+        html = legacy_cache.render(getattr(obj, field))
+    return Markup(html)
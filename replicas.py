@@ -0,0 +1,74 @@
+import time
+
+from flask import current_app, has_request_context, request, session as flask_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql import Select
+
+REPLICA_BIND = 'replica'
+# Метка в cookie сессии: до этого момента чтения пользователя идут в основную БД
+PIN_KEY = 'primary_until'
+READ_METHODS = ('GET', 'HEAD')
+
+
+def pin_primary(seconds):
+    """Направляет чтения текущего пользователя в основную БД на seconds секунд."""
+    if seconds > 0:
+        flask_session[PIN_KEY] = time.time() + seconds
+
+
+def is_pinned():
+    return flask_session.get(PIN_KEY, 0) > time.time()
+
+
+def has_replica():
+    return REPLICA_BIND in current_app.extensions['sqlalchemy'].engines
+
+
+def reads_from_replica():
+    """Пойдут ли чтения текущего запроса на реплику."""
+    return has_replica() and request.method in READ_METHODS and not is_pinned()
+
+
+class RoutingSession(Session):
+    """Сессия, отправляющая SELECT из GET-запросов на реплику (bind replica).
+
+    В основную БД идут запись и flush, SELECT ... FOR UPDATE, чтения после записи
+    в той же сессии, запросы вне HTTP-запроса (CLI, фоновые задачи) и запросы
+    пользователя, закреплённого за основной БД после своей записи.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._use_replica(clause):
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _use_replica(self, clause):
+        if self._flushing or self.info.get('wrote'):
+            return False
+        if not isinstance(clause, Select) or clause._for_update_arg is not None:
+            return False
+        return has_request_context() and reads_from_replica()
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_write(session, flush_context):
+    session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _mark_statement_write(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _pin_after_write(session):
+    # Реплика догонит запись не сразу: следующие запросы автора читают из основной БД
+    if session.info.pop('wrote', False) and has_request_context():
+        pin_primary(current_app.config.get('REPLICA_PIN_SECONDS', 0))
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forget_write(session):
+    session.info.pop('wrote', None)
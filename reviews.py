@@ -0,0 +1,107 @@
+import logging
+
+import click
+from flask import Blueprint, abort, flash, redirect, render_template, request, url_for
+from flask_login import current_user, login_required
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+
+from forms import FeedbackForm
+from httpcache import conditional, page_etag
+from jobs import dispatch, enqueue
+from models import db, Dish, Feedback, RatingBucket
+from pagination import paginate_keyset
+from rendering import process_markdown
+
+# Отзывов на странице блюда и в одной подгрузке «Показать ещё»
+REVIEWS_PER_PAGE = 10
+
+reviews = Blueprint('reviews', __name__, cli_group=None)
+
+
+def reviews_page(dish_id, cursor=None):
+    # Порядок совпадает с индексом ix_reviews_recipe_created: глубина страницы не влияет на стоимость
+    query = Feedback.query.options(joinedload(Feedback.author)).filter(Feedback.recipe_id == dish_id)
+    return paginate_keyset(query, [Feedback.created_at, Feedback.id], cursor,
+                           per_page=REVIEWS_PER_PAGE, descending=False)
+
+@reviews.route('/dish/<int:id>/reviews')
+@login_required
+def dish_reviews(id):
+    """Следующая страница отзывов для кнопки «Показать ещё»."""
+    modified_at = Dish.last_modified(id)
+    if modified_at is None:
+        abort(404)
+    cursor = request.args.get('cursor')
+    return conditional(page_etag('reviews', id, modified_at, cursor), modified_at, lambda: render_template(
+        'fragments/reviews.html', recipe_id=id, page=reviews_page(id, cursor)
+    ))
+
+@reviews.route('/dish/<int:dish_id>/add-feedback', methods=['GET', 'POST'])
+@login_required
+def add_feedback(dish_id):
+    dish = Dish.query.get_or_404(dish_id)
+    form = FeedbackForm()
+    user_id = current_user.id
+    existing_feedback = Feedback.query.filter_by(recipe_id=dish_id, user_id=user_id).first()
+    if existing_feedback:
+        flash('Вы уже оставляли отзыв на это блюдо.', 'warning')
+        return redirect(url_for('dishes.view_dish', id=dish_id))
+    if form.validate_on_submit():
+        text, text_html = process_markdown(form.comment.data)
+        feedback = Feedback(
+            recipe_id=dish_id,
+            user_id=user_id,
+            rating=form.rating.data,
+            text=text,
+            text_html=text_html
+        )
+        try:
+            db.session.add(feedback)
+            dish.add_rating(feedback.rating)
+            enqueue('invalidate_dish', dish_id=dish_id)
+            db.session.commit()
+            dispatch()
+            flash('Отзыв успешно добавлен!', 'success')
+            return redirect(url_for('dishes.view_dish', id=dish_id))
+        except IntegrityError:
+            # Второй отзыв того же пользователя отклонён уникальным индексом
+            db.session.rollback()
+            flash('Вы уже оставляли отзыв на это блюдо.', 'warning')
+            return redirect(url_for('dishes.view_dish', id=dish_id))
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f'Ошибка при добавлении отзыва: {e}')
+            flash('Ошибка при сохранении отзыва.', 'danger')
+    return render_template('add_review.html', form=form, recipe=dish)
+
+@reviews.cli.command('recount-ratings')
+@click.option('--batch-size', default=1000, show_default=True, help='Число блюд в одной транзакции.')
+def recount_ratings_command(batch_size):
+    """Пересчитывает агрегаты оценок блюд по таблице отзывов."""
+    rating_sum = (
+        select(func.coalesce(func.sum(Feedback.rating), 0))
+        .where(Feedback.recipe_id == Dish.id)
+        .scalar_subquery()
+    )
+    rating_count = (
+        select(func.count(Feedback.id))
+        .where(Feedback.recipe_id == Dish.id)
+        .scalar_subquery()
+    )
+    max_id = db.session.scalar(select(func.max(Dish.id))) or 0
+    for start in range(1, max_id + 1, batch_size):
+        batch = Dish.id.between(start, start + batch_size - 1)
+        db.session.execute(update(Dish).where(batch).values(rating_sum=rating_sum, rating_count=rating_count))
+        # Гистограмма оценок строится заново по тем же отзывам
+        in_batch = RatingBucket.recipe_id.between(start, start + batch_size - 1)
+        db.session.execute(delete(RatingBucket).where(in_batch))
+        db.session.execute(insert(RatingBucket).from_select(
+            ['recipe_id', 'rating', 'count'],
+            select(Feedback.recipe_id, Feedback.rating, func.count())
+            .where(Feedback.recipe_id.between(start, start + batch_size - 1))
+            .group_by(Feedback.recipe_id, Feedback.rating)
+        ))
+        db.session.commit()
+    click.echo('Агрегаты оценок пересчитаны.')
@@ -0,0 +1,103 @@
+import re
+
+from sqlalchemy import Float, Integer, select, text
+from sqlalchemy.dialects.mysql import match
+
+from models import db, Dish
+from pagination import paginate_keyset
+
+# Веса полей при ранжировании в SQLite FTS5: название, ингредиенты, шаги
+FTS_WEIGHTS = (10.0, 2.0, 1.0)
+
+
+def _terms(query):
+    return re.findall(r'\w+', query.lower())
+
+
+def _is_sqlite():
+    return db.engine.dialect.name == 'sqlite'
+
+
+def index_dish(dish):
+    """Обновляет запись блюда в поисковом индексе в текущей транзакции.
+
+    В MySQL FULLTEXT-индекс поддерживается самой InnoDB, в SQLite — таблица FTS5.
+    """
+    if not _is_sqlite():
+        return
+    unindex_dish(dish.id)
+    db.session.execute(
+        text('INSERT INTO recipes_fts (rowid, title, ingredients, steps) VALUES (:id, :title, :ingredients, :steps)'),
+        {'id': dish.id, 'title': dish.title, 'ingredients': dish.ingredients, 'steps': dish.steps},
+    )
+
+
+def index_rows(rows):
+    """Пакетно добавляет в индекс новые блюда: словари с id, title, ingredients, steps."""
+    if _is_sqlite() and rows:
+        db.session.execute(
+            text('INSERT INTO recipes_fts (rowid, title, ingredients, steps) VALUES (:id, :title, :ingredients, :steps)'),
+            rows,
+        )
+
+
+def unindex_dish(dish_id):
+    if _is_sqlite():
+        db.session.execute(text('DELETE FROM recipes_fts WHERE rowid = :id'), {'id': dish_id})
+
+
+def reindex_all(batch_size=1000):
+    """Полностью перестраивает поисковый индекс, возвращает число блюд."""
+    if not _is_sqlite():
+        db.session.execute(text(
+            'ALTER TABLE recipes DROP INDEX ft_recipes_search, '
+            'ADD FULLTEXT INDEX ft_recipes_search (title, ingredients, steps)'
+        ))
+        return db.session.scalar(select(db.func.count(Dish.id)))
+    db.session.execute(text('DELETE FROM recipes_fts'))
+    total, last_id = 0, 0
+    while True:
+        rows = db.session.execute(
+            select(Dish.id, Dish.title, Dish.ingredients, Dish.steps)
+            .where(Dish.id > last_id)
+            .order_by(Dish.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        index_rows([row._asdict() for row in rows])
+        db.session.commit()
+        total += len(rows)
+        last_id = rows[-1].id
+    return total
+
+
+def _hits(terms):
+    """Подзапрос (id, score) совпавших блюд; чем больше score, тем выше в выдаче."""
+    if _is_sqlite():
+        weights = ', '.join(str(w) for w in FTS_WEIGHTS)
+        fts_query = ' '.join(f'"{term}"*' for term in terms)
+        return (
+            text(f'SELECT rowid AS id, -bm25(recipes_fts, {weights}) AS score '
+                 'FROM recipes_fts WHERE recipes_fts MATCH :query')
+            .bindparams(query=fts_query)
+            .columns(id=Integer, score=Float)
+            .subquery('hits')
+        )
+    relevance = match(Dish.title, Dish.ingredients, Dish.steps, against=' '.join(terms)).in_natural_language_mode()
+    return select(Dish.id.label('id'), relevance.label('score')).where(relevance > 0).subquery('hits')
+
+
+def search_dishes(query, cursor=None, per_page=10):
+    """Ищет блюда по названию, ингредиентам и шагам; страница упорядочена по релевантности."""
+    terms = _terms(query)
+    if not terms:
+        return None
+    hits = _hits(terms)
+    rows_query = db.session.query(Dish, hits.c.score).join(hits, hits.c.id == Dish.id)
+    page = paginate_keyset(
+        rows_query, [hits.c.score, Dish.id], cursor, per_page=per_page,
+        key=lambda row: (row.score, row.Dish.id),
+    )
+    page.items = [dish for dish, score in page.items]
+    return page
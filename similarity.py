@@ -0,0 +1,239 @@
+import hashlib
+import random
+import re
+from collections import defaultdict
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import delete, insert, select, update
+
+from models import db, Dish, RecipeBand, RecipeNeighbour, RecipeSignature
+
+# 32 полосы по 2 значения MinHash: кандидатами становятся блюда с похожестью
+# примерно от 0.2 (порог LSH (1/32)^(1/2)), точный Jaccard считается только для них
+NUM_PERM = 64
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+# Сколько соседей хранится и показывается для блюда
+NEIGHBOURS = 6
+MIN_SIMILARITY = 0.1
+# Корзины LSH с большим числом блюд (общие ингредиенты вроде «соль, вода») не дают кандидатов
+MAX_BUCKET = 500
+
+_MERSENNE = (1 << 61) - 1
+_rng = random.Random(20240601)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE), _rng.randrange(0, _MERSENNE)) for _ in range(NUM_PERM)]
+
+# Единицы измерения и служебные слова, не описывающие сам ингредиент
+STOPWORDS = {
+    'г', 'гр', 'грамм', 'кг', 'мл', 'л', 'литр', 'шт', 'штук', 'штуки', 'ст', 'ч', 'ложка', 'ложки',
+    'ложек', 'столовая', 'столовые', 'чайная', 'чайные', 'стакан', 'стакана', 'щепотка', 'пучок',
+    'зубчик', 'зубчика', 'по', 'вкусу', 'для', 'и', 'или', 'на', 'с', 'без', 'из', 'a', 'the', 'of',
+}
+
+
+def ingredient_tokens(text):
+    """Множество нормализованных слов списка ингредиентов.
+
+    Markdown, числа и единицы измерения отбрасываются, слова приводятся к
+    нижнему регистру и обрезаются до пяти букв, чтобы «свекла» и «свеклы» совпали.
+    """
+    words = re.findall(r'[^\W\d_]+', (text or '').lower())
+    return {word[:5] for word in words if len(word) > 2 and word not in STOPWORDS}
+
+
+def _token_hash(token):
+    return int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def minhash(tokens):
+    """Сигнатура MinHash множества: NUM_PERM минимумов хешей при разных перестановках."""
+    if not tokens:
+        return []
+    hashes = [_token_hash(token) for token in tokens]
+    return [min((a * h + b) % _MERSENNE for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def band_buckets(signature):
+    """Номера корзин LSH по полосам сигнатуры: (полоса, корзина)."""
+    buckets = []
+    for band in range(BANDS if signature else 0):
+        chunk = ','.join(str(value) for value in signature[band * ROWS:(band + 1) * ROWS])
+        digest = hashlib.blake2b(chunk.encode('ascii'), digest_size=8).digest()
+        buckets.append((band, int.from_bytes(digest, 'big') >> 1))
+    return buckets
+
+
+def jaccard(left, right):
+    if not left or not right:
+        return 0.0
+    return len(left & right) / len(left | right)
+
+
+def _top(scores):
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    return [(dish_id, score) for dish_id, score in ranked if score >= MIN_SIMILARITY][:NEIGHBOURS]
+
+
+def _neighbour_rows(dish_id, top):
+    return [{'recipe_id': dish_id, 'neighbour_id': other, 'score': score} for other, score in top]
+
+
+def _tokens_of(dish_ids):
+    rows = db.session.execute(
+        select(RecipeSignature.recipe_id, RecipeSignature.tokens).where(RecipeSignature.recipe_id.in_(dish_ids))
+    )
+    return {recipe_id: set(tokens) for recipe_id, tokens in rows}
+
+
+def _candidates(dish_id, buckets):
+    """Блюда, попавшие хотя бы в одну корзину LSH вместе с dish_id."""
+    found = set()
+    for band, bucket in buckets:
+        members = db.session.scalars(
+            select(RecipeBand.recipe_id)
+            .where(RecipeBand.band == band, RecipeBand.bucket == bucket, RecipeBand.recipe_id != dish_id)
+            .limit(MAX_BUCKET + 1)
+        ).all()
+        if len(members) <= MAX_BUCKET:
+            found.update(members)
+    return found
+
+
+def forget_dish(dish_id):
+    """Убирает блюдо из индекса и из списков соседей других блюд."""
+    db.session.execute(delete(RecipeNeighbour).where(RecipeNeighbour.neighbour_id == dish_id))
+    db.session.execute(delete(RecipeNeighbour).where(RecipeNeighbour.recipe_id == dish_id))
+    db.session.execute(delete(RecipeBand).where(RecipeBand.recipe_id == dish_id))
+    db.session.execute(delete(RecipeSignature).where(RecipeSignature.recipe_id == dish_id))
+
+
+def update_dish(dish_id):
+    """Пересчитывает сигнатуру блюда и соседей для него и для его кандидатов.
+
+    Блюдо попадает в списки кандидатов, если похоже сильнее их последнего соседа;
+    списки, из которых блюдо ушло после правки или удаления, укорачиваются до
+    следующей сборки. Возвращает id блюд, у которых изменился список соседей.
+    """
+    ingredients = db.session.scalar(select(Dish.ingredients).where(Dish.id == dish_id))
+    previous_holders = set(db.session.scalars(
+        select(RecipeNeighbour.recipe_id).where(RecipeNeighbour.neighbour_id == dish_id)
+    ))
+    forget_dish(dish_id)
+    if ingredients is None:
+        _touch(previous_holders)
+        return previous_holders
+    tokens = ingredient_tokens(ingredients)
+    signature = minhash(tokens)
+    buckets = band_buckets(signature)
+    db.session.add(RecipeSignature(recipe_id=dish_id, tokens=sorted(tokens), signature=signature))
+    if buckets:
+        db.session.execute(insert(RecipeBand), [
+            {'band': band, 'bucket': bucket, 'recipe_id': dish_id} for band, bucket in buckets
+        ])
+    candidates = _tokens_of(_candidates(dish_id, buckets))
+    scores = {other: jaccard(tokens, other_tokens) for other, other_tokens in candidates.items()}
+    top = _top(scores)
+    if top:
+        db.session.execute(insert(RecipeNeighbour), _neighbour_rows(dish_id, top))
+    changed = {dish_id} | previous_holders
+    for other, score in top:
+        current = dict(db.session.execute(
+            select(RecipeNeighbour.neighbour_id, RecipeNeighbour.score).where(RecipeNeighbour.recipe_id == other)
+        ).all())
+        current[dish_id] = score
+        kept = _top(current)
+        if dish_id not in dict(kept):
+            continue
+        db.session.execute(delete(RecipeNeighbour).where(RecipeNeighbour.recipe_id == other))
+        db.session.execute(insert(RecipeNeighbour), _neighbour_rows(other, kept))
+        changed.add(other)
+    _touch(changed)
+    return changed
+
+
+def _touch(dish_ids):
+    # Список соседей входит в страницу блюда: меняем её валидатор HTTP-кеша
+    if dish_ids:
+        db.session.execute(
+            update(Dish).where(Dish.id.in_(dish_ids)).values(updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+
+
+def build_index(batch_size=1000):
+    """Полностью перестраивает сигнатуры, корзины LSH и таблицу соседей; возвращает число блюд."""
+    db.session.execute(delete(RecipeNeighbour))
+    db.session.execute(delete(RecipeBand))
+    db.session.execute(delete(RecipeSignature))
+    tokens_by_dish = {}
+    members = defaultdict(list)
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(Dish.id, Dish.ingredients).where(Dish.id > last_id).order_by(Dish.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        signatures, bands = [], []
+        for dish_id, ingredients in rows:
+            tokens = ingredient_tokens(ingredients)
+            signature = minhash(tokens)
+            tokens_by_dish[dish_id] = tokens
+            signatures.append({'recipe_id': dish_id, 'tokens': sorted(tokens), 'signature': signature})
+            for band, bucket in band_buckets(signature):
+                bands.append({'band': band, 'bucket': bucket, 'recipe_id': dish_id})
+                members[band, bucket].append(dish_id)
+        db.session.execute(insert(RecipeSignature), signatures)
+        if bands:
+            db.session.execute(insert(RecipeBand), bands)
+        db.session.commit()
+        last_id = rows[-1].id
+
+    candidates = defaultdict(set)
+    for dish_ids in members.values():
+        if 1 < len(dish_ids) <= MAX_BUCKET:
+            for dish_id in dish_ids:
+                candidates[dish_id].update(dish_ids)
+    neighbours = []
+    for dish_id, tokens in tokens_by_dish.items():
+        others = candidates.get(dish_id, set()) - {dish_id}
+        top = _top({other: jaccard(tokens, tokens_by_dish[other]) for other in others})
+        neighbours.extend(_neighbour_rows(dish_id, top))
+        if len(neighbours) >= batch_size:
+            db.session.execute(insert(RecipeNeighbour), neighbours)
+            db.session.commit()
+            neighbours = []
+    if neighbours:
+        db.session.execute(insert(RecipeNeighbour), neighbours)
+    db.session.commit()
+    dish_ids = sorted(tokens_by_dish)
+    for start in range(0, len(dish_ids), batch_size):
+        _touch(dish_ids[start:start + batch_size])
+        db.session.commit()
+    return len(tokens_by_dish)
+
+
+def similar_dishes(dish_id):
+    """Соседи блюда из готовой таблицы: (id, название, похожесть), одним запросом по индексу."""
+    return db.session.execute(
+        select(Dish.id, Dish.title, RecipeNeighbour.score)
+        .join(Dish, Dish.id == RecipeNeighbour.neighbour_id)
+        .where(RecipeNeighbour.recipe_id == dish_id)
+        .order_by(RecipeNeighbour.score.desc(), RecipeNeighbour.neighbour_id)
+        .limit(NEIGHBOURS)
+    ).all()
+
+
+@click.group('similarity')
+def similarity_cli():
+    """Индекс похожих блюд по ингредиентам."""
+
+
+@similarity_cli.command('build')
+@click.option('--batch-size', default=1000, show_default=True, help='Число блюд в одной транзакции.')
+@with_appcontext
+def build_command(batch_size):
+    """Перестраивает индекс похожих блюд с нуля."""
+    click.echo(f'Проиндексировано блюд: {build_index(batch_size)}.')
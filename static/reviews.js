@@ -0,0 +1,10 @@
+// «Показать ещё»: следующая страница отзывов подставляется вместо кнопки
+document.getElementById('reviews').addEventListener('click', async (event) => {
+  const link = event.target.closest('[data-fragment-url]');
+  if (!link) return;
+  event.preventDefault();
+  const response = await fetch(link.dataset.fragmentUrl, { credentials: 'same-origin' });
+  if (response.ok) {
+    link.closest('[data-reviews-more]').outerHTML = await response.text();
+  }
+});
@@ -0,0 +1,74 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from flask import current_app
+
+CHUNK_SIZE = 64 * 1024
+# Путь контентно-адресуемого файла: ab/cd/abcd...<sha256>.ext
+BLOB_PATH_RE = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.[a-z0-9]+)*$')
+
+
+def _extension(filename):
+    ext = os.path.splitext(filename or '')[1].lower()
+    return ext if re.fullmatch(r'\.[a-z0-9]{1,10}', ext) else ''
+
+
+def blob_path(digest, ext):
+    return f'{digest[:2]}/{digest[2:4]}/{digest}{ext}'
+
+
+def is_blob_path(path):
+    return bool(BLOB_PATH_RE.match(path))
+
+
+def store_upload(file_storage):
+    """Потоково сохраняет загрузку, именуя файл по SHA-256 содержимого.
+
+    Возвращает (хеш, относительный путь); одинаковое содержимое хранится один раз.
+    """
+    folder = current_app.config['UPLOAD_FOLDER']
+    # Каталог загрузок создаётся здесь, а не при запуске приложения
+    os.makedirs(folder, exist_ok=True)
+    hasher = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = file_storage.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                out.write(chunk)
+        digest = hasher.hexdigest()
+        relpath = blob_path(digest, _extension(file_storage.filename))
+        dest = os.path.join(folder, relpath)
+        if os.path.exists(dest):
+            os.remove(tmp_path)
+            # Строка Photo появится только после коммита: свежее время изменения
+            # не даёт очистке удалить файл как старый и ничейный
+            os.utime(dest)
+        else:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            os.replace(tmp_path, dest)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return digest, relpath
+
+
+def remove_files(filenames, modified_before=None):
+    """Удаляет файлы из UPLOAD_FOLDER, отсутствующие пропускает.
+
+    Файлы, изменённые позже modified_before (время Unix), не трогаются.
+    """
+    folder = current_app.config['UPLOAD_FOLDER']
+    for filename in filenames:
+        path = os.path.join(folder, filename)
+        try:
+            if modified_before is None or os.path.getmtime(path) <= modified_before:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -1,23 +1,79 @@
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from PIL import Image
 import pytest
-from app import app, db
-from models import Account, UserRole, Dish, Feedback
+from sqlalchemy import event, or_
+from flask_migrate import downgrade, upgrade
+from app import create_app, db, init_migrate
+from models import Account, UserRole, Dish, Feedback, Photo, Job, RatingBucket, RecipeNeighbour
+from search import search_dishes
+from similarity import ingredient_tokens
+from fragments import fragment_cache, FragmentCache, MemoryBackend, FileSystemBackend
 from flask import url_for
+from metrics import metrics, SamplingProfiler
+from identity import identity_cache
+from jobs import HANDLERS, enqueue, job, run_due, run_pending, sweep_uploads
+from benchmarks.compare import compare
+from benchmarks.datagen import generate
+from benchmarks.startup import measure_startup
 
+# Допустимое число SQL-запросов на один GET-запрос к странице
+QUERY_BUDGETS = {
+    '/': 3,
+    # блюдо, фото, своя оценка, первая страница отзывов, гистограмма и похожие блюда —
+    # не зависит от числа отзывов и блюд
+    '/dish/1': 7,
+}
+
+# База тестов. {worker} заменяется именем процесса pytest-xdist (gw0, gw1, ...), чтобы при
+# pytest -n параллельные процессы не делили одну серверную БД; SQLite в памяти своя у каждого приложения
+TEST_DATABASE_URL = os.getenv('TEST_DATABASE_URL', 'sqlite:///:memory:')
+
+# Не app: для фикстуры с таким именем pytest-flask держит контекст запроса открытым
+# весь тест, и запросы тестового клиента делили бы с ним g и сессию БД
 @pytest.fixture
-def client():
-    app.config['TESTING'] = True
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
-    with app.test_client() as client:
-        with app.app_context():
-            db.create_all()
-            # Создаем роли
-            admin_role = UserRole(name='Администратор', description='Админ')
-            user_role = UserRole(name='Пользователь', description='Обычный пользователь')
-            db.session.add_all([admin_role, user_role])
-            db.session.commit()
+def flask_app(tmp_path, tmp_path_factory):
+    app = create_app({
+        'TESTING': True,
+        'SECRET_KEY': 'test',
+        'SQLALCHEMY_DATABASE_URI': TEST_DATABASE_URL.format(worker=os.getenv('PYTEST_XDIST_WORKER', 'main')),
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        # Не внутри tmp_path: тесты загрузок используют его как UPLOAD_FOLDER и проверяют состав файлов
+        'FRAGMENT_CACHE_DIR': str(tmp_path_factory.mktemp('fragments')),
+        'WTF_CSRF_ENABLED': False,
+        # Фоновые задачи выполняются сразу после коммита, в потоке теста
+        'JOB_RUNNER': 'inline',
+        'LOG_FILE': '',
+    })
+    # Каждый тест начинается с пустой базы, поэтому и кеши пустые
+    fragment_cache.clear()
+    identity_cache.clear()
+    with app.app_context():
+        db.create_all()
+        # Создаем роли
+        admin_role = UserRole(name='Администратор', description='Админ')
+        user_role = UserRole(name='Пользователь', description='Обычный пользователь')
+        db.session.add_all([admin_role, user_role])
+        db.session.commit()
+    yield app
+    with app.app_context():
+        db.drop_all()
+        for engine in db.engines.values():
+            engine.dispose()
+
+@pytest.fixture
+def client(flask_app):
+    with flask_app.test_client() as client:
         yield client
-        with app.app_context():
-            db.drop_all()
 
 def register(client, username, password, role_id=2):
     return client.post('/register', data={
@@ -35,9 +91,9 @@ def login(client, username, password):
         'password': password
     }, follow_redirects=True)
 
-def add_recipe(client, token=None):
+def add_recipe(client, token=None, title='Тестовый рецепт'):
     data = {
-        'title': 'Тестовый рецепт',
+        'title': title,
         'description': 'Описание',
         'cooking_time': 30,
         'servings': 2,
@@ -52,6 +108,30 @@ def add_feedback(client, recipe_id, rating=5, comment='Отлично!'):
         'comment': comment
     }, follow_redirects=True)
 
+@contextmanager
+def count_queries(app):
+    with app.app_context():
+        engine = db.engine
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+def assert_query_budget(client, url):
+    with count_queries(client.application) as statements:
+        rv = client.get(url)
+    assert rv.status_code == 200
+    budget = QUERY_BUDGETS[url]
+    assert len(statements) <= budget, (
+        f'{url}: {len(statements)} запросов при бюджете {budget}:\n' + '\n'.join(statements)
+    )
+
 def logout(client):
     return client.get('/logout', follow_redirects=True)
 
@@ -119,7 +199,7 @@ def test_admin_can_edit_delete_any_recipe(client):
     logout(client)
     register(client, 'user9', 'pass9')
     login(client, 'user9', 'pass9')
-    add_recipe(client)
+    add_recipe(client, title='Рецепт пользователя')
     logout(client)
     login(client, 'admin2', 'adminpass2')
     rv = client.get('/edit-dish/2')
@@ -142,6 +222,82 @@ def test_add_feedback_twice(client):
     rv = add_feedback(client, 1)
     assert 'Вы уже оставляли отзыв' in rv.data.decode('utf-8')
 
+def test_edit_recipe_rejects_duplicate_title(client, flask_app):
+    register(client, 'user50', 'pass50')
+    login(client, 'user50', 'pass50')
+    add_recipe(client, title='Первое')
+    add_recipe(client, title='Второе')
+    rv = client.post('/edit-dish/2', data={
+        'title': 'Первое', 'description': 'Описание', 'cooking_time': 30,
+        'servings': 2, 'ingredients': 'Ингредиенты', 'steps': 'Шаги'
+    }, follow_redirects=True)
+    assert 'Блюдо с таким названием уже существует' in rv.data.decode('utf-8')
+    with flask_app.app_context():
+        assert db.session.get(Dish, 2).title == 'Второе'
+
+def test_feedback_updates_rating_aggregates(client, flask_app):
+    register(client, 'user16', 'pass16')
+    login(client, 'user16', 'pass16')
+    add_recipe(client)
+    add_feedback(client, 1, rating=4)
+    logout(client)
+    register(client, 'user17', 'pass17')
+    login(client, 'user17', 'pass17')
+    add_feedback(client, 1, rating=1)
+    with flask_app.app_context():
+        dish = db.session.get(Dish, 1)
+        assert (dish.rating_sum, dish.rating_count) == (5, 2)
+        assert dish.rating_avg == 2.5
+    rv = client.get('/')
+    assert '2.5' in rv.data.decode('utf-8')
+
+def test_reviews_paged_with_histogram(client, flask_app):
+    register(client, 'user51', 'pass51')
+    login(client, 'user51', 'pass51')
+    add_recipe(client)
+    with flask_app.app_context():
+        dish = db.session.get(Dish, 1)
+        for i in range(24):
+            account = Account(username=f'critic{i}', password_hash='-', last_name='Критик',
+                              first_name=f'Номер{i}', role_id=2)
+            db.session.add(account)
+            db.session.flush()
+            db.session.add(Feedback(recipe_id=1, user_id=account.id, rating=i % 3, text=f'Отзыв {i}',
+                                    text_html=f'<p>Отзыв {i}</p>', created_at=datetime(2024, 1, 1, 0, i)))
+            dish.add_rating(i % 3)
+        db.session.commit()
+    add_feedback(client, 1, rating=5, comment='Мой отзыв')
+    html = client.get('/dish/1').data.decode('utf-8')
+    assert html.count('Отзыв ') == 10 and 'Ваш отзыв:' in html and 'Мой отзыв' in html
+    assert re.search(r'>8</span>', html) and 'отзывов: 25' in html
+    assert 'Редактировать' in html
+    more = re.search(r'data-fragment-url="([^"]+)"', html).group(1).replace('&amp;', '&')
+    fragment = client.get(more).data.decode('utf-8')
+    assert 'Отзыв 10' in fragment and 'Отзыв 9<' not in fragment and fragment.count('card-body') == 10
+    last = re.search(r'data-fragment-url="([^"]+)"', fragment).group(1).replace('&amp;', '&')
+    fragment = client.get(last).data.decode('utf-8')
+    assert fragment.count('card-body') == 5 and 'Мой отзыв' in fragment
+    assert 'data-fragment-url' not in fragment
+    with flask_app.app_context():
+        assert RatingBucket.histogram(1) == {0: 8, 1: 8, 2: 8, 5: 1}
+
+def test_recount_ratings_command(client, flask_app):
+    register(client, 'user18', 'pass18')
+    login(client, 'user18', 'pass18')
+    add_recipe(client)
+    add_feedback(client, 1, rating=3)
+    with flask_app.app_context():
+        dish = db.session.get(Dish, 1)
+        dish.rating_sum, dish.rating_count = 0, 0
+        RatingBucket.bump([(1, 3, 5), (1, 4, 1)])
+        db.session.commit()
+    result = flask_app.test_cli_runner().invoke(args=['recount-ratings'])
+    assert result.exit_code == 0
+    with flask_app.app_context():
+        dish = db.session.get(Dish, 1)
+        assert (dish.rating_sum, dish.rating_count) == (3, 1)
+        assert RatingBucket.histogram(1) == {3: 1}
+
 def test_feedback_unauth(client):
     register(client, 'user12', 'pass12')
     login(client, 'user12', 'pass12')
@@ -150,6 +306,10 @@ def test_feedback_unauth(client):
     rv = add_feedback(client, 1)
     assert 'Для выполнения данного действия необходимо пройти процедуру аутентификации' in rv.data.decode('utf-8')
 
+def next_cursor(html, label):
+    match = re.search(r'href="[^"]*cursor=([^"&]+)">' + label, html)
+    return match.group(1) if match else None
+
 def test_pagination(client):
     register(client, 'user13', 'pass13')
     login(client, 'user13', 'pass13')
@@ -162,10 +322,859 @@ def test_pagination(client):
             'ingredients': 'Ингредиенты',
             'steps': 'Шаги'
         }, follow_redirects=True)
-    rv = client.get('/')
-    assert 'Рецепт 0' in rv.data.decode('utf-8') and 'Рецепт 10' not in rv.data.decode('utf-8')
-    rv = client.get('/?page=2')
-    assert 'Рецепт 10' in rv.data.decode('utf-8')
+    first = client.get('/').data.decode('utf-8')
+    assert '>Рецепт 11<' in first and '>Рецепт 2<' in first and '>Рецепт 1<' not in first
+    assert next_cursor(first, 'Назад') is None
+    cursor = next_cursor(first, 'Вперёд')
+    second = client.get(f'/?cursor={cursor}').data.decode('utf-8')
+    assert '>Рецепт 1<' in second and '>Рецепт 0<' in second and '>Рецепт 2<' not in second
+    assert next_cursor(second, 'Вперёд') is None
+    back = client.get(f"/?cursor={next_cursor(second, 'Назад')}").data.decode('utf-8')
+    assert '>Рецепт 11<' in back and '>Рецепт 2<' in back and '>Рецепт 1<' not in back
+    assert next_cursor(back, 'Назад') is None
+
+def test_pagination_bad_cursor(client):
+    register(client, 'user19', 'pass19')
+    login(client, 'user19', 'pass19')
+    add_recipe(client)
+    rv = client.get('/?cursor=garbage')
+    assert rv.status_code == 200 and 'Тестовый рецепт' in rv.data.decode('utf-8')
+
+def test_pagination_approx_total(client, flask_app):
+    flask_app.config['FEED_APPROX_TOTAL'] = True
+    try:
+        register(client, 'user20', 'pass20')
+        login(client, 'user20', 'pass20')
+        add_recipe(client)
+        rv = client.get('/')
+        assert 'Всего рецептов: около' in rv.data.decode('utf-8')
+    finally:
+        flask_app.config['FEED_APPROX_TOTAL'] = False
+
+def test_markdown_rendered_once_at_write_time(client, flask_app, monkeypatch):
+    import rendering
+    register(client, 'user21', 'pass21')
+    login(client, 'user21', 'pass21')
+    add_recipe(client)
+    add_feedback(client, 1, comment='**вкусно**')
+    client.post('/edit-dish/1', data={
+        'title': 'Тестовый рецепт',
+        'description': '# Новое <script>alert(1)</script>',
+        'cooking_time': 30,
+        'servings': 2,
+        'ingredients': 'Ингредиенты',
+        'steps': 'Шаги'
+    }, follow_redirects=True)
+    with flask_app.app_context():
+        dish = db.session.get(Dish, 1)
+        assert '<h1>' in dish.description_html and '<script>' not in dish.description_html
+        assert '<strong>вкусно</strong>' in db.session.get(Feedback, 1).text_html
+
+    def fail(text):
+        raise AssertionError('Markdown не должен рендериться при чтении')
+    monkeypatch.setattr(rendering, 'render_markdown', fail)
+    html = client.get('/dish/1').data.decode('utf-8')
+    assert '<h1>Новое' in html and '<strong>вкусно</strong>' in html
+
+def test_legacy_rows_render_through_bounded_cache(client, flask_app):
+    import rendering
+    register(client, 'user22', 'pass22')
+    login(client, 'user22', 'pass22')
+    add_recipe(client)
+    with flask_app.app_context():
+        dish = db.session.get(Dish, 1)
+        dish.description, dish.description_html = '*старое*', None
+        db.session.commit()
+    assert '<em>старое</em>' in client.get('/dish/1').data.decode('utf-8')
+    cache = rendering.RenderCache(maxsize=2)
+    for text in ('a', 'b', 'c'):
+        cache.render(text)
+    assert len(cache) == 2
+    result = flask_app.test_cli_runner().invoke(args=['render-markdown'])
+    assert result.exit_code == 0
+    with flask_app.app_context():
+        assert db.session.get(Dish, 1).description_html == '<p><em>старое</em></p>'
+
+def create_dish(client, title, ingredients='Ингредиенты', steps='Шаги'):
+    return client.post('/create-dish', data={
+        'title': title,
+        'description': 'Описание',
+        'cooking_time': 10,
+        'servings': 1,
+        'ingredients': ingredients,
+        'steps': steps
+    }, follow_redirects=True)
+
+def similar_titles(client, dish_id):
+    html = client.get(f'/dish/{dish_id}').data.decode('utf-8')
+    panel = html.partition('Похожие блюда')[2].partition('</ul>')[0]
+    return re.findall(r'<a href="/dish/\d+">([^<]+)</a>', panel)
+
+def test_similar_dishes_index_tracks_changes(client, flask_app):
+    assert ingredient_tokens('* 300 г свеклы\n* Капуста — 1 шт, соль по вкусу') == {'свекл', 'капус', 'соль'}
+    register(client, 'user52', 'pass52')
+    login(client, 'user52', 'pass52')
+    create_dish(client, 'Борщ', ingredients='* свекла\n* капуста\n* картофель\n* морковь\n* лук')
+    create_dish(client, 'Винегрет', ingredients='* свекла\n* картофель\n* морковь\n* огурцы\n* горошек')
+    create_dish(client, 'Омлет', ingredients='* яйца\n* молоко\n* соль')
+    create_dish(client, 'Щи', ingredients='* капуста\n* картофель\n* морковь\n* лук')
+    assert similar_titles(client, 1) == ['Щи', 'Винегрет']
+    assert similar_titles(client, 3) == []
+    # Правка ингредиентов пересчитывает соседей блюда и его новых кандидатов
+    client.post('/edit-dish/3', data={
+        'title': 'Омлет', 'description': 'Описание', 'cooking_time': 10, 'servings': 1,
+        'ingredients': '* яйца\n* капуста\n* лук\n* морковь', 'steps': 'Шаги'
+    }, follow_redirects=True)
+    assert 'Омлет' in similar_titles(client, 4)
+    incremental = {dish_id: similar_titles(client, dish_id) for dish_id in range(1, 5)}
+    result = flask_app.test_cli_runner().invoke(args=['similarity', 'build'])
+    assert 'Проиндексировано блюд: 4' in result.output
+    assert {dish_id: similar_titles(client, dish_id) for dish_id in range(1, 5)} == incremental
+    client.post('/delete-dish/4', follow_redirects=True)
+    assert 'Щи' not in similar_titles(client, 1)
+    with flask_app.app_context():
+        assert not db.session.scalar(db.select(db.func.count()).select_from(RecipeNeighbour)
+                                     .where(or_(RecipeNeighbour.recipe_id == 4, RecipeNeighbour.neighbour_id == 4)))
+
+def test_renaming_neighbour_refreshes_similar_panels(client):
+    register(client, 'user53', 'pass53')
+    login(client, 'user53', 'pass53')
+    create_dish(client, 'Борщ', ingredients='* свекла\n* капуста\n* картофель\n* морковь\n* лук')
+    create_dish(client, 'Щи', ingredients='* капуста\n* картофель\n* морковь\n* лук')
+    rv = client.get('/dish/2')
+    assert similar_titles(client, 2) == ['Борщ']
+    client.post('/edit-dish/1', data={
+        'title': 'Борщ украинский', 'description': 'Описание', 'cooking_time': 10, 'servings': 1,
+        'ingredients': '* свекла\n* капуста\n* картофель\n* морковь\n* лук', 'steps': 'Шаги'
+    }, follow_redirects=True)
+    rv = client.get('/dish/2', headers={'If-None-Match': rv.headers['ETag']})
+    assert rv.status_code == 200 and 'Борщ украинский' in rv.data.decode('utf-8')
+
+def test_search_ranks_and_tracks_changes(client, flask_app):
+    register(client, 'user23', 'pass23')
+    login(client, 'user23', 'pass23')
+    create_dish(client, 'Борщ', ingredients='свекла, капуста')
+    create_dish(client, 'Салат', ingredients='свекла, чеснок')
+    create_dish(client, 'Омлет', ingredients='яйца', steps='Взбить яйца')
+    html = client.get('/search?q=борщ').data.decode('utf-8')
+    assert 'Борщ' in html and 'Салат' not in html
+    html = client.get('/search?q=свекла').data.decode('utf-8')
+    assert 'Борщ' in html and 'Салат' in html and 'Омлет' not in html
+    with flask_app.test_request_context():
+        titles = [dish.title for dish in search_dishes('свекла борщ').items]
+    assert titles == ['Борщ']
+    client.post('/edit-dish/3', data={
+        'title': 'Омлет', 'description': 'Описание', 'cooking_time': 10,
+        'servings': 1, 'ingredients': 'яйца, свекла', 'steps': 'Взбить'
+    }, follow_redirects=True)
+    client.post('/delete-dish/1', follow_redirects=True)
+    html = client.get('/search?q=свекла').data.decode('utf-8')
+    assert 'Омлет' in html and 'Салат' in html and 'Борщ' not in html
+
+def test_search_keyset_pages(client, flask_app):
+    register(client, 'user24', 'pass24')
+    login(client, 'user24', 'pass24')
+    for i in range(12):
+        create_dish(client, f'Суп {i}', ingredients='картофель')
+    with flask_app.test_request_context():
+        first = search_dishes('картофель', per_page=10)
+        second = search_dishes('картофель', first.next_cursor, per_page=10)
+    assert len(first.items) == 10 and len(second.items) == 2
+    assert not {d.id for d in first.items} & {d.id for d in second.items}
+    assert not second.has_next
+
+def test_reindex_search_command(client, flask_app):
+    register(client, 'user25', 'pass25')
+    login(client, 'user25', 'pass25')
+    create_dish(client, 'Плов', ingredients='рис')
+    with flask_app.app_context():
+        db.session.execute(db.text('DELETE FROM recipes_fts'))
+        db.session.commit()
+    assert 'Плов' not in client.get('/search?q=рис').data.decode('utf-8')
+    result = flask_app.test_cli_runner().invoke(args=['reindex-search'])
+    assert result.exit_code == 0
+    assert 'Плов' in client.get('/search?q=рис').data.decode('utf-8')
+
+def image_upload(name, size=(2400, 1600)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 80, 40)).save(buffer, 'JPEG')
+    buffer.seek(0)
+    return buffer, name
+
+def test_photo_variants_generated(client, flask_app, tmp_path, monkeypatch):
+    monkeypatch.setitem(flask_app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setitem(flask_app.config, 'UPLOAD_GRACE_SECONDS', 0)
+    register(client, 'user26', 'pass26')
+    login(client, 'user26', 'pass26')
+    client.post('/create-dish', data={
+        'title': 'С фото', 'description': 'Описание', 'cooking_time': 10, 'servings': 1,
+        'ingredients': 'Ингредиенты', 'steps': 'Шаги',
+        'photos': [image_upload('dish.jpg')]
+    }, content_type='multipart/form-data', follow_redirects=True)
+    with flask_app.app_context():
+        photo = Photo.query.one()
+        assert photo.variants == 'card,card.webp,detail,detail.webp'
+        with Image.open(tmp_path / photo.variant_filename('card')) as card:
+            assert card.width <= 480 and card.height <= 250
+        with Image.open(tmp_path / photo.variant_filename('detail.webp')) as detail:
+            assert detail.format == 'WEBP' and detail.width <= 1200
+        card_url = '/uploads/' + photo.variant_filename('card')
+    html = client.get('/').data.decode('utf-8')
+    assert card_url in html and 'type="image/webp"' in html
+    html = client.get('/dish/1').data.decode('utf-8')
+    assert '.detail.jpg' in html and '.card.webp 480w' in html
+    client.post('/delete-dish/1', follow_redirects=True)
+    assert [files for _, _, files in os.walk(tmp_path) if files] == []
+
+def stored_files(folder):
+    return sorted(os.path.relpath(os.path.join(root, name), folder)
+                  for root, _, files in os.walk(folder) for name in files)
+
+def test_photos_content_addressed_and_deduplicated(client, flask_app, tmp_path, monkeypatch):
+    monkeypatch.setitem(flask_app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setitem(flask_app.config, 'UPLOAD_GRACE_SECONDS', 0)
+    register(client, 'user28', 'pass28')
+    login(client, 'user28', 'pass28')
+    for title, uploads in [('Первое', [image_upload('IMG_0001.jpg', (64, 64))]),
+                           ('Второе', [image_upload('copy.jpg', (64, 64))]),
+                           ('Третье', [image_upload('IMG_0001.jpg', (32, 32))])]:
+        client.post('/create-dish', data={
+            'title': title, 'description': 'Описание', 'cooking_time': 10, 'servings': 1,
+            'ingredients': 'Ингредиенты', 'steps': 'Шаги', 'photos': uploads
+        }, content_type='multipart/form-data', follow_redirects=True)
+    with flask_app.app_context():
+        photos = Photo.query.order_by(Photo.id).all()
+        assert photos[0].filename == photos[1].filename != photos[2].filename
+        assert re.fullmatch(r'[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.jpg', photos[0].filename)
+        shared = photos[0].filename
+    originals = [f for f in stored_files(tmp_path) if f.count('.') == 1]
+    assert len(originals) == 2
+    rv = client.get('/uploads/' + shared)
+    assert rv.status_code == 200 and 'immutable' in rv.headers['Cache-Control']
+    rv.close()
+    client.post('/delete-dish/1', follow_redirects=True)
+    assert shared in stored_files(tmp_path)
+    client.post('/delete-dish/2', follow_redirects=True)
+    assert shared not in stored_files(tmp_path)
+    assert len(stored_files(tmp_path)) == 5
+
+def test_legacy_photo_file_shared_by_two_dishes_kept_until_last_delete(client, flask_app, tmp_path, monkeypatch):
+    monkeypatch.setitem(flask_app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setitem(flask_app.config, 'UPLOAD_GRACE_SECONDS', 0)
+    register(client, 'user55', 'pass55')
+    login(client, 'user55', 'pass55')
+    add_recipe(client, title='Первое')
+    add_recipe(client, title='Второе')
+    # До контентной адресации файл назывался по имени от клиента и мог достаться двум фото
+    (tmp_path / 'photo.jpg').write_bytes(b'x')
+    with flask_app.app_context():
+        db.session.add_all([Photo(filename='photo.jpg', mime_type='image/jpeg', recipe_id=1),
+                            Photo(filename='photo.jpg', mime_type='image/jpeg', recipe_id=2)])
+        db.session.commit()
+    client.post('/delete-dish/1', follow_redirects=True)
+    assert stored_files(tmp_path) == ['photo.jpg']
+    client.post('/delete-dish/2', follow_redirects=True)
+    assert stored_files(tmp_path) == []
+
+def test_reused_blob_is_protected_until_its_row_commits(client, flask_app, tmp_path, monkeypatch):
+    monkeypatch.setitem(flask_app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    register(client, 'user56', 'pass56')
+    login(client, 'user56', 'pass56')
+    for title in ('Первое', 'Второе'):
+        client.post('/create-dish', data={
+            'title': title, 'description': 'Описание', 'cooking_time': 10, 'servings': 1,
+            'ingredients': 'Ингредиенты', 'steps': 'Шаги', 'photos': [image_upload('same.jpg', (64, 64))]
+        }, content_type='multipart/form-data', follow_redirects=True)
+        with flask_app.app_context():
+            shared = Photo.query.first().filename
+        if title == 'Первое':
+            os.utime(tmp_path / shared, (0, 0))
+    # Повторная загрузка того же содержимого обновляет время файла
+    assert os.path.getmtime(tmp_path / shared) > 0
+    client.post('/delete-dish/1', follow_redirects=True)
+    client.post('/delete-dish/2', follow_redirects=True)
+    # Свежий файл мог понадобиться незакоммиченной загрузке: его удалит очистка после grace
+    assert shared in stored_files(tmp_path)
+    with flask_app.app_context():
+        assert sweep_uploads(grace=0) > 0
+    assert shared not in stored_files(tmp_path)
+
+def test_first_upload_creates_upload_folder(client, flask_app, tmp_path):
+    folder = tmp_path / 'fresh' / 'uploads'
+    flask_app.config['UPLOAD_FOLDER'] = str(folder)
+    register(client, 'user29', 'pass29')
+    login(client, 'user29', 'pass29')
+    assert not folder.exists()
+    rv = client.post('/create-dish', data={
+        'title': 'С фото', 'description': 'Описание', 'cooking_time': 10, 'servings': 1,
+        'ingredients': 'Ингредиенты', 'steps': 'Шаги', 'photos': [image_upload('first.jpg', (64, 64))]
+    }, content_type='multipart/form-data', follow_redirects=True)
+    assert 'Блюдо успешно добавлено' in rv.data.decode('utf-8')
+    with flask_app.app_context():
+        filename = Photo.query.one().filename
+    assert filename in stored_files(folder)
+
+def test_generate_variants_command(client, flask_app, tmp_path, monkeypatch):
+    monkeypatch.setitem(flask_app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    Image.new('RGB', (800, 600)).save(tmp_path / 'old.png')
+    register(client, 'user27', 'pass27')
+    login(client, 'user27', 'pass27')
+    add_recipe(client)
+    with flask_app.app_context():
+        db.session.add(Photo(filename='old.png', mime_type='image/png', recipe_id=1))
+        db.session.commit()
+    result = flask_app.test_cli_runner().invoke(args=['generate-variants'])
+    assert result.exit_code == 0 and 'Обработано фотографий: 1 из 1' in result.output
+    assert (tmp_path / 'old.card.png').exists() and (tmp_path / 'old.detail.webp').exists()
+
+def test_conditional_get_dish_page(client):
+    register(client, 'user29', 'pass29')
+    login(client, 'user29', 'pass29')
+    add_recipe(client)
+    client.get('/dish/1')
+    rv = client.get('/dish/1')
+    etag = rv.headers['ETag']
+    assert rv.headers['Last-Modified'] and 'no-cache' in rv.headers['Cache-Control']
+    with count_queries(client.application) as statements:
+        rv = client.get('/dish/1', headers={'If-None-Match': etag})
+    assert rv.status_code == 304 and rv.data == b''
+    # Пользователь берётся из кеша, остаётся только выборка даты изменения
+    assert len(statements) == 1
+    add_feedback(client, 1)
+    client.get('/dish/1')
+    rv = client.get('/dish/1', headers={'If-None-Match': etag})
+    assert rv.status_code == 200 and rv.headers['ETag'] != etag
+    logout(client)
+    register(client, 'user30', 'pass30')
+    login(client, 'user30', 'pass30')
+    client.get('/')
+    rv = client.get('/dish/1', headers={'If-None-Match': rv.headers['ETag']})
+    assert rv.status_code == 200
+
+def test_conditional_get_home_page(client):
+    register(client, 'user31', 'pass31')
+    login(client, 'user31', 'pass31')
+    add_recipe(client)
+    etag = client.get('/').headers['ETag']
+    assert client.get('/', headers={'If-None-Match': etag}).status_code == 304
+    add_recipe(client, title='Новое блюдо')
+    client.get('/')
+    assert client.get('/', headers={'If-None-Match': etag}).status_code == 200
+
+def test_responses_compressed_by_accept_encoding(client):
+    register(client, 'user53', 'pass53')
+    login(client, 'user53', 'pass53')
+    add_recipe(client)
+    plain = client.get('/')
+    assert 'Content-Encoding' not in plain.headers
+    rv = client.get('/', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert rv.headers['Content-Encoding'] == 'gzip' and 'Accept-Encoding' in rv.headers['Vary']
+    assert gzip.decompress(rv.data) == plain.data
+    assert int(rv.headers['Content-Length']) == len(rv.data) < len(plain.data)
+    # Сжатый ответ помечает ETag слабым, и он по-прежнему даёт 304
+    assert rv.headers['ETag'].startswith('W/')
+    assert client.get('/', headers={'If-None-Match': rv.headers['ETag'], 'Accept-Encoding': 'gzip'}).status_code == 304
+    assert 'Content-Encoding' not in client.get('/', headers={'Accept-Encoding': 'gzip;q=0'}).headers
+    # Короткие ответы и уже сжатые типы остаются как есть
+    assert 'Content-Encoding' not in client.get('/health', headers={'Accept-Encoding': 'gzip'}).headers
+
+def test_assets_build_fingerprinted_precompressed_copies(client, flask_app, tmp_path, monkeypatch):
+    static = tmp_path / 'static'
+    static.mkdir()
+    shutil.copy(os.path.join(flask_app.root_path, 'static', 'custom.css'), static / 'custom.css')
+    (static / 'logo.png').write_bytes(b'png')
+    monkeypatch.setattr(flask_app, 'static_folder', str(static))
+    monkeypatch.setitem(flask_app.extensions, 'assets', {})
+    result = flask_app.test_cli_runner().invoke(args=['assets', 'build'])
+    assert 'Собрано файлов: 2' in result.output
+    manifest = json.loads((static / 'dist' / 'manifest.json').read_text(encoding='utf-8'))
+    css = manifest['custom.css']
+    assert re.fullmatch(r'custom\.[0-9a-f]{12}\.css', css)
+    assert (static / 'dist' / f'{css}.gz').exists()
+    assert not (static / 'dist' / f'{manifest["logo.png"]}.gz').exists()
+    register(client, 'user54', 'pass54')
+    html = login(client, 'user54', 'pass54').data.decode('utf-8')
+    assert f'/static/dist/{css}' in html
+    rv = client.get(f'/static/dist/{css}', headers={'Accept-Encoding': 'gzip'})
+    assert rv.headers['Content-Encoding'] == 'gzip' and 'immutable' in rv.headers['Cache-Control']
+    assert gzip.decompress(rv.get_data()) == (static / 'custom.css').read_bytes()
+    rv.close()
+    rv = client.get(f'/static/dist/{css}')
+    assert 'Content-Encoding' not in rv.headers and rv.get_data() == (static / 'custom.css').read_bytes()
+    assert rv.mimetype == 'text/css'
+    rv.close()
+
+def test_fragment_cache_hits_and_invalidation(client):
+    register(client, 'user32', 'pass32')
+    login(client, 'user32', 'pass32')
+    # Ингредиенты разные: блюда не соседи, и правка второго не затрагивает карточку первого
+    create_dish(client, 'Первое', ingredients='Картофель')
+    add_recipe(client, title='Второе')
+    fragment_cache.clear()
+    client.get('/')
+    assert fragment_cache.stats()['misses'] == 3
+    html = client.get('/').data.decode('utf-8')
+    assert fragment_cache.stats()['hits'] == 1 and 'Первое' in html
+    add_feedback(client, 1, rating=4)
+    html = client.get('/').data.decode('utf-8')
+    assert '<span class="fw-bold">⭐ Оценка:</span> 4.0' in html
+    hits = fragment_cache.stats()['hits']
+    client.post('/edit-dish/2', data={
+        'title': 'Второе изменённое', 'description': 'Описание', 'cooking_time': 5,
+        'servings': 1, 'ingredients': 'Ингредиенты', 'steps': 'Шаги'
+    })
+    assert 'Второе изменённое' in client.get('/').data.decode('utf-8')
+    # карточка неизменённого блюда берётся из кеша
+    assert fragment_cache.stats()['hits'] == hits + 1
+    client.post('/delete-dish/2', follow_redirects=True)
+    assert 'Второе' not in client.get('/').data.decode('utf-8')
+
+@pytest.mark.parametrize('make_backend', [
+    lambda tmp_path: MemoryBackend(maxsize=2),
+    lambda tmp_path: FileSystemBackend(str(tmp_path), maxsize=2),
+])
+def test_fragment_cache_backends(tmp_path, make_backend):
+    cache = FragmentCache(make_backend(tmp_path))
+    assert cache.get_or_render('a', lambda: 'A') == 'A'
+    assert cache.get_or_render('a', lambda: 'other') == 'A'
+    first_key = cache.feed_key('')
+    cache.invalidate_feed()
+    assert cache.feed_key('') != first_key
+    for key in 'bcdef':
+        cache.backend.set(key, key)
+    assert len(cache.backend) <= 3
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+def test_filesystem_cache_culls_once_per_batch_of_writes(tmp_path, monkeypatch):
+    backend = FileSystemBackend(str(tmp_path), maxsize=20)
+    scans = []
+    entries = backend._entries
+    monkeypatch.setattr(backend, '_entries', lambda: scans.append(1) or entries())
+    for i in range(25):
+        backend.set(str(i), i)
+    # Каталог обходится раз в cull_every записей, а не при каждой
+    assert backend.cull_every == 2 and len(scans) == 12
+    # Между проверками каталог может превысить maxsize не больше чем на cull_every записей
+    assert len(backend) <= 20 + backend.cull_every
+
+def test_fragment_cache_invalidation_reaches_other_processes(tmp_path):
+    config = {'SECRET_KEY': 'test', 'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'UPLOAD_FOLDER': str(tmp_path),
+              'FRAGMENT_CACHE_DIR': str(tmp_path / 'fragments'), 'LOG_FILE': ''}
+    # Кеш каждого «воркера» подключается к своему экземпляру приложения с общей настройкой
+    web, worker = FragmentCache(), FragmentCache()
+    web.init_app(create_app(config))
+    worker.init_app(create_app(config))
+    assert isinstance(web.backend, FileSystemBackend) and web.timeout > 0
+    feed_key = web.feed_key('')
+    assert web.get_or_render(web.card_key(1), lambda: 'Старое название') == 'Старое название'
+    assert web.get_or_render(web.card_key(1), lambda: 'Новое название') == 'Старое название'
+    worker.invalidate_dish(1)
+    assert web.get_or_render(web.card_key(1), lambda: 'Новое название') == 'Новое название'
+    assert web.feed_key('') != feed_key
+
+def test_health_reports_database_and_pool(client):
+    rv = client.get('/health')
+    assert rv.status_code == 200
+    data = rv.get_json()
+    assert data['status'] == 'ok' and data['database'] == 'ok'
+    assert data['pool']['class']
+
+def test_engine_options_for_server_databases():
+    from app import engine_options
+    config = {
+        'SQLALCHEMY_DATABASE_URI': 'mysql://user@db/webexam',
+        'DB_POOL_PRE_PING': True, 'DB_POOL_RECYCLE': 280,
+        'DB_POOL_SIZE': 8, 'DB_MAX_OVERFLOW': 4, 'DB_POOL_TIMEOUT': 10,
+    }
+    assert engine_options(config) == {
+        'pool_pre_ping': True, 'pool_recycle': 280,
+        'pool_size': 8, 'max_overflow': 4, 'pool_timeout': 10,
+    }
+    config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    assert 'pool_size' not in engine_options(config)
+
+def test_import_and_export_data(client, flask_app, tmp_path):
+    register(client, 'importer', 'pass')
+    register(client, 'critic', 'pass')
+    register(client, 'chef', 'pass')
+    login(client, 'chef', 'pass')
+    add_recipe(client, title='Существующее')
+    recipes = tmp_path / 'recipes.jsonl'
+    recipes.write_text('\n'.join(json.dumps({
+        'title': title, 'description': '**Описание**', 'cooking_time': 15, 'servings': 2,
+        'ingredients': 'мука, вода', 'steps': 'Смешать', 'author': 'importer'
+    }, ensure_ascii=False) for title in ['Хлеб', 'Лепёшка', 'Хлеб', 'хлеб', 'СУЩЕСТВУЮЩЕЕ']), encoding='utf-8')
+    reviews = tmp_path / 'reviews.csv'
+    reviews.write_text(
+        'recipe,author,rating,text,created_at\n'
+        'Хлеб,critic,4,Хорошо,\n'
+        'Хлеб,chef,2,Сухо,\n'
+        'Хлеб,critic,5,Повтор,\n'
+        'Хлеб,importer,7,Вне шкалы,\n'
+        'Лепёшка,importer,нет,Без оценки,\n'
+        'Нет такого,critic,5,Пропуск,\n', encoding='utf-8')
+    photo = tmp_path / 'bread.png'
+    Image.new('RGB', (10, 10)).save(photo)
+    photos = tmp_path / 'photos.jsonl'
+    photos.write_text(json.dumps({'recipe': 'Лепёшка', 'path': str(photo)}), encoding='utf-8')
+    upload_folder = tmp_path / 'uploads'
+    upload_folder.mkdir()
+    flask_app.config['UPLOAD_FOLDER'], old_folder = str(upload_folder), flask_app.config['UPLOAD_FOLDER']
+    try:
+        runner = flask_app.test_cli_runner()
+        result = runner.invoke(args=['import-data', 'recipes', str(recipes), '--batch-size', '2'])
+        # Названия, отличающиеся только регистром, совпадают для уникального индекса MySQL
+        assert 'Добавлено: 2, пропущено: 3' in result.output
+        result = runner.invoke(args=['import-data', 'reviews', str(reviews)])
+        assert 'Добавлено: 2, пропущено: 4' in result.output
+        result = runner.invoke(args=['import-data', 'photos', str(photos)])
+        assert 'Добавлено: 1, пропущено: 0' in result.output
+        with flask_app.app_context():
+            bread = Dish.query.filter_by(title='Хлеб').one()
+            assert (bread.rating_sum, bread.rating_count) == (6, 2)
+            assert RatingBucket.histogram(bread.id) == {2: 1, 4: 1}
+            assert bread.description_html == '<p><strong>Описание</strong></p>'
+            assert Dish.query.filter_by(title='Лепёшка').one().cover_photo.content_hash
+        assert 'Лепёшка' in client.get('/search?q=мука').data.decode('utf-8')
+        # Импортированные блюда сразу попадают в индекс похожих
+        assert similar_titles(client, 2) == ['Лепёшка']
+        exported = tmp_path / 'export.csv'
+        result = runner.invoke(args=['export-data', 'reviews', '--output', str(exported)])
+        assert result.exit_code == 0
+        rows = list(csv.DictReader(exported.open(encoding='utf-8')))
+        assert sorted((row['author'], row['rating']) for row in rows) == [('chef', '2'), ('critic', '4')]
+        result = runner.invoke(args=['export-data', 'recipes'])
+        titles = [json.loads(line)['title'] for line in result.output.splitlines()]
+        assert titles == ['Существующее', 'Хлеб', 'Лепёшка']
+    finally:
+        flask_app.config['UPLOAD_FOLDER'] = old_folder
+
+def test_query_budgets(client, flask_app):
+    for i in range(3):
+        register(client, f'cook{i}', 'pass')
+        login(client, f'cook{i}', 'pass')
+        add_recipe(client, title=f'Блюдо {i}')
+        for j in range(3):
+            add_feedback(client, j + 1, rating=i)
+        logout(client)
+    with flask_app.app_context():
+        for dish_id in range(1, 4):
+            db.session.add_all([
+                Photo(filename=f'{dish_id}-{n}.jpg', mime_type='image/jpeg', recipe_id=dish_id)
+                for n in range(3)
+            ])
+        db.session.commit()
+    login(client, 'cook0', 'pass')
+    html = client.get('/').data.decode('utf-8')
+    assert 'uploads/1-0.jpg' in html and 'uploads/1-1.jpg' not in html
+    for url in QUERY_BUDGETS:
+        assert_query_budget(client, url)
+
+def test_api_requires_login(client):
+    rv = client.get('/api/v1/recipes')
+    assert rv.status_code == 401
+    assert rv.get_json()['error']
+
+def test_api_lists_recipes_with_cursor_and_fields(client):
+    register(client, 'user40', 'pass40')
+    login(client, 'user40', 'pass40')
+    for i in range(3):
+        create_dish(client, f'API {i}')
+    add_feedback(client, 1, rating=4)
+    rv = client.get('/api/v1/recipes?limit=2&fields=id,title,rating_avg,author')
+    data = rv.get_json()
+    assert [item['title'] for item in data['items']] == ['API 2', 'API 1']
+    assert set(data['items'][0]) == {'id', 'title', 'rating_avg', 'author'}
+    assert data['items'][0]['author']['first_name'] == 'Тест'
+    rv = client.get(f'/api/v1/recipes?limit=2&cursor={data["next_cursor"]}')
+    items = rv.get_json()['items']
+    assert [item['title'] for item in items] == ['API 0']
+    assert items[0]['rating_avg'] == 4 and items[0]['rating_count'] == 1
+    assert client.get('/api/v1/recipes?fields=title,password_hash').status_code == 400
+
+def test_api_recipe_and_reviews(client, flask_app):
+    register(client, 'user41', 'pass41')
+    login(client, 'user41', 'pass41')
+    create_dish(client, 'Деталь')
+    with flask_app.app_context():
+        db.session.add(Photo(filename='d.jpg', mime_type='image/jpeg', recipe_id=1, variants='card'))
+        db.session.commit()
+    add_feedback(client, 1, rating=5, comment='*Вкусно*')
+    data = client.get('/api/v1/recipes/1').get_json()
+    assert data['title'] == 'Деталь'
+    assert data['photos'][0]['url'].endswith('/uploads/d.jpg')
+    assert 'card' in data['photos'][0]['variants']
+    assert client.get('/api/v1/recipes/99').status_code == 404
+    reviews = client.get('/api/v1/recipes/1/reviews').get_json()
+    assert reviews['items'][0]['text_html'] == '<p><em>Вкусно</em></p>'
+    assert reviews['next_cursor'] is None
+
+def test_api_streams_ndjson_in_batches(client, monkeypatch):
+    monkeypatch.setattr('api.STREAM_BATCH', 2)
+    register(client, 'user42', 'pass42')
+    login(client, 'user42', 'pass42')
+    for i in range(5):
+        create_dish(client, f'Поток {i}')
+    with count_queries(client.application) as statements:
+        rv = client.get('/api/v1/recipes?format=ndjson&fields=id,author')
+        lines = rv.data.decode('utf-8').splitlines()
+    assert rv.mimetype == 'application/x-ndjson'
+    assert [json.loads(line)['id'] for line in lines] == [5, 4, 3, 2, 1]
+    # По пачкам: запрос блюд и запрос авторов, а не запрос на каждое блюдо
+    author_queries = [s for s in statements if 'FROM users' in s and 'users.id IN' in s]
+    assert len(author_queries) == 3
+
+def test_metrics_endpoint_reports_requests_sql_and_templates(client, flask_app, monkeypatch):
+    # Без настроенного токена эндпоинт закрыт, с чужим токеном — 401
+    assert client.get('/metrics').status_code == 404
+    monkeypatch.setitem(flask_app.config, 'METRICS_TOKEN', 'secret')
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    metrics.reset()
+    register(client, 'user43', 'pass43')
+    login(client, 'user43', 'pass43')
+    create_dish(client, 'Метрики')
+    client.get('/dish/1')
+    client.post('/create-dish', data={
+        'title': 'С файлом', 'description': 'Описание', 'cooking_time': 10, 'servings': 1,
+        'ingredients': 'Ингредиенты', 'steps': 'Шаги', 'photos': [(io.BytesIO(b'x' * 100), 'a.txt')]
+    })
+    rv = client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+    assert rv.mimetype == 'text/plain'
+    text = rv.data.decode('utf-8')
+    assert 'http_request_duration_seconds_count{endpoint="dishes.view_dish",method="GET"} 1' in text
+    assert 'http_requests_total{endpoint="dishes.view_dish",method="GET",status="200"} 1' in text
+    queries = re.search(r'sql_queries_per_request_sum\{endpoint="dishes.view_dish"\} (\d+)', text)
+    assert queries and int(queries.group(1)) > 0
+    assert 'template_render_seconds_count{endpoint="dishes.view_dish"} 1' in text
+    uploaded = re.search(r'upload_bytes_total\{endpoint="dishes.create_dish"\} (\d+)', text)
+    assert uploaded and int(uploaded.group(1)) > 100
+    assert '# TYPE fragment_cache_hits_total counter' in text
+
+def test_slow_request_log_includes_sql(client, flask_app, monkeypatch, caplog):
+    monkeypatch.setitem(flask_app.config, 'SLOW_REQUEST_SECONDS', 0)
+    register(client, 'user44', 'pass44')
+    login(client, 'user44', 'pass44')
+    create_dish(client, 'Медленно')
+    with caplog.at_level('WARNING', logger='metrics.slow'):
+        client.get('/dish/1')
+    message = caplog.records[-1].getMessage()
+    assert 'dishes.view_dish' in message and 'SELECT' in message and 'FROM recipes' in message
+
+def test_profiler_dumps_for_selected_endpoint(client, flask_app, monkeypatch, tmp_path):
+    monkeypatch.setitem(flask_app.config, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setitem(flask_app.config, 'PROFILE_ENDPOINT', 'dishes.view_dish')
+    monkeypatch.setattr(metrics, '_profile_checked', 0.0)
+    register(client, 'user45', 'pass45')
+    login(client, 'user45', 'pass45')
+    create_dish(client, 'Профиль')
+    client.get('/')
+    assert not list(tmp_path.glob('*.folded'))
+    client.get('/dish/1')
+    assert [path.name.split('-')[0] for path in tmp_path.glob('*.folded')] == ['dishes.view_dish']
+
+def test_sampling_profiler_collects_stacks():
+    def busy_loop():
+        deadline = time.perf_counter() + 0.1
+        while time.perf_counter() < deadline:
+            pass
+    profiler = SamplingProfiler(threading.get_ident(), interval=0.001).start()
+    busy_loop()
+    profiler.stop()
+    assert any('busy_loop' in stack.split(';')[-1] for stack in profiler.samples)
+
+def test_benchmark_datagen_is_seeded_and_consistent(client, flask_app):
+    with flask_app.app_context():
+        sizes = generate(users=20, recipes=30, reviews=200, seed=7, batch_size=8)
+        assert sizes['recipes'] == Dish.query.count() == 30
+        assert sizes['reviews'] == Feedback.query.count()
+        rows = db.session.execute(db.select(
+            Feedback.recipe_id, db.func.sum(Feedback.rating), db.func.count()
+        ).group_by(Feedback.recipe_id)).all()
+        aggregates = {dish.id: (dish.rating_sum, dish.rating_count) for dish in Dish.query}
+        assert all(aggregates[recipe_id] == (total, count) for recipe_id, total, count in rows)
+        assert db.session.scalar(db.select(db.func.sum(RatingBucket.count))) == sizes['reviews']
+        first_titles = [dish.title for dish in Dish.query.order_by(Dish.id)]
+        assert search_dishes(first_titles[0].split()[0]).items
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+        generate(users=20, recipes=30, reviews=200, seed=7, batch_size=8)
+        assert [dish.title for dish in Dish.query.order_by(Dish.id)] == first_titles
+
+def test_benchmark_compare_flags_regressions():
+    stats = {'p50_ms': 10.0, 'p95_ms': 20.0, 'queries_per_request': 3.0}
+    baseline = {'routes': {'home': stats, 'view_dish': stats}, 'load': dict(stats, routes={'home': stats})}
+    current = {
+        'routes': {
+            'home': dict(stats, p95_ms=21.0, queries_per_request=3.25),
+            'view_dish': dict(stats, p50_ms=15.0, queries_per_request=4.0),
+        },
+        # Число запросов под конкурентной нагрузкой не сравнивается
+        'load': dict(stats, queries_per_request=5.0, routes={'home': dict(stats, queries_per_request=5.0)}),
+    }
+    lines, regressions = compare(baseline, current, threshold=0.1)
+    assert len(lines) == 4
+    assert regressions == [
+        'route view_dish: p50_ms вырос на 50%',
+        'route view_dish: SQL-запросов на запрос стало 4.0 вместо 3.0',
+    ]
+
+def test_startup_defers_heavy_imports_and_side_effects():
+    report = measure_startup(runs=1)
+    assert report['lazy_modules_loaded'] == []
+    assert report['total']['p50_ms'] > 0
+    stats = {'p50_ms': 500.0, 'p95_ms': 550.0}
+    baseline = {'startup': {'import': stats, 'lazy_modules_loaded': []}}
+    current = {'startup': {'import': stats, 'lazy_modules_loaded': ['alembic']}}
+    lines, regressions = compare(baseline, current)
+    assert lines == ['startup import: p50_ms 500.00 → 500.00 (+0%), p95_ms 550.00 → 550.00 (+0%)']
+    assert regressions == ['startup: при запуске загружаются alembic']
+
+def test_identity_cache_skips_auth_queries(client):
+    register(client, 'user46', 'pass46', role_id=1)
+    login(client, 'user46', 'pass46')
+    add_recipe(client)
+    client.get('/dish/1')
+    with count_queries(client.application) as statements:
+        rv = client.get('/dish/1')
+        client.get('/register')
+    assert rv.status_code == 200
+    assert 'Удалить' in rv.data.decode('utf-8')
+    assert not [s for s in statements if 'FROM users' in s and 'users.id = ?' in s]
+    assert not [s for s in statements if 'FROM roles' in s]
+
+def test_identity_cache_invalidation(client, flask_app):
+    register(client, 'user47', 'pass47')
+    login(client, 'user47', 'pass47')
+    client.get('/')
+    with flask_app.app_context():
+        account = Account.query.filter_by(username='user47').one()
+        account.first_name = 'Переименован'
+        db.session.add(UserRole(name='Модератор', description='Новая роль'))
+        db.session.commit()
+        account_id = account.id
+    assert identity_cache._accounts.get(account_id) is None
+    client.get('/')
+    assert identity_cache._accounts[account_id][1]['first_name'] == 'Переименован'
+    assert 'Модератор' in client.get('/register').data.decode('utf-8')
+    logout(client)
+    assert identity_cache._accounts.get(account_id) is None
+
+def test_jobs_external_runner_and_idempotency(client, flask_app, tmp_path, monkeypatch):
+    monkeypatch.setitem(flask_app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setitem(flask_app.config, 'JOB_RUNNER', 'external')
+    register(client, 'user48', 'pass48')
+    login(client, 'user48', 'pass48')
+    client.post('/create-dish', data={
+        'title': 'Очередь', 'description': 'Описание', 'cooking_time': 10, 'servings': 1,
+        'ingredients': 'Ингредиенты', 'steps': 'Шаги', 'photos': [image_upload('q.jpg', (64, 64))]
+    }, content_type='multipart/form-data', follow_redirects=True)
+    with flask_app.app_context():
+        # Сброс кеша выполняется сразу, обработка фото и индекс похожих ждут исполнителя
+        assert {(j.kind, j.status) for j in Job.query} == {
+            ('invalidate_dish', 'done'), ('generate_variants', 'pending'), ('update_similarity', 'pending')
+        }
+        photo_id = Photo.query.one().id
+        enqueue('generate_variants', key=f'variants:{photo_id}', photo_id=photo_id)
+        db.session.commit()
+        assert Job.query.filter_by(kind='generate_variants').count() == 1
+    result = flask_app.test_cli_runner().invoke(args=['jobs', 'work', '--once'])
+    assert result.exit_code == 0 and 'Выполнено задач: 2' in result.output
+    with flask_app.app_context():
+        assert Photo.query.one().variants
+        assert Job.query.filter_by(status='pending').count() == 0
+
+def test_jobs_retry_with_backoff_then_fail(client, flask_app, monkeypatch):
+    calls = []
+
+    @job('flaky')
+    def flaky(value):
+        calls.append(value)
+        raise RuntimeError('сбой')
+
+    monkeypatch.setitem(flask_app.config, 'JOB_RETRY_DELAY', 0)
+    try:
+        with flask_app.app_context():
+            enqueue('flaky', max_attempts=2, value=1)
+            db.session.commit()
+            assert run_pending() == 2
+            task = Job.query.filter_by(kind='flaky').one()
+            assert calls == [1, 1]
+            assert task.status == 'failed' and task.attempts == 2
+            assert 'сбой' in task.last_error
+    finally:
+        HANDLERS.pop('flaky')
+
+def test_jobs_enqueue_while_running_reruns_job(client, flask_app):
+    calls = []
+
+    @job('reindex')
+    def reindex(version):
+        calls.append(version)
+        if version == 1:
+            # Данные изменились, пока задача выполняется: её ставят снова с новым payload
+            enqueue('reindex', key='reindex:1', version=2)
+
+    try:
+        with flask_app.app_context():
+            enqueue('reindex', key='reindex:1', version=1)
+            db.session.commit()
+            assert run_pending() == 2
+            task = Job.query.filter_by(kind='reindex').one()
+            assert calls == [1, 2]
+            assert task.status == 'done' and not task.rerun and task.payload == {'version': 2}
+    finally:
+        HANDLERS.pop('reindex')
+
+def test_jobs_scheduler_tick_runs_due_retries_and_sweep(client, flask_app, monkeypatch):
+    calls = []
+
+    @job('flaky')
+    def flaky(value):
+        calls.append(value)
+        if len(calls) == 1:
+            raise RuntimeError('сбой')
+
+    monkeypatch.setitem(flask_app.config, 'JOB_RETRY_DELAY', 60)
+    try:
+        with flask_app.app_context():
+            enqueue('flaky', value=1)
+            db.session.commit()
+            assert run_pending() == 1
+            task = Job.query.filter_by(kind='flaky').one()
+            assert task.status == 'pending' and task.run_at > datetime.utcnow()
+            # Время повтора наступило: его выполняет такт планировщика, без flask jobs work
+            task.run_at = datetime.utcnow() - timedelta(seconds=1)
+            db.session.commit()
+            assert run_due() == 2
+            assert calls == [1, 1]
+            assert {(j.kind, j.status) for j in Job.query} == {('flaky', 'done'), ('sweep_uploads', 'done')}
+    finally:
+        HANDLERS.pop('flaky')
+
+def test_sweeper_removes_only_old_unreferenced_files(client, flask_app, tmp_path, monkeypatch):
+    monkeypatch.setitem(flask_app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    register(client, 'user49', 'pass49')
+    login(client, 'user49', 'pass49')
+    add_recipe(client)
+    digest = 'a' * 64
+    blob = f'aa/aa/{digest}.jpg'
+    files = [blob, f'aa/aa/{digest}.card.webp', 'legacy.png', 'legacy.card.png',
+             f'bb/bb/{"b" * 64}.jpg', 'stray.png', '.upload-tmp', 'fresh.png']
+    for name in files:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_bytes(b'x')
+        if name != 'fresh.png':
+            os.utime(tmp_path / name, (0, 0))
+    with flask_app.app_context():
+        db.session.add_all([
+            Photo(filename=blob, mime_type='image/jpeg', recipe_id=1, content_hash=digest, variants='card.webp'),
+            Photo(filename='legacy.png', mime_type='image/png', recipe_id=1, variants='card'),
+        ])
+        db.session.commit()
+        assert sweep_uploads(grace=60) == 3
+    assert stored_files(tmp_path) == sorted([blob, f'aa/aa/{digest}.card.webp', 'fresh.png', 'legacy.card.png', 'legacy.png'])
 
 def test_logout(client):
     register(client, 'user14', 'pass14')
@@ -193,4 +1202,144 @@ def test_markdown_rendering(client):
     rv = client.get('/')
     assert 'MD' in rv.data.decode('utf-8')
     rv = client.get('/dish/1')
-    assert '<h1>Заголовок' in rv.data.decode('utf-8') or '<li>item' in rv.data.decode('utf-8') or '<strong>bold' in rv.data.decode('utf-8') 
\ No newline at end of file
+    assert '<h1>Заголовок' in rv.data.decode('utf-8') or '<li>item' in rv.data.decode('utf-8') or '<strong>bold' in rv.data.decode('utf-8') 
+
+@contextmanager
+def capture_selects(app):
+    with app.app_context():
+        engine = db.engine
+    selects = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            selects.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield selects
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+def full_scans(statement, parameters):
+    """Шаги плана SQLite, читающие таблицу целиком без индекса."""
+    rows = db.session.connection().exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).all()
+    return [row[-1] for row in rows
+            if row[-1].startswith('SCAN ') and 'INDEX' not in row[-1] and 'VIRTUAL TABLE' not in row[-1]]
+
+@pytest.fixture
+def routed(tmp_path):
+    """Приложение с двумя файлами SQLite: основная БД и реплика."""
+    routed = create_app({
+        'SECRET_KEY': 'test', 'UPLOAD_FOLDER': str(tmp_path),
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "primary.db"}',
+        'REPLICA_DATABASE_URL': f'sqlite:///{tmp_path / "replica.db"}',
+        'FRAGMENT_CACHE_DIR': str(tmp_path / 'fragments'),
+        'WTF_CSRF_ENABLED': False, 'JOB_RUNNER': 'inline', 'LOG_FILE': '',
+    })
+    yield routed
+    with routed.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+    # Метаданные общего db знают о bind реплики только в этом приложении
+    db.metadatas.pop('replica', None)
+
+def test_replica_serves_reads_and_pins_writer_to_primary(routed, tmp_path):
+    fragment_cache.clear()
+    identity_cache.clear()
+    with routed.app_context():
+        db.create_all()
+        db.session.add_all([UserRole(name='Администратор', description='Админ'),
+                            UserRole(name='Пользователь', description='Обычный пользователь')])
+        db.session.commit()
+    writer, reader = routed.test_client(), routed.test_client()
+    register(writer, 'writer', 'pass')
+    login(writer, 'writer', 'pass')
+    # Реплика догнала основную БД: пользователь и роли есть в обеих
+    shutil.copy(tmp_path / 'primary.db', tmp_path / 'replica.db')
+
+    with routed.app_context():
+        replica_engine = db.engines['replica']
+
+    @contextmanager
+    def replica_reads():
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(replica_engine, 'before_cursor_execute', listener)
+        try:
+            yield statements
+        finally:
+            event.remove(replica_engine, 'before_cursor_execute', listener)
+
+    with replica_reads() as statements:
+        writer.post('/create-dish', data={
+            'title': 'Свежее блюдо', 'description': 'Описание', 'cooking_time': 30,
+            'servings': 2, 'ingredients': 'Ингредиенты', 'steps': 'Шаги'
+        })
+    with writer.session_transaction() as session:
+        assert session['primary_until'] > time.time()
+    # Записи и чтения закреплённого автора идут в основную БД
+    assert statements == []
+
+    login(reader, 'writer', 'pass')
+    with replica_reads() as statements:
+        assert 'Свежее блюдо' not in reader.get('/').data.decode('utf-8')
+    assert statements and all(statement.lstrip().startswith('SELECT') for statement in statements)
+    # Лента, собранная по отстающей реплике, не скрывает от автора его запись
+    assert 'Свежее блюдо' in writer.get('/').data.decode('utf-8')
+
+    # После окончания закрепления автор тоже читает с реплики
+    with writer.session_transaction() as session:
+        session['primary_until'] = 0
+    with replica_reads() as statements:
+        writer.get('/dish/1')
+    assert statements
+    with routed.app_context():
+        assert Dish.query.count() == 1
+
+def test_main_routes_use_indexes(client, flask_app):
+    for i in range(2):
+        register(client, f'plan{i}', 'pass')
+        login(client, f'plan{i}', 'pass')
+        add_recipe(client, title=f'Блюдо {i}')
+        add_feedback(client, 1, rating=4)
+        logout(client)
+    with flask_app.app_context():
+        db.session.add(Photo(filename='1.jpg', mime_type='image/jpeg', recipe_id=1))
+        db.session.commit()
+    login(client, 'plan0', 'pass')
+    with capture_selects(client.application) as selects:
+        client.get('/')
+        client.get('/dish/1')
+        client.get('/dish/1/reviews')
+        client.get('/search?q=Блюдо')
+        client.get('/dish/2/add-feedback')
+        add_feedback(client, 2)
+        client.get('/edit-dish/1')
+        add_recipe(client, title='Новое блюдо')
+        assert client.get('/api/v1/recipes?fields=id,title,author,photos,rating_avg').status_code == 200
+        client.get('/api/v1/recipes/1')
+        client.get('/api/v1/recipes/1/reviews')
+        logout(client)
+        register(client, 'plan9', 'pass')
+        login(client, 'plan9', 'pass')
+    assert selects
+    with flask_app.app_context():
+        problems = [(statement, scans) for statement, parameters in selects
+                    if (scans := full_scans(statement, parameters))]
+    assert not problems, '\n\n'.join(f'{scans}\n{statement}' for statement, scans in problems)
+
+def test_migrations_create_indexes(tmp_path):
+    migrated = create_app({
+        'SECRET_KEY': 'test', 'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "app.db"}',
+        'UPLOAD_FOLDER': str(tmp_path), 'LOG_FILE': '',
+    })
+    init_migrate(migrated)
+    with migrated.app_context():
+        upgrade()
+        inspector = db.inspect(db.engine)
+        assert {'uq_recipes_title', 'ix_recipes_created_at_id'} <= {i['name'] for i in inspector.get_indexes('recipes')}
+        assert {'uq_reviews_recipe_user', 'ix_reviews_recipe_created'} <= {i['name'] for i in inspector.get_indexes('reviews')}
+        assert 'ix_images_recipe_id_id' in {i['name'] for i in inspector.get_indexes('images')}
+        assert inspector.get_pk_constraint('rating_buckets')['constrained_columns'] == ['recipe_id', 'rating']
+        downgrade(revision='base')
+        assert db.inspect(db.engine).get_table_names() == ['alembic_version']
@@ -0,0 +1,307 @@
+import csv
+import json
+import mimetypes
+import os
+import sys
+from collections import defaultdict
+from datetime import datetime
+from itertools import islice
+
+import click
+from flask import current_app
+from sqlalchemy import bindparam, insert, select, tuple_, update
+from werkzeug.datastructures import FileStorage
+
+from forms import RATING_CHOICES
+from fragments import fragment_cache
+from jobs import dispatch, enqueue
+from models import db, Account, Dish, Feedback, Photo, RatingBucket
+from rendering import process_markdown
+from search import index_rows
+from storage import store_upload
+
+RATINGS = {value for value, _ in RATING_CHOICES}
+
+RECIPE_FIELDS = ['title', 'description', 'cooking_time', 'servings', 'ingredients', 'steps', 'author', 'created_at']
+REVIEW_FIELDS = ['recipe', 'author', 'rating', 'text', 'created_at']
+PHOTO_FIELDS = ['recipe', 'path', 'mime_type']
+
+
+def _detect_format(path, fmt):
+    if fmt:
+        return fmt
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def read_records(stream, fmt):
+    """Построчно читает записи JSONL или CSV, не загружая файл целиком."""
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _parse_datetime(value):
+    return datetime.fromisoformat(value) if value else datetime.utcnow()
+
+
+def _parse_rating(value):
+    try:
+        rating = int(value)
+    except (TypeError, ValueError):
+        return None
+    return rating if rating in RATINGS else None
+
+
+def _account_ids(usernames):
+    """Одним запросом сопоставляет логины с id пользователей."""
+    rows = db.session.execute(select(Account.username, Account.id).where(Account.username.in_(set(usernames))))
+    return dict(rows.all())
+
+
+def _title_key(title):
+    return title.casefold()
+
+
+def _dish_ids(titles):
+    rows = db.session.execute(select(Dish.title, Dish.id).where(Dish.title.in_(set(titles))))
+    return dict(rows.all())
+
+
+def import_recipes(records, batch_size=1000):
+    """Импортирует блюда пачками; возвращает (добавлено, пропущено).
+
+    Уникальность названий проверяется по заранее загруженному множеству, а не
+    отдельным запросом на каждую запись. Названия сравниваются без учёта
+    регистра, как уникальный индекс при сортировке MySQL по умолчанию.
+    Соседей новых блюд в индексе похожих считают задачи update_similarity.
+    """
+    titles = {_title_key(title) for title in db.session.scalars(select(Dish.title).execution_options(yield_per=5000))}
+    added = skipped = 0
+    for chunk in chunked(records, batch_size):
+        accounts = _account_ids(record['author'] for record in chunk)
+        rows = []
+        for record in chunk:
+            title_key = _title_key(record['title'])
+            if title_key in titles or record['author'] not in accounts:
+                skipped += 1
+                continue
+            titles.add(title_key)
+            row = {
+                'title': record['title'],
+                'cooking_time': int(record['cooking_time']),
+                'servings': int(record['servings']),
+                'user_id': accounts[record['author']],
+                'created_at': _parse_datetime(record.get('created_at')),
+            }
+            for field in ('description', 'ingredients', 'steps'):
+                row[field], row[f'{field}_html'] = process_markdown(record[field])
+            row['updated_at'] = row['created_at']
+            rows.append(row)
+        if rows:
+            db.session.execute(insert(Dish), rows)
+            ids = _dish_ids(row['title'] for row in rows)
+            index_rows([
+                {'id': ids[row['title']], 'title': row['title'],
+                 'ingredients': row['ingredients'], 'steps': row['steps']}
+                for row in rows
+            ])
+            for row in rows:
+                dish_id = ids[row['title']]
+                enqueue('update_similarity', key=f'similarity:{dish_id}', dish_id=dish_id)
+        db.session.commit()
+        dispatch()
+        added += len(rows)
+    fragment_cache.invalidate_feed()
+    return added, skipped
+
+
+def import_reviews(records, batch_size=1000):
+    """Импортирует отзывы пачками; агрегаты и гистограмма оценок обновляются раз на пачку.
+
+    Отзывы с оценкой не из RATING_CHOICES пропускаются, как и в форме отзыва.
+    """
+    added = skipped = 0
+    touched = set()
+    add_rating = (
+        update(Dish.__table__)
+        .where(Dish.__table__.c.id == bindparam('dish_id'))
+        .values(
+            rating_sum=Dish.__table__.c.rating_sum + bindparam('rating_sum'),
+            rating_count=Dish.__table__.c.rating_count + bindparam('rating_count'),
+        )
+    )
+    for chunk in chunked(records, batch_size):
+        dishes = _dish_ids(record['recipe'] for record in chunk)
+        accounts = _account_ids(record['author'] for record in chunk)
+        pairs = {(dishes.get(r['recipe']), accounts.get(r['author'])) for r in chunk}
+        pairs = [pair for pair in pairs if None not in pair]
+        existing = set(db.session.execute(
+            select(Feedback.recipe_id, Feedback.user_id)
+            .where(tuple_(Feedback.recipe_id, Feedback.user_id).in_(pairs))
+        ).all()) if pairs else set()
+        rows = []
+        totals = defaultdict(lambda: [0, 0])
+        buckets = defaultdict(int)
+        for record in chunk:
+            key = (dishes.get(record['recipe']), accounts.get(record['author']))
+            rating = _parse_rating(record['rating'])
+            if None in key or key in existing or rating is None:
+                skipped += 1
+                continue
+            existing.add(key)
+            text, text_html = process_markdown(record['text'])
+            rows.append({
+                'recipe_id': key[0], 'user_id': key[1], 'rating': rating,
+                'text': text, 'text_html': text_html,
+                'created_at': _parse_datetime(record.get('created_at')),
+            })
+            totals[key[0]][0] += rating
+            totals[key[0]][1] += 1
+            buckets[key[0], rating] += 1
+        if rows:
+            db.session.execute(insert(Feedback), rows)
+            db.session.execute(add_rating, [
+                {'dish_id': dish_id, 'rating_sum': rating_sum, 'rating_count': rating_count}
+                for dish_id, (rating_sum, rating_count) in totals.items()
+            ])
+            RatingBucket.bump([(dish_id, rating, count) for (dish_id, rating), count in buckets.items()])
+        db.session.commit()
+        touched.update(totals)
+        added += len(rows)
+    for dish_id in touched:
+        fragment_cache.invalidate_dish(dish_id)
+    return added, skipped
+
+
+def import_photos(records, batch_size=200):
+    """Копирует файлы фотографий в хранилище и добавляет записи пачками."""
+    added = skipped = 0
+    touched = set()
+    for chunk in chunked(records, batch_size):
+        dishes = _dish_ids(record['recipe'] for record in chunk)
+        rows = []
+        for record in chunk:
+            dish_id = dishes.get(record['recipe'])
+            if dish_id is None or not os.path.isfile(record['path']):
+                skipped += 1
+                continue
+            mime_type = record.get('mime_type') or mimetypes.guess_type(record['path'])[0] or 'application/octet-stream'
+            with open(record['path'], 'rb') as f:
+                content_hash, filename = store_upload(FileStorage(stream=f, filename=record['path']))
+            rows.append({'recipe_id': dish_id, 'filename': filename, 'mime_type': mime_type, 'content_hash': content_hash})
+            touched.add(dish_id)
+        if rows:
+            db.session.execute(insert(Photo), rows)
+        db.session.commit()
+        added += len(rows)
+    for dish_id in touched:
+        fragment_cache.invalidate_dish(dish_id)
+    return added, skipped
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def export_recipes():
+    """Выгружает блюда построчно через серверный курсор."""
+    statement = (
+        select(Dish.title, Dish.description, Dish.cooking_time, Dish.servings,
+               Dish.ingredients, Dish.steps, Account.username.label('author'), Dish.created_at)
+        .join(Account, Account.id == Dish.user_id)
+        .order_by(Dish.id)
+        .execution_options(yield_per=1000)
+    )
+    for row in db.session.execute(statement):
+        record = row._asdict()
+        record['created_at'] = _isoformat(record['created_at'])
+        yield record
+
+
+def export_reviews():
+    statement = (
+        select(Dish.title.label('recipe'), Account.username.label('author'),
+               Feedback.rating, Feedback.text, Feedback.created_at)
+        .join(Dish, Dish.id == Feedback.recipe_id)
+        .join(Account, Account.id == Feedback.user_id)
+        .order_by(Feedback.id)
+        .execution_options(yield_per=1000)
+    )
+    for row in db.session.execute(statement):
+        record = row._asdict()
+        record['created_at'] = _isoformat(record['created_at'])
+        yield record
+
+
+def export_photos(upload_folder):
+    statement = (
+        select(Dish.title.label('recipe'), Photo.filename, Photo.mime_type)
+        .join(Dish, Dish.id == Photo.recipe_id)
+        .order_by(Photo.id)
+        .execution_options(yield_per=1000)
+    )
+    for row in db.session.execute(statement):
+        yield {'recipe': row.recipe, 'path': os.path.join(upload_folder, row.filename), 'mime_type': row.mime_type}
+
+
+def write_records(records, stream, fmt, fields):
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=fields)
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record)
+        return
+    for record in records:
+        stream.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+IMPORTERS = {'recipes': import_recipes, 'reviews': import_reviews, 'photos': import_photos}
+KINDS = click.Choice(['recipes', 'reviews', 'photos'])
+FORMATS = click.Choice(['jsonl', 'csv'])
+
+
+@click.command('import-data')
+@click.argument('kind', type=KINDS)
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=FORMATS, help='По умолчанию определяется по расширению файла.')
+@click.option('--batch-size', default=1000, show_default=True, help='Число записей в одной транзакции.')
+def import_data_command(kind, path, fmt, batch_size):
+    """Импортирует блюда, отзывы или фотографии из JSONL/CSV."""
+    with open(path, encoding='utf-8', newline='') as stream:
+        added, skipped = IMPORTERS[kind](read_records(stream, _detect_format(path, fmt)), batch_size)
+    click.echo(f'Добавлено: {added}, пропущено: {skipped}.')
+    if kind == 'photos' and added:
+        click.echo('Уменьшенные копии создаются командой flask generate-variants.')
+
+
+@click.command('export-data')
+@click.argument('kind', type=KINDS)
+@click.option('--output', '-o', default='-', help='Файл результата, по умолчанию stdout.')
+@click.option('--format', 'fmt', type=FORMATS, help='По умолчанию определяется по расширению файла.')
+def export_data_command(kind, output, fmt):
+    """Потоково выгружает блюда, отзывы или фотографии в JSONL/CSV."""
+    fmt = _detect_format(output, fmt)
+    exporters = {
+        'recipes': (export_recipes, RECIPE_FIELDS),
+        'reviews': (export_reviews, REVIEW_FIELDS),
+        'photos': (lambda: export_photos(current_app.config['UPLOAD_FOLDER']), PHOTO_FIELDS),
+    }
+    export, fields = exporters[kind]
+    if output == '-':
+        write_records(export(), sys.stdout, fmt, fields)
+        return
+    with open(output, 'w', encoding='utf-8', newline='') as stream:
+        write_records(export(), stream, fmt, fields)